@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import platform
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from cache_store import SenderCacheStore  # noqa: E402
+from message_features import _extract_relevant_headers, _extract_text, _extract_urls  # noqa: E402
+from policy_engine import DomainCacheStore, SpamSenderCacheStore, extract_url_domains, is_obvious_spam  # noqa: E402
+
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+DEFAULT_BASELINE = ROOT / "benchmarks" / "baseline.json"
+# Zoveel verschillende mails; grotere sets herhalen ze zodat 100k mails geen minuten genereren kost.
+DISTINCT_MESSAGES = 2_000
+WORDS = "bestelling verzonden factuur aanbieding korting nieuwsbrief afspraak gratis week update account".split()
+TLDS = ("nl", "com", "de", "be", "co.uk", "xyz", "top")
+SUBJECTS = (
+    "Uw bestelling {n} is verzonden",
+    "Nieuwsbrief week {n}",
+    "Factuur {n} voor uw account",
+    "WIN a free casino bonus now {n}",
+    "Payment completed - receipt copy {n}",
+    "Herinnering: afspraak op {n} mei",
+)
+
+
+def synthetic_domains(count: int, rng: random.Random) -> list[str]:
+    return [f"{rng.choice(WORDS)}{pos}.{rng.choice(TLDS)}" for pos in range(count)]
+
+
+def synthetic_messages(count: int, seed: int = 7) -> list[SimpleNamespace]:
+    # Mix van plain-text en HTML-mails met tracking-links en gangbare authenticatie-headers.
+    rng = random.Random(seed)
+    domains = synthetic_domains(500, rng)
+    distinct = []
+    for pos in range(min(count, DISTINCT_MESSAGES)):
+        domain = rng.choice(domains)
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 120)))
+        links = "".join(
+            f'<a href="https://{rng.choice(["click.", "www.", ""])}{rng.choice(domains)}/t/{rng.randrange(10**8)}">'
+            f"{rng.choice(WORDS)}</a> "
+            for _ in range(rng.randint(1, 15))
+        )
+        html = f"<html><body><div><table><tr><td>{words}</td></tr></table>{links}</div></body></html>"
+        is_html = pos % 3 != 0
+        distinct.append(
+            SimpleNamespace(
+                uid=str(pos),
+                from_=f"Afzender <info@{domain}>",
+                subject=rng.choice(SUBJECTS).format(n=rng.randrange(10**5)),
+                text="" if is_html else f"{words} https://{domain}/info",
+                html=html if is_html else "",
+                headers={
+                    "authentication-results": (
+                        f"mx.example.com; spf=pass smtp.mailfrom={domain}; dkim=pass header.d={domain}; dmarc=pass",
+                    ),
+                    "return-path": (f"<bounce@{domain}>",),
+                    "message-id": (f"<{rng.randrange(10**9)}@{domain}>",),
+                    "list-unsubscribe": (f"<https://{domain}/unsubscribe>",) if pos % 2 else (),
+                    "precedence": ("bulk",) if pos % 4 == 0 else (),
+                },
+            )
+        )
+    return [distinct[pos % len(distinct)] for pos in range(count)]
+
+
+def bench_extract_text(size: int) -> tuple:
+    messages = synthetic_messages(size)
+    return lambda: [_extract_text(msg, 250) for msg in messages], None
+
+
+def bench_extract_urls(size: int) -> tuple:
+    messages = synthetic_messages(size)
+    return lambda: [_extract_urls(msg.text, msg.html) for msg in messages], None
+
+
+def bench_extract_relevant_headers(size: int) -> tuple:
+    messages = synthetic_messages(size)
+    return lambda: [_extract_relevant_headers(msg) for msg in messages], None
+
+
+def bench_is_obvious_spam(size: int) -> tuple:
+    messages = synthetic_messages(size)
+    rows = []
+    for msg in messages:
+        urls = _extract_urls(msg.text, msg.html)
+        rows.append((msg.from_.rsplit("@", 1)[1].strip(">"), msg.subject, _extract_text(msg, 250), extract_url_domains(urls)))
+    return lambda: [is_obvious_spam(*row) for row in rows], None
+
+
+def bench_extract_url_domains(size: int) -> tuple:
+    url_lists = [_extract_urls(msg.text, msg.html) for msg in synthetic_messages(size)]
+    return lambda: [extract_url_domains(urls) for urls in url_lists], None
+
+
+def bench_domain_cache_evaluate(size: int) -> tuple:
+    # size regels in de cache en size lookups: exacte hits, subdomeinen van regels en missers.
+    rng = random.Random(size)
+    domains = synthetic_domains(size, rng)
+    workdir = Path(tempfile.mkdtemp(prefix="bench_domain_cache_"))
+    cache_file = workdir / "domain_cache.json"
+    rules = {domain: {"spam": pos % 5 == 0, "category": None if pos % 5 == 0 else "updates"} for pos, domain in enumerate(domains)}
+    cache_file.write_text(json.dumps(rules), encoding="utf-8")
+    lookups = []
+    for pos in range(size):
+        domain = rng.choice(domains)
+        lookups.append((domain, f"mail.{domain}", f"{domain}-onbekend.{rng.choice(TLDS)}")[pos % 3])
+
+    store = DomainCacheStore(cache_file)
+
+    def run():
+        # Memo leegmaken per meting: anders meet alleen de tweede ronde de dict-lookup.
+        store._resolved.clear()
+        return [store.evaluate(domain) for domain in lookups]
+
+    return run, workdir
+
+
+def bench_sender_cache_save(size: int) -> tuple:
+    workdir = Path(tempfile.mkdtemp(prefix="bench_sender_cache_"))
+    store = SenderCacheStore(workdir / "sender_exact.json", logger=logging.getLogger("bench"), run_logger=None)
+    for pos in range(size):
+        store.update(f"afzender{pos}@domein{pos % 997}.nl", WORDS[pos % len(WORDS)], f"Onderwerp {pos}")
+    return store.save, workdir
+
+
+def bench_spam_cache_save(size: int) -> tuple:
+    workdir = Path(tempfile.mkdtemp(prefix="bench_spam_cache_"))
+    store = SpamSenderCacheStore(workdir / "sender_spam_cache.json")
+    for pos in range(size):
+        store.increment_spam_hit(f"spammer{pos}@rommel{pos % 997}.xyz", f"WIN {pos}")
+    return store.save, workdir
+
+
+CASES = {
+    "extract_text": bench_extract_text,
+    "extract_urls": bench_extract_urls,
+    "extract_relevant_headers": bench_extract_relevant_headers,
+    "is_obvious_spam": bench_is_obvious_spam,
+    "extract_url_domains": bench_extract_url_domains,
+    "domain_cache_evaluate": bench_domain_cache_evaluate,
+    "sender_cache_save": bench_sender_cache_save,
+    "spam_cache_save": bench_spam_cache_save,
+}
+
+
+def measure(run, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_suite(cases: list[str], sizes: list[int], repeat: int) -> dict[str, float]:
+    results = {}
+    for name in cases:
+        for size in sizes:
+            run, workdir = CASES[name](size)
+            seconds = measure(run, repeat)
+            results[f"{name}@{size}"] = round(seconds / size * 1e6, 3)
+            print(f"{name:<26} {size:>7}  {seconds * 1000:9.1f} ms  {results[f'{name}@{size}']:9.2f} us/item", flush=True)
+            if workdir is not None:
+                for path in workdir.iterdir():
+                    path.unlink()
+                workdir.rmdir()
+    return results
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], tolerance: float) -> list[str]:
+    regressions = []
+    for key, value in results.items():
+        reference = baseline.get(key)
+        if reference and value > reference * (1 + tolerance):
+            regressions.append(f"{key}: {value:.2f} us/item, baseline {reference:.2f} (+{value / reference - 1:.0%})")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks voor extractie, policy en caches")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES))
+    parser.add_argument("--cases", default=",".join(CASES), help=f"komma-gescheiden uit: {', '.join(CASES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="toegestane vertraging t.o.v. de baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="resultaten als nieuwe baseline opslaan")
+    args = parser.parse_args()
+
+    cases = [name.strip() for name in args.cases.split(",") if name.strip()]
+    unknown = [name for name in cases if name not in CASES]
+    if unknown:
+        parser.error(f"onbekende benchmark(s): {', '.join(unknown)}")
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+
+    print(f"Python {platform.python_version()} op {platform.machine()}, beste van {args.repeat}")
+    results = run_suite(cases, sizes, max(1, args.repeat))
+
+    baseline = {}
+    if args.baseline.is_file():
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8")).get("results", {})
+
+    if args.update_baseline:
+        merged = {**baseline, **results}
+        args.baseline.write_text(
+            json.dumps(
+                {"python": platform.python_version(), "machine": platform.machine(), "results": dict(sorted(merged.items()))},
+                indent=2,
+            )
+            + "\n",
+            encoding="utf-8",
+        )
+        print(f"Baseline bijgewerkt: {args.baseline}")
+        return 0
+
+    if not baseline:
+        print(f"Geen baseline in {args.baseline}; draai met --update-baseline om er een vast te leggen")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"REGRESSIE (> {args.tolerance:.0%} trager dan baseline):")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"Geen regressies t.o.v. {args.baseline} (tolerantie {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import argparse
+import email
+import random
+import sys
+import time
+from email import policy
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from html_text import stream_html_text  # noqa: E402
+from message_features import WHITESPACE_REGEX, _soup_text  # noqa: E402
+
+
+def soup_text(html: str, max_chars: int) -> str:
+    # Dezelfde BeautifulSoup-fallback als _extract_text in productie.
+    return WHITESPACE_REGEX.sub(" ", _soup_text(html)).strip()[:max_chars]
+
+
+def eml_html(path: Path) -> str | None:
+    msg = email.message_from_bytes(path.read_bytes(), policy=policy.default)
+    part = msg.get_body(preferencelist=("html",))
+    return part.get_content() if part is not None else None
+
+
+def load_corpus(corpus_dir: Path | None) -> list[str]:
+    if corpus_dir is not None:
+        documents = [path.read_text(encoding="utf-8", errors="replace") for path in sorted(corpus_dir.glob("*.htm*"))]
+        # .eml bestanden eerst parsen: alleen het text/html deel telt, niet de headers of base64/quoted-printable.
+        documents.extend(html for html in map(eml_html, sorted(corpus_dir.glob("*.eml"))) if html)
+        if documents:
+            return documents
+        print(f"Geen .html/.eml bestanden in {corpus_dir}; gebruik synthetische nieuwsbrieven")
+    return synthetic_newsletters(200)
+
+
+def synthetic_newsletters(count: int, seed: int = 12) -> list[str]:
+    # Opbouw zoals typische marketingmails: veel inline CSS, geneste tabellen, tracking-links en een lange footer.
+    rng = random.Random(seed)
+    words = "aanbieding korting week nieuw gratis verzending bestel nu alleen vandaag sale collectie".split()
+    documents = []
+    for _ in range(count):
+        style = "".join(f".c{i}{{color:#{rng.randrange(0xFFFFFF):06x};padding:{i}px}}" for i in range(200))
+        rows = []
+        for row in range(rng.randint(20, 80)):
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(5, 30)))
+            rows.append(
+                f'<tr><td class="c{row}" style="font-family:Arial;padding:8px">'
+                f'<table width="100%"><tr><td><a href="https://click.example.nl/t/{rng.randrange(10**9)}">'
+                f"{text}</a>&nbsp;&euro;{rng.randint(5, 500)},-</td></tr></table></td></tr>"
+            )
+        footer = "<p>Je ontvangt deze mail omdat je je hebt aangemeld. Afmelden kan altijd.</p>" * 10
+        documents.append(
+            f"<html><head><style>{style}</style></head><body><table>{''.join(rows)}</table>"
+            f"<script>window.track={rng.randrange(10**6)};</script>{footer}</body></html>"
+        )
+    return documents
+
+
+def measure(func, documents: list[str], max_chars: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for html in documents:
+            func(html, max_chars)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Vergelijk streaming HTML->tekst met BeautifulSoup")
+    parser.add_argument("corpus", nargs="?", type=Path, help="map met nieuwsbrief .html/.eml bestanden")
+    parser.add_argument("--max-chars", type=int, default=250)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    documents = load_corpus(args.corpus)
+    total_kb = sum(len(html) for html in documents) / 1024
+    mismatches = sum(
+        1 for html in documents if stream_html_text(html, args.max_chars) != soup_text(html, args.max_chars)
+    )
+    soup_seconds = measure(soup_text, documents, args.max_chars, args.repeat)
+    stream_seconds = measure(stream_html_text, documents, args.max_chars, args.repeat)
+
+    print(f"Corpus: {len(documents)} mails, {total_kb:.0f} KiB, max_chars={args.max_chars}")
+    print(f"BeautifulSoup: {soup_seconds * 1000:.1f} ms ({soup_seconds / len(documents) * 1e6:.0f} us/mail)")
+    print(f"Streaming:     {stream_seconds * 1000:.1f} ms ({stream_seconds / len(documents) * 1e6:.0f} us/mail)")
+    print(f"Versnelling:   {soup_seconds / max(stream_seconds, 1e-9):.1f}x; afwijkende snippets: {mismatches}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
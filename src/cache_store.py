@@ -1,11 +1,30 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import re
+import time
+from datetime import datetime
 from pathlib import Path
 
 import logging
 
 from logging_setup import RunLogger
+from payload_format import signal_fields
+
+
+FINGERPRINT_SIGNALS = (
+    "spf",
+    "dkim",
+    "dmarc",
+    "return_path_domain",
+    "message_id_domain",
+    "list_id",
+    "list_unsubscribe",
+    "precedence",
+    "x_spam_flag",
+)
+DKIM_DOMAIN_REGEX = re.compile(r"(?:^|[\s;])d=([a-z0-9.-]+)", re.IGNORECASE)
 
 
 class SenderCacheStore:
@@ -41,6 +60,9 @@ class SenderCacheStore:
         with self.cache_file.open("w", encoding="utf-8") as f:
             json.dump(self._data, f, indent=2, ensure_ascii=False)
 
+    def items(self):
+        return iter(list(self._data.items()))
+
     def _load_and_upgrade(self) -> dict[str, dict[str, str]]:
         if self.cache_file.is_file():
             with self.cache_file.open("r", encoding="utf-8") as f:
@@ -73,3 +95,266 @@ class SenderCacheStore:
                 json.dump(upgraded, f, indent=2, ensure_ascii=False)
 
         return upgraded
+
+
+class ImapWatermarkStore:
+    def __init__(self, cache_file: Path, run_logger: RunLogger | None = None) -> None:
+        self.cache_file = cache_file
+        self.run_logger = run_logger
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self._data = self._load()
+
+    def _load(self) -> dict[str, dict[str, int]]:
+        if not self.cache_file.is_file():
+            return {}
+        try:
+            with self.cache_file.open("r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except Exception:
+            return {}
+        if not isinstance(raw, dict):
+            return {}
+
+        data = {}
+        for folder, value in raw.items():
+            if not isinstance(value, dict):
+                continue
+            try:
+                data[str(folder)] = {
+                    "uidvalidity": int(value.get("uidvalidity", 0) or 0),
+                    "last_uid": int(value.get("last_uid", 0) or 0),
+                }
+                deferred = sorted({int(uid) for uid in value.get("deferred") or []})
+            except (TypeError, ValueError):
+                continue
+            if deferred:
+                data[str(folder)]["deferred"] = deferred
+        return data
+
+    def save(self) -> None:
+        with self.cache_file.open("w", encoding="utf-8") as f:
+            json.dump(self._data, f, indent=2, ensure_ascii=False)
+
+    def last_uid(self, folder: str, uidvalidity: int) -> int | None:
+        entry = self._data.get(folder)
+        if not entry:
+            return None
+        if entry.get("uidvalidity") != uidvalidity:
+            if self.run_logger:
+                self.run_logger.event(
+                    "watermark_reset",
+                    f"{folder}: UIDVALIDITY {entry.get('uidvalidity')} -> {uidvalidity}",
+                )
+            return None
+        return entry.get("last_uid", 0)
+
+    def advance(self, folder: str, uidvalidity: int, uid: int) -> None:
+        entry = self._data.get(folder)
+        if not entry or entry.get("uidvalidity") != uidvalidity:
+            entry = {"uidvalidity": uidvalidity, "last_uid": 0}
+            self._data[folder] = entry
+        entry["last_uid"] = max(entry["last_uid"], int(uid))
+
+    def deferred_uids(self, folder: str, uidvalidity: int) -> list[int]:
+        entry = self._data.get(folder)
+        if not entry or entry.get("uidvalidity") != uidvalidity:
+            return []
+        return list(entry.get("deferred", []))
+
+    def defer(self, folder: str, uidvalidity: int, uids) -> None:
+        # Uitgestelde mails liggen onder het watermark; deze lijst haalt ze in een volgende run terug.
+        if not uids:
+            return
+        self.advance(folder, uidvalidity, 0)
+        entry = self._data[folder]
+        entry["deferred"] = sorted(set(entry.get("deferred", [])) | {int(uid) for uid in uids})
+
+    def resolve_deferred(self, folder: str, uidvalidity: int, uids) -> None:
+        entry = self._data.get(folder)
+        if not entry or entry.get("uidvalidity") != uidvalidity or not entry.get("deferred"):
+            return
+        remaining = sorted(set(entry["deferred"]) - {int(uid) for uid in uids})
+        if remaining:
+            entry["deferred"] = remaining
+        else:
+            entry.pop("deferred")
+
+
+def verdict_namespace(model: str, *prompts: str) -> str:
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for prompt in prompts:
+        digest.update(b"\0")
+        digest.update(hashlib.sha256((prompt or "").encode("utf-8")).digest())
+    return digest.hexdigest()[:16]
+
+
+def stable_header_signals(payload: dict) -> dict[str, str]:
+    # VERP Return-Paths, DKIM b=/bh= en X-Spam-Status scores verschillen per mail; alleen domeinen en verdicts blijven.
+    signals = signal_fields(payload)
+    headers = payload.get("headers") or {}
+    stable = {name: signals[name] for name in FINGERPRINT_SIGNALS if signals[name]}
+    dkim_domain = DKIM_DOMAIN_REGEX.search(str(headers.get("dkim") or ""))
+    if dkim_domain:
+        stable["dkim_domain"] = dkim_domain.group(1).lower()
+    if headers.get("x_mailer"):
+        stable["x_mailer"] = str(headers["x_mailer"])
+    return stable
+
+
+def payload_fingerprint(payload: dict) -> str:
+    # Alleen inhoud die het oordeel bepaalt; index, datum, ontvangers en Message-ID verschillen per mail.
+    sender = str(payload.get("from") or "").lower()
+    headers = stable_header_signals(payload)
+    normalized = {
+        "from_domain": sender.rsplit("@", 1)[-1].strip(" >") if "@" in sender else sender,
+        "subject": " ".join(str(payload.get("subject") or "").split()),
+        "body": " ".join(str(payload.get("body_snippet") or "").split()),
+        "urls": sorted(set(payload.get("urls") or [])),
+        "headers": headers,
+    }
+    raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class VerdictCacheStore:
+    def __init__(
+        self,
+        cache_file: Path,
+        namespace: str,
+        ttl_days: int,
+        max_entries: int,
+        run_logger: RunLogger | None = None,
+    ) -> None:
+        self.cache_file = cache_file
+        self.namespace = namespace
+        self.ttl_seconds = ttl_days * 86400
+        self.max_entries = max_entries
+        self.run_logger = run_logger
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self._dirty = False
+        self._data = self._load()
+
+    def _load(self) -> dict[str, dict]:
+        if not self.cache_file.is_file():
+            return {}
+        try:
+            with self.cache_file.open("r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except Exception:
+            return {}
+        if not isinstance(raw, dict) or not isinstance(raw.get("entries"), dict):
+            return {}
+        if raw.get("namespace") != self.namespace:
+            # Ander model of gewijzigde prompts: oude oordelen gelden niet meer.
+            if self.run_logger:
+                self.run_logger.event("verdict_cache_reset", f"namespace {raw.get('namespace')} -> {self.namespace}")
+            self._dirty = True
+            return {}
+        return {key: value for key, value in raw["entries"].items() if isinstance(value, dict)}
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        with self.cache_file.open("w", encoding="utf-8") as f:
+            json.dump({"namespace": self.namespace, "entries": self._data}, f, ensure_ascii=False)
+        self._dirty = False
+
+    def get(self, key: str, now: float | None = None) -> str | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        now = time.time() if now is None else now
+        if self.ttl_seconds and now - float(entry.get("created", 0)) > self.ttl_seconds:
+            self._data.pop(key, None)
+            self._dirty = True
+            return None
+        # Dict-volgorde is de LRU-volgorde: een hit gaat naar achteren.
+        self._data[key] = self._data.pop(key)
+        self._dirty = True
+        return str(entry.get("categorie") or "") or None
+
+    def put(self, key: str, categorie: str, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        self._data.pop(key, None)
+        self._data[key] = {"categorie": categorie, "created": int(now)}
+        self._dirty = True
+        while len(self._data) > self.max_entries:
+            self._data.pop(next(iter(self._data)))
+
+
+MONTHS = (
+    "jan|januari|january|feb|februari|february|mrt|maart|mar|march|apr|april|mei|may|jun|juni|june|jul|juli|july|"
+    "aug|augustus|august|sep|sept|september|okt|oktober|oct|october|nov|november|dec|december"
+)
+TEMPLATE_MASKS = (
+    # Alleen quotes op woordgrenzen: apostrofs in "don't" of "john's" zijn geen geciteerde naam.
+    (re.compile(r"(?<!\w)['\"‘“].+?['\"’”](?!\w)|«[^»]+»"), "<q>"),
+    (re.compile(r"\b\d{4}[-/.]\d{1,2}[-/.]\d{1,2}\b|\b\d{1,2}[-/.]\d{1,2}(?:[-/.]\d{2,4})?\b"), "<date>"),
+    (re.compile(rf"\b\d{{1,2}}\s+(?:{MONTHS})\.?(?:\s+\d{{4}})?\b|\b(?:{MONTHS})\.?\s+\d{{1,2}}(?:,?\s+\d{{4}})?\b"), "<date>"),
+    (re.compile(r"\b(?=[0-9a-f]*\d)(?=[0-9a-f]*[a-f])[0-9a-f]{6,}\b|\b[0-9a-f]{8}-[0-9a-f-]{27}\b"), "<id>"),
+    (re.compile(r"\d+(?:[.,]\d+)*"), "<n>"),
+)
+
+
+def subject_template(subject: str) -> str:
+    template = " ".join((subject or "").lower().split())
+    for pattern, mask in TEMPLATE_MASKS:
+        template = pattern.sub(mask, template)
+    return template
+
+
+class SubjectTemplateCacheStore:
+    def __init__(self, cache_file: Path, min_votes: int, run_logger: RunLogger | None = None) -> None:
+        self.cache_file = cache_file
+        self.min_votes = min_votes
+        self.run_logger = run_logger
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self._dirty = False
+        self._data = self._load()
+
+    def _load(self) -> dict[str, dict]:
+        if not self.cache_file.is_file():
+            return {}
+        try:
+            with self.cache_file.open("r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except Exception:
+            return {}
+        if not isinstance(raw, dict):
+            return {}
+        return {key: value for key, value in raw.items() if isinstance(value, dict) and isinstance(value.get("votes"), dict)}
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        with self.cache_file.open("w", encoding="utf-8") as f:
+            json.dump(self._data, f, indent=2, ensure_ascii=False)
+        self._dirty = False
+
+    @staticmethod
+    def key(domain: str, subject: str) -> str | None:
+        template = subject_template(subject)
+        if not domain or not template:
+            return None
+        return f"{domain.lower()}|{template}"
+
+    def get(self, domain: str, subject: str) -> str | None:
+        key = self.key(domain, subject)
+        entry = self._data.get(key) if key else None
+        if not entry:
+            return None
+        votes = entry["votes"]
+        # Alleen antwoorden als alle stemmen het eens zijn; een afwijkend oordeel maakt het template onbetrouwbaar.
+        if len(votes) != 1:
+            return None
+        categorie, count = next(iter(votes.items()))
+        return categorie if int(count) >= self.min_votes else None
+
+    def vote(self, domain: str, subject: str, categorie: str) -> None:
+        key = self.key(domain, subject)
+        if not key:
+            return
+        entry = self._data.setdefault(key, {"votes": {}, "example": subject})
+        entry["votes"][categorie] = int(entry["votes"].get(categorie, 0)) + 1
+        entry["last_seen"] = datetime.now().date().isoformat()
+        self._dirty = True
@@ -1,17 +1,33 @@
 from __future__ import annotations
 
 import json
-import re
+import time
 from pathlib import Path
 
-from bs4 import BeautifulSoup
-from openai import OpenAI
+from openai import OpenAI, OpenAIError, RateLimitError
 
 from config import Settings
+from llm_dispatch import (
+    DEFERRED,
+    OUTPUT_TOKENS_PER_MAIL,
+    CircuitBreaker,
+    TokenBucketLimiter,
+    backoff_delay,
+    estimate_tokens,
+    retry_after_seconds,
+)
 from logging_setup import RunLogger
+from message_features import MessageFeatures, extract_features
+from metrics import metrics
+from payload_format import encode_payloads
 
 
-URL_REGEX = re.compile(r"(https?://[^\s\"'>)]+)", re.IGNORECASE)
+# Alleen fouten van het endpoint tellen voor retry, uitstel en circuit breaker; lokale fouten gaan gewoon omhoog.
+ENDPOINT_ERRORS = (OpenAIError, TimeoutError, ConnectionError)
+
+
+class _EndpointFailure(Exception):
+    pass
 
 
 class EmailClassifier:
@@ -21,9 +37,16 @@ class EmailClassifier:
         self.run_logger = run_logger
         self.system_prompt = _read_prompt(settings.system_prompt_file)
         self.classify_prompt = _read_prompt(settings.classify_prompt_file)
-        self.client = OpenAI(api_key=settings.openai_api_key) if settings.openai_api_key else None
-
-    def batch_classify(self, batch: list) -> dict[int, str] | None:
+        _validate_classify_prompt(self.classify_prompt, settings.classify_prompt_file, settings.llm_payload_format)
+        self.allowed_categories = parse_allowed_categories(self.system_prompt)
+        # Geen SDK-retries: 429 en 5xx lopen alleen via de eigen Retry-After, token bucket, backoff en breaker.
+        self.client = OpenAI(api_key=settings.openai_api_key, max_retries=0) if settings.openai_api_key else None
+        self.rate_limiter = (
+            TokenBucketLimiter(settings.llm_rpm, settings.llm_tpm) if settings.llm_rpm or settings.llm_tpm else None
+        )
+        self.circuit_breaker = CircuitBreaker(settings.llm_breaker_failures, settings.llm_breaker_reset_seconds)
+
+    def batch_classify(self, batch: list, on_result=None) -> dict[int, str] | None:
         if not batch:
             return {}
         if self.client is None:
@@ -31,29 +54,124 @@ class EmailClassifier:
             self.logger.error("OPENAI_API_KEY ontbreekt; GPT classificatie overgeslagen")
             return None
 
-        try:
-            email_list = self._build_payload(batch)
-            json_data = json.dumps(email_list, ensure_ascii=False)
+        # Alleen indices die ontbreken of een ongeldige categorie hebben gaan opnieuw naar de LLM.
+        results: dict[int, str] = {}
+        missing = list(range(len(batch)))
+        endpoint_failed = False
+        for attempt in range(self.settings.llm_retry_attempts + 1):
+            if not self.circuit_breaker.allow():
+                endpoint_failed = True
+                self.run_logger.event("gpt_circuit_open", f"{len(missing)} mails uitgesteld")
+                break
+            if attempt:
+                delay = backoff_delay(attempt - 1, self.settings.llm_retry_base_seconds, self.settings.llm_retry_max_seconds)
+                self.run_logger.event("gpt_retry", f"{len(missing)} mails opnieuw over {delay:.1f}s (poging {attempt + 1})")
+                time.sleep(delay)
+
+            def accept(local_idx: int, category: str, asked: list[int] = missing) -> None:
+                if not 0 <= local_idx < len(asked) or not self._is_allowed(category) or asked[local_idx] in results:
+                    return
+                results[asked[local_idx]] = category
+                if on_result is not None:
+                    on_result(asked[local_idx], category)
+
+            answered = self._classify_once([batch[idx] for idx in missing], accept)
+            if answered is None:
+                endpoint_failed = True
+                if self.circuit_breaker.record_failure():
+                    self.run_logger.event("gpt_circuit_open", f"{self.settings.llm_breaker_failures} fouten op rij")
+                    self.logger.warning(
+                        "GPT circuit breaker open; nieuwe calls over %.0fs", self.settings.llm_breaker_reset_seconds
+                    )
+            else:
+                endpoint_failed = False
+                self.circuit_breaker.record_success()
+            # Bij streaming kunnen ook uit een afgebroken antwoord al oordelen binnen zijn.
+            missing = [idx for idx in missing if idx not in results]
+            if not missing:
+                break
+
+        if missing and endpoint_failed:
+            # Niet als onbekend labelen: de mails blijven staan en komen in een volgende run terug.
+            for idx in missing:
+                results[idx] = DEFERRED
+            self.logger.warning("GPT onbereikbaar; %s mails uitgesteld", len(missing))
+        return results
+
+    def _is_allowed(self, category: str) -> bool:
+        return bool(category) and (not self.allowed_categories or category in self.allowed_categories)
+
+    def _classify_once(self, batch: list, accept) -> dict[int, str] | None:
+        email_list = self._build_payload(batch)
+        json_data = json.dumps(email_list, ensure_ascii=False)
+        if self.settings.llm_payload_format == "compact":
+            user_prompt = self.classify_prompt.format(emails=encode_payloads(email_list, "compact"))
+        else:
             user_prompt = self.classify_prompt.format(emails_json=json_data)
-            self.run_logger.gpt_payload(json_data, user_prompt)
-            self.run_logger.event("gpt_call", f"Batch size={len(batch)}")
-
-            response = self.client.chat.completions.create(
-                model=self.settings.gpt_model,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-            )
-
-            raw = (response.choices[0].message.content or "").strip()
-            results = self._parse_results(raw)
-            self.run_logger.event("gpt_ok", f"Classified {len(results)}/{len(batch)} mails")
-            return results
-        except Exception as exc:
-            self.run_logger.event("gpt_exception", str(exc))
-            self.logger.exception("GPT classificatie fout")
+        # Het JSON-deel blijft gelogd zodat payload_format.py oud en compact formaat kan vergelijken.
+        self.run_logger.gpt_payload(json_data, user_prompt)
+        self.run_logger.event("gpt_call", f"Batch size={len(batch)}")
+
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        expected_tokens = estimate_tokens(self.system_prompt + user_prompt) + OUTPUT_TOKENS_PER_MAIL * len(batch)
+        started = time.perf_counter()
+        results: dict[int, str] = {}
+        try:
+            # accept draait buiten de endpoint-afhandeling: een fout bij het verplaatsen is geen LLM-storing.
+            for line in self._response_lines(messages, expected_tokens):
+                parsed = self._parse_line(line)
+                if parsed is not None and parsed[0] not in results:
+                    results[parsed[0]] = parsed[1]
+                    accept(*parsed)
+        except _EndpointFailure as exc:
+            self.run_logger.event("gpt_exception", str(exc.__cause__))
+            self.logger.error("GPT endpoint fout: %s", exc.__cause__)
             return None
+        metrics.observe("llm_request", time.perf_counter() - started)
+        self.run_logger.event("gpt_ok", f"Classified {len(results)}/{len(batch)} mails")
+        return results
+
+    def _response_lines(self, messages: list[dict], expected_tokens: int):
+        try:
+            if self.settings.llm_stream:
+                # Elke complete regel gaat direct door, terwijl de rest van het antwoord nog gegenereerd wordt.
+                yield from _stream_lines(self._create_with_rate_limit(messages, expected_tokens, stream=True))
+                return
+            response = self._create_with_rate_limit(messages, expected_tokens)
+        except ENDPOINT_ERRORS as exc:
+            raise _EndpointFailure() from exc
+        metrics.record_usage(getattr(response, "usage", None))
+        raw = (response.choices[0].message.content or "").strip() if response.choices else ""
+        yield from raw.splitlines()
+
+    def _create_with_rate_limit(self, messages: list[dict], expected_tokens: int, stream: bool = False):
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(expected_tokens)
+            try:
+                if stream:
+                    return self.client.chat.completions.create(
+                        model=self.settings.gpt_model,
+                        messages=messages,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    )
+                return self.client.chat.completions.create(model=self.settings.gpt_model, messages=messages)
+            except RateLimitError as exc:
+                attempt += 1
+                if attempt > self.settings.llm_rate_limit_retries:
+                    raise
+                wait = retry_after_seconds(exc, default=float(2**attempt))
+                self.run_logger.event("gpt_rate_limited", f"429; opnieuw over {wait:.1f}s (poging {attempt})")
+                self.logger.warning("GPT rate limit (429); opnieuw over %.1fs", wait)
+                if self.rate_limiter is not None:
+                    self.rate_limiter.block_for(wait)
+                else:
+                    time.sleep(wait)
 
     def _build_payload(self, batch: list) -> list[dict]:
         payload = []
@@ -61,35 +179,39 @@ class EmailClassifier:
             payload.append(self.build_email_payload(msg, idx))
         return payload
 
+    def build_features(self, msg) -> MessageFeatures:
+        if isinstance(msg, MessageFeatures):
+            return msg
+        with metrics.timer("extract"):
+            return extract_features(msg, self.settings.max_body_chars)
+
     def build_email_payload(self, msg, index: int = 0) -> dict:
-        body_snippet = _extract_text(msg, self.settings.max_body_chars)
-        html_raw = msg.html or ""
-        return {
-            "index": index,
-            "subject": msg.subject or "",
-            "from": msg.from_,
-            "to": msg.to,
-            "cc": msg.cc,
-            "date": msg.date.isoformat() if msg.date else "",
-            "body_snippet": body_snippet,
-            "urls": _extract_urls(body_snippet, html_raw),
-            "headers": _extract_relevant_headers(msg),
-        }
+        return self.build_features(msg).to_payload(index)
 
     @staticmethod
-    def _parse_results(raw: str) -> dict[int, str]:
-        results: dict[int, str] = {}
-        for line in raw.splitlines():
-            if not line.lower().startswith("index="):
-                continue
-            try:
-                part1, part2 = line.split(";")
-                idx = int(part1.split("=")[1].strip())
-                cat = part2.split("=")[1].strip().lower()
-                results[idx] = cat
-            except Exception:
-                continue
-        return results
+    def _parse_line(line: str) -> tuple[int, str] | None:
+        line = line.strip()
+        if not line.lower().startswith("index="):
+            return None
+        try:
+            part1, part2 = line.split(";")
+            return int(part1.split("=")[1].strip()), part2.split("=")[1].strip().lower()
+        except Exception:
+            return None
+
+
+def _stream_lines(stream):
+    buffer = ""
+    for chunk in stream:
+        # Met include_usage komt het tokengebruik in een laatste chunk zonder choices.
+        metrics.record_usage(getattr(chunk, "usage", None))
+        if not chunk.choices:
+            continue
+        buffer += chunk.choices[0].delta.content or ""
+        *lines, buffer = buffer.split("\n")
+        yield from lines
+    if buffer:
+        yield buffer
 
 
 def _read_prompt(path: Path) -> str:
@@ -97,76 +219,33 @@ def _read_prompt(path: Path) -> str:
         return f.read()
 
 
-def _extract_text(msg, max_chars: int) -> str:
-    body = msg.text or msg.html or ""
-    is_html = any(tag in body.lower() for tag in ("<html", "<body", "<div", "<table", "<span"))
-
-    if is_html:
-        try:
-            soup = BeautifulSoup(body, "html.parser")
-            for node in soup(("script", "style")):
-                node.extract()
-            text = soup.get_text(" ")
-        except Exception:
-            text = body
-    else:
-        text = body
-
-    text = re.sub(r"\s+", " ", text).strip()
-    return text[:max_chars]
-
-
-def _extract_urls(body: str, html: str) -> list[str]:
-    urls = set()
-    for match in URL_REGEX.findall(body or ""):
-        urls.add(match.strip())
-    if html:
-        for match in re.findall(r'href=["\']([^"\']+)["\']', html, flags=re.IGNORECASE):
-            urls.add(match.strip())
-    return list(urls)
-
-
-def _extract_relevant_headers(msg) -> dict[str, str]:
-    headers = msg.headers
-
-    def norm(value) -> str:
-        if not value:
-            return ""
-        return str(value).strip().lower()
-
-    def first_header(*names: str) -> str:
-        for name in names:
-            values = headers.get(name.lower())
-            if not values:
-                continue
-            if isinstance(values, (tuple, list)):
-                flattened = [str(v).strip() for v in values if str(v).strip()]
-                if flattened:
-                    return "; ".join(flattened)
-            else:
-                value = str(values).strip()
-                if value:
-                    return value
-        return ""
-
-    auth_results = first_header("Authentication-Results")
-
-    def auth_result(name: str) -> str:
-        if not auth_results:
-            return ""
-        match = re.search(rf"\b{re.escape(name)}\s*=\s*([a-z0-9_-]+)", auth_results, flags=re.IGNORECASE)
-        return match.group(1) if match else ""
-
-    return {
-        "spf": norm(auth_result("spf") or first_header("Received-SPF")),
-        "dkim": norm(auth_result("dkim") or first_header("DKIM-Signature")),
-        "dmarc": norm(auth_result("dmarc") or first_header("DMARC-Filter")),
-        "return_path": norm(first_header("Return-Path")),
-        "message_id": norm(first_header("Message-ID")),
-        "list_id": norm(first_header("List-ID")),
-        "list_unsubscribe": norm(first_header("List-Unsubscribe")),
-        "precedence": norm(first_header("Precedence")),
-        "x_mailer": norm(first_header("X-Mailer")),
-        "x_spam_flag": norm(first_header("X-Spam-Flag")),
-        "x_spam_status": norm(first_header("X-Spam-Status")),
-    }
+def _validate_classify_prompt(prompt: str, path: Path, payload_format: str) -> None:
+    placeholder = "emails" if payload_format == "compact" else "emails_json"
+    # Proef-format: een verkeerde of extra placeholder geeft anders pas per batch een KeyError.
+    try:
+        prompt.format(**{placeholder: ""})
+    except (KeyError, IndexError, ValueError) as exc:
+        raise ValueError(
+            f"CLASSIFY_PROMPT_FILE {path} past niet bij LLM_PAYLOAD_FORMAT={payload_format}: "
+            f"verwacht placeholder {{{placeholder}}} ({exc!r})"
+        ) from exc
+    if f"{{{placeholder}}}" not in prompt:
+        raise ValueError(
+            f"CLASSIFY_PROMPT_FILE {path} mist placeholder {{{placeholder}}} voor LLM_PAYLOAD_FORMAT={payload_format}"
+        )
+
+
+def parse_allowed_categories(system_prompt: str) -> set[str]:
+    # De lijst onder "Toegestane categorieën" in de system prompt is leidend; zonder lijst wordt niets afgekeurd.
+    categories: set[str] = set()
+    in_list = False
+    for line in system_prompt.splitlines():
+        stripped = line.strip()
+        if stripped.lower().startswith("toegestane categorie"):
+            in_list = True
+            continue
+        if in_list:
+            if not stripped:
+                break
+            categories.add(stripped.lower())
+    return categories
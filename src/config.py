@@ -19,6 +19,16 @@ def _env_bool(name: str, default: bool) -> bool:
     return raw.strip().lower() in {"1", "true", "yes", "y", "on"}
 
 
+def _env_float(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        return default
+
+
 def _env_int(name: str, default: int) -> int:
     raw = os.getenv(name)
     if raw is None:
@@ -34,12 +44,20 @@ class Settings:
     project_root: Path
     prompts_dir: Path
     log_dir: Path
+    metrics_textfile_dir: Path
     cache_dir: Path
     cache_file: Path
     domain_cache_file: Path
     sender_spam_cache_file: Path
+    watermark_file: Path
+    verdict_cache_file: Path
+    cache_db_file: Path
+    domain_candidates_file: Path
+    template_cache_file: Path
+    local_model_file: Path
     system_prompt_file: Path
     classify_prompt_file: Path
+    guardrail_rules_file: Path
     runstamp: str
 
     imap_host: str
@@ -52,13 +70,53 @@ class Settings:
     date_to: str
     batch_size: int
     chunk_days: int
+    fetch_strategy: str
+    fetch_slice_size: int
+    fetch_slice_max_bytes: int
+    incremental: bool
+    llm_concurrency: int
+    llm_rpm: int
+    llm_tpm: int
+    llm_rate_limit_retries: int
+    llm_retry_attempts: int
+    llm_retry_base_seconds: float
+    llm_retry_max_seconds: float
+    llm_breaker_failures: int
+    llm_breaker_reset_seconds: float
+    llm_batch_tokens: int
+    llm_batch_max_wait: float
+    llm_context_tokens: int
+    llm_max_output_tokens: int
+    llm_payload_format: str
+    llm_stream: bool
+    llm_coalesce: bool
+    pipeline: bool
+    pipeline_queue_size: int
+    daemon_max_latency: int
+    daemon_keepalive_seconds: int
+    daemon_reconnect_max_seconds: int
     max_body_chars: int
     log_gpt_payload: bool
     log_to_console: bool
+    log_flush_bytes: int
+    log_flush_seconds: float
+    log_writer_thread: bool
     use_spam_sender_cache: bool
     spam_hits_threshold: int
+    cache_backend: str
+    use_verdict_cache: bool
+    verdict_cache_ttl_days: int
+    verdict_cache_max_entries: int
+    use_template_cache: bool
+    template_cache_min_votes: int
+    use_local_model: bool
+    local_model_threshold: float
+    local_model_min_rows: int
+    local_model_retrain_hours: float
     imap_move_by_category: bool
     imap_category_prefix: str
+    imap_headers_first: bool
+    imap_partial_body: bool
 
 
 def load_settings() -> Settings:
@@ -68,7 +126,9 @@ def load_settings() -> Settings:
 
     cache_file = Path(os.getenv("CACHE_FILE", str(cache_dir / "sender_exact.json")))
     system_prompt_file = Path(os.getenv("SYSTEM_PROMPT_FILE", str(prompts_dir / "system_prompt.txt")))
-    classify_prompt_file = Path(os.getenv("CLASSIFY_PROMPT_FILE", str(prompts_dir / "classify_prompt.txt")))
+    llm_payload_format = os.getenv("LLM_PAYLOAD_FORMAT", "json").strip().lower()
+    default_classify_prompt = "classify_prompt_compact.txt" if llm_payload_format == "compact" else "classify_prompt.txt"
+    classify_prompt_file = Path(os.getenv("CLASSIFY_PROMPT_FILE", str(prompts_dir / default_classify_prompt)))
 
     runstamp = os.getenv("RUNSTAMP") or datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
@@ -76,12 +136,22 @@ def load_settings() -> Settings:
         project_root=PROJECT_ROOT,
         prompts_dir=prompts_dir,
         log_dir=log_dir,
+        metrics_textfile_dir=Path(os.getenv("METRICS_TEXTFILE_DIR", str(log_dir))),
         cache_dir=cache_dir,
         cache_file=cache_file,
         domain_cache_file=Path(os.getenv("DOMAIN_CACHE_FILE", str(cache_dir / "domain_cache.json"))),
         sender_spam_cache_file=Path(os.getenv("SENDER_SPAM_CACHE_FILE", str(cache_dir / "sender_spam_cache.json"))),
+        watermark_file=Path(os.getenv("WATERMARK_FILE", str(cache_dir / "imap_watermark.json"))),
+        verdict_cache_file=Path(os.getenv("VERDICT_CACHE_FILE", str(cache_dir / "llm_verdicts.json"))),
+        cache_db_file=Path(os.getenv("CACHE_DB_FILE", str(cache_dir / "caches.sqlite3"))),
+        domain_candidates_file=Path(os.getenv("DOMAIN_CANDIDATES_FILE", str(cache_dir / "domain_candidates.json"))),
+        template_cache_file=Path(os.getenv("TEMPLATE_CACHE_FILE", str(cache_dir / "subject_templates.json"))),
+        local_model_file=Path(os.getenv("LOCAL_MODEL_FILE", str(cache_dir / "local_model.npz"))),
         system_prompt_file=system_prompt_file,
         classify_prompt_file=classify_prompt_file,
+        guardrail_rules_file=Path(
+            os.getenv("GUARDRAIL_RULES_FILE", str(PROJECT_ROOT / "config" / "guardrail_rules.json"))
+        ),
         runstamp=runstamp,
         imap_host=os.getenv("IMAP_HOST", ""),
         imap_user=os.getenv("IMAP_USER", ""),
@@ -92,18 +162,62 @@ def load_settings() -> Settings:
         date_to=os.getenv("DATE_TO", "2025-01-08"),
         batch_size=max(1, _env_int("BATCH_SIZE", 30)),
         chunk_days=max(1, _env_int("CHUNK_DAYS", 3)),
+        fetch_strategy=os.getenv("FETCH_STRATEGY", "days").strip().lower(),
+        fetch_slice_size=max(1, _env_int("FETCH_SLICE_SIZE", 150)),
+        fetch_slice_max_bytes=max(0, _env_int("FETCH_SLICE_MAX_BYTES", 25_000_000)),
+        incremental=_env_bool("INCREMENTAL", False),
+        llm_concurrency=max(1, _env_int("LLM_CONCURRENCY", 1)),
+        llm_rpm=max(0, _env_int("LLM_RPM", 0)),
+        llm_tpm=max(0, _env_int("LLM_TPM", 0)),
+        llm_rate_limit_retries=max(0, _env_int("LLM_RATE_LIMIT_RETRIES", 3)),
+        llm_retry_attempts=max(0, _env_int("LLM_RETRY_ATTEMPTS", 2)),
+        llm_retry_base_seconds=max(0.0, _env_float("LLM_RETRY_BASE_SECONDS", 1.0)),
+        llm_retry_max_seconds=max(0.0, _env_float("LLM_RETRY_MAX_SECONDS", 30.0)),
+        llm_breaker_failures=max(1, _env_int("LLM_BREAKER_FAILURES", 3)),
+        llm_breaker_reset_seconds=max(0.0, _env_float("LLM_BREAKER_RESET_SECONDS", 300.0)),
+        llm_batch_tokens=max(0, _env_int("LLM_BATCH_TOKENS", 0)),
+        llm_batch_max_wait=max(0.0, _env_float("LLM_BATCH_MAX_WAIT", 2.0)),
+        llm_context_tokens=max(1000, _env_int("LLM_CONTEXT_TOKENS", 128000)),
+        llm_max_output_tokens=max(100, _env_int("LLM_MAX_OUTPUT_TOKENS", 16384)),
+        llm_payload_format=llm_payload_format,
+        llm_stream=_env_bool("LLM_STREAM", False),
+        llm_coalesce=_env_bool("LLM_COALESCE", True),
+        pipeline=_env_bool("PIPELINE", False),
+        pipeline_queue_size=max(1, _env_int("PIPELINE_QUEUE_SIZE", 4)),
+        daemon_max_latency=max(0, _env_int("DAEMON_MAX_LATENCY", 5)),
+        daemon_keepalive_seconds=max(30, _env_int("DAEMON_KEEPALIVE_SECONDS", 300)),
+        daemon_reconnect_max_seconds=max(1, _env_int("DAEMON_RECONNECT_MAX_SECONDS", 300)),
         max_body_chars=max(50, _env_int("MAX_BODY_CHARS", 250)),
         log_gpt_payload=_env_bool("LOG_GPT_PAYLOAD", True),
         log_to_console=_env_bool("LOG_TO_CONSOLE", True),
+        log_flush_bytes=max(0, _env_int("LOG_FLUSH_BYTES", 65536)),
+        log_flush_seconds=max(0.0, _env_float("LOG_FLUSH_SECONDS", 2.0)),
+        log_writer_thread=_env_bool("LOG_WRITER_THREAD", False),
         use_spam_sender_cache=_env_bool("USE_SPAM_SENDER_CACHE", True),
         spam_hits_threshold=max(1, _env_int("SPAM_HITS_THRESHOLD", 2)),
+        cache_backend=os.getenv("CACHE_BACKEND", "json").strip().lower(),
+        use_verdict_cache=_env_bool("USE_VERDICT_CACHE", False),
+        verdict_cache_ttl_days=max(0, _env_int("VERDICT_CACHE_TTL_DAYS", 30)),
+        verdict_cache_max_entries=max(1, _env_int("VERDICT_CACHE_MAX_ENTRIES", 50000)),
+        use_template_cache=_env_bool("USE_TEMPLATE_CACHE", False),
+        template_cache_min_votes=max(1, _env_int("TEMPLATE_CACHE_MIN_VOTES", 3)),
+        use_local_model=_env_bool("USE_LOCAL_MODEL", False),
+        local_model_threshold=_env_float("LOCAL_MODEL_THRESHOLD", 0.97),
+        local_model_min_rows=max(1, _env_int("LOCAL_MODEL_MIN_ROWS", 200)),
+        local_model_retrain_hours=max(0.0, _env_float("LOCAL_MODEL_RETRAIN_HOURS", 24.0)),
         imap_move_by_category=_env_bool("IMAP_MOVE_BY_CATEGORY", False),
         imap_category_prefix=os.getenv("IMAP_CATEGORY_PREFIX", "AI/"),
+        imap_headers_first=_env_bool("IMAP_HEADERS_FIRST", False),
+        imap_partial_body=_env_bool("IMAP_PARTIAL_BODY", False),
     )
     _validate_required(settings)
     return settings
 
 
+def headers_first_enabled(settings: Settings) -> bool:
+    return settings.imap_headers_first or settings.imap_partial_body
+
+
 def _validate_required(settings: Settings) -> None:
     missing = []
     if not settings.imap_host:
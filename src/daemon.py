@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import time
+
+from imap_tools import MailBox
+
+from cache_store import ImapWatermarkStore
+from classifier import EmailClassifier
+from config import headers_first_enabled, load_settings
+from imap_mover import CategoryMover
+from imap_reader import folder_uidvalidity, stream_uid_slices
+from logging_setup import RunLogger, setup_app_logger
+from metrics import metrics, report_metrics
+from main import (
+    log_local_model_summary,
+    open_local_model,
+    open_stores,
+    open_template_cache,
+    open_verdict_cache,
+)
+from processing import process_batch
+
+
+IDLE_MAX_SECONDS = 29 * 60
+
+
+class MicroBatchWindow:
+    def __init__(self, batch_size: int, max_latency: float) -> None:
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.uids: list[str] = []
+        self.opened_at: float | None = None
+
+    def add(self, uids: list[str], now: float) -> None:
+        if uids and self.opened_at is None:
+            self.opened_at = now
+        self.uids.extend(uids)
+
+    def ready(self, now: float) -> bool:
+        if not self.uids:
+            return False
+        return len(self.uids) >= self.batch_size or now - self.opened_at >= self.max_latency
+
+    def take(self) -> list[str]:
+        taken = self.uids[: self.batch_size]
+        self.uids = self.uids[self.batch_size :]
+        self.opened_at = self.opened_at if self.uids else None
+        return taken
+
+    def wait_timeout(self, now: float, idle_timeout: float) -> float:
+        if self.opened_at is None:
+            return idle_timeout
+        return max(0.0, min(idle_timeout, self.opened_at + self.max_latency - now))
+
+
+def _new_uids(box, after_uid: int) -> list[str]:
+    uids = box.uids(f"UID {after_uid + 1}:*")
+    return sorted((uid for uid in uids if int(uid) > after_uid), key=int)
+
+
+def _run_session(box, settings, classifier, stores, watermark, caches, logger, run_logger) -> None:
+    exact_cache, domain_cache, spam_cache = stores
+    verdict_cache, template_cache, local_model = caches
+    folder, uidvalidity = folder_uidvalidity(box)
+    last_uid = watermark.last_uid(folder, uidvalidity)
+    if last_uid is None:
+        # Zonder watermark begint de daemon bij de huidige stand; achterstand is voor de batch-run.
+        existing = box.uids("ALL")
+        last_uid = max((int(uid) for uid in existing), default=0)
+        watermark.advance(folder, uidvalidity, last_uid)
+        watermark.save()
+    logger.info("Daemon actief op %s vanaf UID %s", folder, last_uid + 1)
+
+    mover = CategoryMover(box, settings, logger, run_logger)
+    window = MicroBatchWindow(settings.batch_size, settings.daemon_max_latency)
+    queued_uid = last_uid
+    deferred = watermark.deferred_uids(folder, uidvalidity)
+    if deferred:
+        logger.info("%s uitgestelde mails uit een vorige sessie opnieuw aangeboden", len(deferred))
+        window.add([str(uid) for uid in deferred], time.monotonic())
+    for uid in _new_uids(box, queued_uid):
+        window.add([uid], time.monotonic())
+        queued_uid = int(uid)
+    last_keepalive = time.monotonic()
+
+    while True:
+        now = time.monotonic()
+        timeout = window.wait_timeout(now, min(settings.daemon_keepalive_seconds, IDLE_MAX_SECONDS))
+        responses = box.idle.wait(timeout=timeout) if timeout > 0 else []
+        if responses or window.uids:
+            new_uids = _new_uids(box, queued_uid)
+            if new_uids:
+                window.add(new_uids, time.monotonic())
+                queued_uid = int(new_uids[-1])
+
+        while window.ready(time.monotonic()):
+            uids = window.take()
+            deferred_uids = []
+            for batch in stream_uid_slices(
+                box,
+                uids,
+                settings.batch_size,
+                settings.fetch_slice_max_bytes,
+                logger,
+                run_logger,
+                headers_only=headers_first_enabled(settings),
+            ):
+                if not batch:
+                    continue
+                state = process_batch(
+                    batch=batch,
+                    box=box,
+                    classifier=classifier,
+                    exact_cache=exact_cache,
+                    domain_cache=domain_cache,
+                    spam_cache=spam_cache,
+                    settings=settings,
+                    logger=logger,
+                    run_logger=run_logger,
+                    mover=mover,
+                    verdict_cache=verdict_cache,
+                    template_cache=template_cache,
+                    local_model=local_model,
+                )
+                deferred_uids.extend(state.deferred_uids)
+            watermark.advance(folder, uidvalidity, max(int(uid) for uid in uids))
+            watermark.resolve_deferred(folder, uidvalidity, uids)
+            watermark.defer(folder, uidvalidity, deferred_uids)
+            watermark.save()
+            run_logger.flush()
+            metrics.export(settings.log_dir, settings.runstamp, settings.metrics_textfile_dir)
+
+        if time.monotonic() - last_keepalive >= settings.daemon_keepalive_seconds:
+            box.client.noop()
+            last_keepalive = time.monotonic()
+
+
+def run_daemon() -> int:
+    settings = load_settings()
+    logger = setup_app_logger(settings)
+    run_logger = RunLogger(settings)
+    stores = open_stores(settings, logger, run_logger)
+    classifier = EmailClassifier(settings, logger=logger, run_logger=run_logger)
+    watermark = ImapWatermarkStore(settings.watermark_file, run_logger=run_logger)
+    caches = (
+        open_verdict_cache(settings, classifier, run_logger),
+        open_template_cache(settings, run_logger),
+        open_local_model(settings, logger, run_logger),
+    )
+
+    logger.info(
+        "Daemon start: max latency=%ss keepalive=%ss",
+        settings.daemon_max_latency,
+        settings.daemon_keepalive_seconds,
+    )
+    backoff = 1.0
+    while True:
+        try:
+            with MailBox(settings.imap_host).login(settings.imap_user, settings.imap_password) as box:
+                backoff = 1.0
+                _run_session(box, settings, classifier, stores, watermark, caches, logger, run_logger)
+        except KeyboardInterrupt:
+            log_local_model_summary(caches[2], logger, run_logger)
+            report_metrics(settings, logger, run_logger)
+            run_logger.close()
+            logger.info("Daemon gestopt")
+            return 0
+        except Exception as exc:
+            run_logger.event("daemon_reconnect", str(exc))
+            logger.warning("IMAP sessie verbroken (%s); opnieuw inloggen over %.0fs", exc, backoff)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, settings.daemon_reconnect_max_seconds)
+
+
+if __name__ == "__main__":
+    raise SystemExit(run_daemon())
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from config import load_settings
+from logging_setup import setup_app_logger
+from policy_engine import DomainCacheStore, extract_domain_from_sender
+from sqlite_cache import read_sender_items
+
+
+MIN_MAILS = 5
+MIN_SHARE = 0.95
+LLM_SOURCES = {"llm"}
+
+
+@dataclass
+class DomainStats:
+    counts: Counter = field(default_factory=Counter)
+    llm_mails: int = 0
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def top(self) -> tuple[str, int]:
+        return self.counts.most_common(1)[0] if self.counts else ("", 0)
+
+
+def read_log_rows(log_files: list[Path]) -> list[dict]:
+    # Runs over overlappende datumbereiken loggen dezelfde mail opnieuw; afzender, onderwerp en maildatum
+    # identificeren de mail, de laatste run telt. Zonder maildatum is een regel niet te herkennen en telt hij los.
+    rows: dict[tuple, dict] = {}
+    for log_file in log_files:
+        with log_file.open("r", encoding="utf-8", newline="") as f:
+            for line_no, row in enumerate(csv.DictReader(f, delimiter=";")):
+                sender = (row.get("afzender") or "").strip().lower()
+                email_datum = (row.get("email_datum") or "").strip()
+                if email_datum:
+                    key = (sender, (row.get("onderwerp") or "").strip(), email_datum)
+                else:
+                    key = (str(log_file), line_no)
+                rows.pop(key, None)
+                rows[key] = row
+    return list(rows.values())
+
+
+def collect_domain_stats(sender_items, log_files: list[Path]) -> dict[str, DomainStats]:
+    stats: dict[str, DomainStats] = {}
+    logged_senders = set()
+
+    for row in read_log_rows(log_files):
+        sender = (row.get("afzender") or "").strip().lower()
+        categorie = (row.get("categorie") or "").strip().lower()
+        domain = extract_domain_from_sender(sender)
+        if not domain or categorie in {"", "onbekend"}:
+            continue
+        logged_senders.add(sender)
+        entry = stats.setdefault(domain, DomainStats())
+        entry.counts[categorie] += 1
+        if (row.get("bron") or "").strip() in LLM_SOURCES:
+            entry.llm_mails += 1
+
+    # Afzenders uit de cache die niet in de logs voorkomen tellen als een mail.
+    for sender, value in sender_items:
+        categorie = str((value or {}).get("categorie") or "").strip().lower()
+        domain = extract_domain_from_sender(sender)
+        if not domain or sender in logged_senders or categorie in {"", "onbekend"}:
+            continue
+        stats.setdefault(domain, DomainStats()).counts[categorie] += 1
+    return stats
+
+
+def select_candidates(
+    stats: dict[str, DomainStats],
+    domain_cache,
+    min_mails: int = MIN_MAILS,
+    min_share: float = MIN_SHARE,
+) -> dict[str, dict]:
+    candidates = {}
+    for domain, entry in stats.items():
+        categorie, count = entry.top()
+        total = entry.total
+        if total < min_mails or count / total < min_share:
+            continue
+        if categorie.startswith("persoonlijk"):
+            continue
+        if domain_cache.lookup(domain) is not None:
+            continue
+        spam = categorie == "spam"
+        candidates[domain] = {
+            "spam": spam,
+            "category": None if spam else categorie,
+            "mails": total,
+            "share": round(count / total, 3),
+            "llm_calls_saved": entry.llm_mails,
+        }
+    return dict(sorted(candidates.items(), key=lambda item: (-item[1]["llm_calls_saved"], -item[1]["mails"], item[0])))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Zoek domeinen die veilig naar de domain cache kunnen")
+    parser.add_argument("--min-mails", type=int, default=MIN_MAILS)
+    parser.add_argument("--min-share", type=float, default=MIN_SHARE)
+    args = parser.parse_args()
+
+    settings = load_settings()
+    logger = setup_app_logger(settings)
+    # Alleen lezen: geen startup-reconciliatie, migratie of cache-upgrade vanuit een rapportage.
+    db_file = settings.cache_db_file if settings.cache_backend == "sqlite" else None
+    sender_items = read_sender_items(db_file, settings.cache_file)
+    domain_cache = DomainCacheStore(settings.domain_cache_file, read_only=True)
+
+    log_files = sorted(settings.log_dir.glob("log_*.csv"))
+    stats = collect_domain_stats(sender_items, log_files)
+    candidates = select_candidates(stats, domain_cache, args.min_mails, args.min_share)
+
+    settings.domain_candidates_file.parent.mkdir(parents=True, exist_ok=True)
+    with settings.domain_candidates_file.open("w", encoding="utf-8") as f:
+        json.dump(candidates, f, indent=2, ensure_ascii=False)
+
+    saved = sum(entry["llm_calls_saved"] for entry in candidates.values())
+    logger.info(
+        "%s kandidaat-domeinen uit %s domeinen en %s logbestanden; %s LLM-classificaties bespaard in de loghistorie",
+        len(candidates),
+        len(stats),
+        len(log_files),
+        saved,
+    )
+    for domain, entry in list(candidates.items())[:20]:
+        logger.info(
+            "  %s -> %s (%s mails, %.0f%%, %s LLM bespaard)",
+            domain,
+            "spam" if entry["spam"] else entry["category"],
+            entry["mails"],
+            entry["share"] * 100,
+            entry["llm_calls_saved"],
+        )
+    logger.info("Kandidaten geschreven naar %s", settings.domain_candidates_file)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
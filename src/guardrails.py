@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+
+DEFAULT_RULES_FILE = Path(__file__).resolve().parents[1] / "config" / "guardrail_rules.json"
+RARE_DOMAIN_DIGITS = re.compile(r"\d{3,}")
+
+
+@dataclass(frozen=True)
+class GuardrailRule:
+    name: str
+    conditions: tuple[re.Pattern, ...]
+    rare_domain: bool = False
+
+
+class GuardrailEngine:
+    def __init__(self, rules: list[GuardrailRule], common_domains: set[str], version: int = 0) -> None:
+        self.rules = rules
+        self.common_domains = frozenset(domain.lower() for domain in common_domains)
+        self.version = version
+
+    def match(self, from_domain: str, subject: str, body_snippet: str, url_domains: list[str]) -> str | None:
+        text = f"{subject or ''} {body_snippet or ''}".lower()
+        for rule in self.rules:
+            if not all(pattern.search(text) for pattern in rule.conditions):
+                continue
+            if rule.rare_domain and not (
+                self.is_rare_domain(from_domain) or any(self.is_rare_domain(d) for d in (url_domains or []))
+            ):
+                continue
+            return rule.name
+        return None
+
+    def is_rare_domain(self, domain: str) -> bool:
+        if not domain:
+            return True
+        d = domain.lower()
+        if d in self.common_domains:
+            return False
+        if d.count("-") >= 2:
+            return True
+        return bool(RARE_DOMAIN_DIGITS.search(d))
+
+
+def compile_condition(condition: dict) -> re.Pattern:
+    if "regex" in condition:
+        return re.compile(condition["regex"], re.IGNORECASE)
+    terms = [str(term).lower() for term in condition.get("terms", []) if str(term).strip()]
+    if not terms:
+        raise ValueError("Guardrail conditie zonder terms of regex")
+    # Een alternation per conditie; langste terms eerst zodat de regex-engine niet onnodig backtrackt.
+    return re.compile("|".join(re.escape(term) for term in sorted(set(terms), key=len, reverse=True)))
+
+
+def parse_guardrails(raw: dict) -> GuardrailEngine:
+    if not isinstance(raw, dict) or not isinstance(raw.get("rules"), list):
+        raise ValueError("Guardrail bestand mist een 'rules' lijst")
+    rules = []
+    for entry in raw["rules"]:
+        name = str(entry.get("name") or "").strip()
+        conditions = entry.get("conditions") or []
+        if not name or not conditions:
+            raise ValueError(f"Guardrail regel zonder naam of condities: {entry!r}")
+        rules.append(
+            GuardrailRule(
+                name=name,
+                conditions=tuple(compile_condition(condition) for condition in conditions),
+                rare_domain=bool(entry.get("rare_domain", False)),
+            )
+        )
+    return GuardrailEngine(rules, set(raw.get("common_domains") or []), version=int(raw.get("version", 0) or 0))
+
+
+@lru_cache(maxsize=None)
+def load_guardrails(rules_file: Path = DEFAULT_RULES_FILE) -> GuardrailEngine:
+    with Path(rules_file).open("r", encoding="utf-8") as f:
+        return parse_guardrails(json.load(f))
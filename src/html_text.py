@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+from html.parser import HTMLParser
+
+
+# Geen "head": zonder </head> (gangbaar in mail-HTML) zou de hele body wegvallen; title/style/script dekken de inhoud.
+SKIPPED_TAGS = frozenset({"script", "style", "title", "noscript", "template"})
+FEED_CHUNK_CHARS = 4096
+
+
+class _EnoughText(Exception):
+    pass
+
+
+class _VisibleTextParser(HTMLParser):
+    def __init__(self, max_chars: int) -> None:
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.words: list[str] = []
+        self.length = -1
+        self.skip_depth = 0
+        self.open_word = False
+
+    def handle_starttag(self, tag, attrs) -> None:
+        self.open_word = False
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+
+    def handle_startendtag(self, tag, attrs) -> None:
+        self.open_word = False
+
+    def handle_endtag(self, tag) -> None:
+        self.open_word = False
+        if tag in SKIPPED_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data) -> None:
+        if self.skip_depth or not data:
+            return
+        words = data.split()
+        # Tekst zonder tag ertussen kan over twee feed-chunks verdeeld zijn; plak het afgebroken woord weer aan.
+        if words and self.open_word and not data[0].isspace():
+            first = words.pop(0)
+            self.words[-1] += first
+            self.length += len(first)
+        for word in words:
+            self.words.append(word)
+            self.length += len(word) + 1
+        self.open_word = bool(self.words) and not data[-1].isspace()
+        if self.length >= self.max_chars:
+            raise _EnoughText
+
+
+def stream_html_text(html: str, max_chars: int) -> str:
+    # Zelfde uitkomst als BeautifulSoup get_text(" ") + whitespace collapse, maar stopt na max_chars.
+    parser = _VisibleTextParser(max_chars)
+    try:
+        for start in range(0, len(html), FEED_CHUNK_CHARS):
+            parser.feed(html[start : start + FEED_CHUNK_CHARS])
+        parser.close()
+    except _EnoughText:
+        pass
+    return " ".join(parser.words)[:max_chars]
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import re
+
+from imap_tools.utils import encode_folder
+
+from imap_reader import uid_sequence_set
+from metrics import metrics
+
+
+_NAMESPACE_RE = re.compile(r'^\s*\(\(\s*"([^"]*)"\s+(?:"([^"]*)"|NIL)\s*\)')
+
+
+class CategoryMover:
+    def __init__(self, box, settings, logger, run_logger) -> None:
+        self.box = box
+        self.settings = settings
+        self.logger = logger
+        self.run_logger = run_logger
+        self.ensured_folders: set[str] = set()
+        self.folder_delim = "/"
+        self.namespace_prefix = ""
+        self.has_move = False
+        self.has_uidplus = False
+        self._probed = False
+
+    def move_batch(self, moves: list[tuple[str, str]]) -> None:
+        if not self.settings.imap_move_by_category:
+            return
+        groups: dict[str, list[str]] = {}
+        for uid, categorie in moves:
+            if uid:
+                groups.setdefault(categorie, []).append(uid)
+        if not groups:
+            return
+        self._probe()
+        for categorie, uids in groups.items():
+            with metrics.timer("imap_move"):
+                self._move_group(uids, self.folder_for(categorie))
+
+    def folder_for(self, categorie: str) -> str:
+        self._probe()
+        prefix = self.settings.imap_category_prefix or ""
+        normalized_prefix = re.sub(r"[\\/]+", self.folder_delim, prefix)
+        folder = f"{normalized_prefix}{categorie}"
+        if self.namespace_prefix and not folder.upper().startswith(self.namespace_prefix.upper()):
+            folder = f"{self.namespace_prefix}{folder}"
+        return folder
+
+    def _probe(self) -> None:
+        if self._probed:
+            return
+        self._probed = True
+        capabilities = {str(cap).upper() for cap in getattr(self.box.client, "capabilities", ())}
+        self.has_move = "MOVE" in capabilities
+        self.has_uidplus = "UIDPLUS" in capabilities
+        try:
+            inbox_info = self.box.folder.list("", "INBOX")
+            if inbox_info and getattr(inbox_info[0], "delim", None):
+                self.folder_delim = inbox_info[0].delim
+        except Exception:
+            pass
+        if "NAMESPACE" in capabilities:
+            try:
+                status, data = self.box.client.namespace()
+                if status == "OK" and data and data[0]:
+                    raw = data[0].decode() if isinstance(data[0], bytes) else str(data[0])
+                    match = _NAMESPACE_RE.match(raw)
+                    if match:
+                        self.namespace_prefix = match.group(1)
+                        if match.group(2):
+                            self.folder_delim = match.group(2)
+            except Exception:
+                pass
+        self.logger.info(
+            "IMAP sessie: delim=%r namespace=%r MOVE=%s UIDPLUS=%s",
+            self.folder_delim,
+            self.namespace_prefix,
+            self.has_move,
+            self.has_uidplus,
+        )
+
+    def _move_group(self, uids: list[str], primary_folder: str) -> None:
+        uid_set = uid_sequence_set(uids)
+        try:
+            self._ensure_and_move(uid_set, primary_folder)
+        except Exception as exc:
+            err = str(exc)
+            needs_inbox_prefix = (
+                "nonexistent namespace" in err.lower()
+                or "prefixed with: inbox" in err.lower()
+            )
+            if needs_inbox_prefix and not primary_folder.upper().startswith("INBOX" + self.folder_delim):
+                fallback_folder = f"INBOX{self.folder_delim}{primary_folder}"
+                try:
+                    self._ensure_and_move(uid_set, fallback_folder)
+                    self.run_logger.event("imap_move_retry", f"{uid_set} -> {fallback_folder} (fallback from {primary_folder})")
+                    self.logger.info("IMAP move fallback gebruikt: %s -> %s", uid_set, fallback_folder)
+                    return
+                except Exception as exc2:
+                    self.run_logger.event("imap_move", f"{uid_set} -> {fallback_folder}: {exc2}")
+                    self.logger.warning("IMAP move fallback mislukt: %s -> %s (%s)", uid_set, fallback_folder, exc2)
+                    return
+            self.run_logger.event("imap_move", f"{uid_set} -> {primary_folder}: {exc}")
+            self.logger.warning("IMAP move mislukt: %s -> %s (%s)", uid_set, primary_folder, exc)
+
+    def _ensure_and_move(self, uid_set: str, target_folder: str) -> None:
+        if target_folder not in self.ensured_folders:
+            if not self.box.folder.exists(target_folder):
+                self.box.folder.create(target_folder)
+                try:
+                    self.box.folder.subscribe(target_folder, True)
+                except Exception:
+                    pass
+            self.ensured_folders.add(target_folder)
+        self._uid_move(uid_set, target_folder)
+
+    def _uid_move(self, uid_set: str, target_folder: str) -> None:
+        client = self.box.client
+        encoded_folder = encode_folder(target_folder)
+        if self.has_move:
+            _check(client.uid("MOVE", uid_set, encoded_folder), "UID MOVE")
+            return
+        _check(client.uid("COPY", uid_set, encoded_folder), "UID COPY")
+        _check(client.uid("STORE", uid_set, "+FLAGS.SILENT", r"(\Deleted)"), "UID STORE")
+        if self.has_uidplus:
+            _check(client.uid("EXPUNGE", uid_set), "UID EXPUNGE")
+        else:
+            _check(client.expunge(), "EXPUNGE")
+
+
+def _check(result: tuple, command: str) -> None:
+    status, data = result
+    if status != "OK":
+        detail = b" ".join(item for item in data if isinstance(item, bytes)).decode(errors="replace")
+        raise RuntimeError(f"{command} mislukt: {status} {detail}".strip())
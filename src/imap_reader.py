@@ -1,15 +1,28 @@
 from __future__ import annotations
 
+import base64
+import binascii
+import quopri
+import re
+from dataclasses import dataclass
 from datetime import date, timedelta
 from typing import Iterator
 
-from imap_tools import AND, MailBox
+from imap_tools import AND, MailBox, MailMessage
+
+from metrics import metrics
 
 
 def mailbox_connection(host: str, user: str, password: str) -> MailBox:
     return MailBox(host).login(user, password)
 
 
+def folder_uidvalidity(box: MailBox) -> tuple[str, int]:
+    folder = box.folder.get() or "INBOX"
+    status = box.folder.status(folder, ["UIDVALIDITY"])
+    return folder, int(status.get("UIDVALIDITY", 0))
+
+
 def fetch_in_chunks(
     box: MailBox,
     date_from: str,
@@ -17,9 +30,13 @@ def fetch_in_chunks(
     step_days: int,
     logger,
     run_logger,
+    headers_only: bool = False,
 ) -> Iterator[list]:
     start = date.fromisoformat(date_from)
     end = date.fromisoformat(date_to)
+    # Two-phase fetch: eerst alleen BODY[HEADER]; bodies volgen via fetch_bodies. Geen PEEK op de headers,
+    # zodat mails net als bij de volledige fetch als gelezen gemarkeerd worden.
+    fetch_kwargs = {"headers_only": True} if headers_only else {}
 
     current = start
     while current < end:
@@ -27,15 +44,17 @@ def fetch_in_chunks(
         logger.info("Chunk %s -> %s", current.isoformat(), segment_end.isoformat())
 
         try:
-            mails = list(
-                box.fetch(
-                    AND(
-                        date_gte=current,
-                        date_lt=segment_end,
-                    ),
-                    reverse=True,
+            with metrics.timer("imap_fetch"):
+                mails = list(
+                    box.fetch(
+                        AND(
+                            date_gte=current,
+                            date_lt=segment_end,
+                        ),
+                        reverse=True,
+                        **fetch_kwargs,
+                    )
                 )
-            )
         except Exception as exc:
             run_logger.event("imap_fetch", f"IMAP fetch error: {exc}")
             logger.exception("IMAP fetch error")
@@ -44,3 +63,405 @@ def fetch_in_chunks(
         logger.info("%s mails in chunk", len(mails))
         yield mails
         current = segment_end
+
+
+def fetch_bodies(box: MailBox, uids: list[str], logger, run_logger) -> dict[str, object]:
+    uids = [uid for uid in uids if uid]
+    if not uids:
+        return {}
+    try:
+        mails = box.fetch(uid_list=uids, mark_seen=False, bulk=True)
+        result = {msg.uid: msg for msg in mails if msg.uid}
+    except Exception as exc:
+        run_logger.event("imap_fetch_bodies", f"IMAP body fetch error: {exc}")
+        logger.exception("IMAP body fetch error")
+        return {}
+    logger.info("%s/%s bodies opgehaald", len(result), len(uids))
+    return result
+
+
+def fetch_uid_slices(
+    box: MailBox,
+    date_from: str,
+    date_to: str,
+    slice_size: int,
+    max_bytes: int,
+    logger,
+    run_logger,
+    headers_only: bool = False,
+) -> Iterator[list]:
+    start = date.fromisoformat(date_from)
+    end = date.fromisoformat(date_to)
+    try:
+        uids = box.uids(AND(date_gte=start, date_lt=end))
+    except Exception as exc:
+        run_logger.event("imap_search", f"IMAP UID SEARCH error: {exc}")
+        logger.exception("IMAP UID SEARCH error")
+        return
+    logger.info("%s mails in %s -> %s", len(uids), start.isoformat(), end.isoformat())
+    yield from stream_uid_slices(box, list(reversed(uids)), slice_size, max_bytes, logger, run_logger, headers_only)
+
+
+def fetch_new_uid_slices(
+    box: MailBox,
+    last_uid: int,
+    slice_size: int,
+    max_bytes: int,
+    logger,
+    run_logger,
+    headers_only: bool = False,
+) -> Iterator[list]:
+    try:
+        uids = box.uids(f"UID {last_uid + 1}:*")
+    except Exception as exc:
+        run_logger.event("imap_search", f"IMAP UID SEARCH error: {exc}")
+        logger.exception("IMAP UID SEARCH error")
+        return
+    # "n:*" levert altijd minstens het hoogste bericht op, ook als dat al verwerkt is.
+    new_uids = sorted((uid for uid in uids if int(uid) > last_uid), key=int)
+    logger.info("%s nieuwe mails sinds UID %s", len(new_uids), last_uid)
+    yield from stream_uid_slices(box, new_uids, slice_size, max_bytes, logger, run_logger, headers_only)
+
+
+def stream_uid_slices(
+    box: MailBox,
+    uids: list[str],
+    slice_size: int,
+    max_bytes: int,
+    logger,
+    run_logger,
+    headers_only: bool = False,
+) -> Iterator[list]:
+    fetch_kwargs = {"headers_only": True} if headers_only else {}
+    sizes: dict[str, int] = {}
+    if max_bytes > 0 and not headers_only and uids:
+        try:
+            sizes = _fetch_sizes(box, uids)
+        except Exception as exc:
+            run_logger.event("imap_fetch_sizes", f"IMAP RFC822.SIZE error: {exc}")
+            logger.warning("IMAP RFC822.SIZE fout, slices alleen op aantal: %s", exc)
+
+    for slice_uids in plan_uid_slices(uids, sizes, slice_size, max_bytes):
+        try:
+            with metrics.timer("imap_fetch"):
+                mails = list(box.fetch(uid_list=slice_uids, bulk=True, **fetch_kwargs))
+        except Exception as exc:
+            run_logger.event("imap_fetch", f"IMAP fetch error: {exc}")
+            logger.exception("IMAP fetch error")
+            mails = []
+        logger.info("%s mails in slice (%s uids)", len(mails), len(slice_uids))
+        yield mails
+
+
+def plan_uid_slices(uids: list[str], sizes: dict[str, int], slice_size: int, max_bytes: int) -> Iterator[list[str]]:
+    current: list[str] = []
+    current_bytes = 0
+    for uid in uids:
+        size = sizes.get(uid, 0)
+        over_bytes = max_bytes > 0 and current and current_bytes + size > max_bytes
+        if len(current) >= slice_size or over_bytes:
+            yield current
+            current, current_bytes = [], 0
+        current.append(uid)
+        current_bytes += size
+    if current:
+        yield current
+
+
+def uid_sequence_set(uids) -> str:
+    numbers = sorted({int(uid) for uid in uids})
+    ranges = []
+    for number in numbers:
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+
+def _fetch_sizes(box: MailBox, uids: list[str]) -> dict[str, int]:
+    status, data = box.client.uid("FETCH", uid_sequence_set(uids), "(UID RFC822.SIZE)")
+    if status != "OK":
+        raise RuntimeError(f"RFC822.SIZE fetch status {status}")
+    sizes = {}
+    for item in data:
+        line = item[0] if isinstance(item, tuple) else item
+        if not isinstance(line, bytes):
+            continue
+        uid_match = re.search(rb"UID (\d+)", line)
+        size_match = re.search(rb"RFC822\.SIZE (\d+)", line)
+        if uid_match and size_match:
+            sizes[uid_match.group(1).decode()] = int(size_match.group(1))
+    return sizes
+
+
+# Partial body fetch: BODYSTRUCTURE bepaalt welk tekstdeel nodig is; daarvan wordt
+# alleen een prefix opgehaald (BODY.PEEK[n]<0.N>). Bijlagen worden nooit gedownload.
+PARTIAL_PLAIN_BYTES_PER_CHAR = 4
+PARTIAL_HTML_BYTES_PER_CHAR = 64
+
+_LITERAL_RE = re.compile(rb"\{(\d+)\}\s*$")
+_MSG_START_RE = re.compile(rb"^\d+ \(")
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+_HEADER_DROP_RE = re.compile(rb"^(content-type|content-transfer-encoding)\s*:", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class TextPart:
+    section: str
+    subtype: str
+    encoding: str
+    charset: str
+
+
+class _Literal(str):
+    pass
+
+
+def fetch_partial_bodies(box: MailBox, uids: list[str], max_body_chars: int, logger, run_logger) -> dict[str, object]:
+    uids = [uid for uid in uids if uid]
+    if not uids:
+        return {}
+    try:
+        structures = _fetch_bodystructures(box, uids)
+    except Exception as exc:
+        run_logger.event("imap_fetch_bodystructure", f"IMAP BODYSTRUCTURE error: {exc}")
+        logger.exception("IMAP BODYSTRUCTURE error")
+        return fetch_bodies(box, uids, logger, run_logger)
+
+    groups: dict[TextPart | None, list[str]] = {}
+    unparsed = []
+    for uid in uids:
+        if uid not in structures:
+            unparsed.append(uid)
+            continue
+        groups.setdefault(select_text_part(structures[uid]), []).append(uid)
+
+    result: dict[str, object] = {}
+    for part, group_uids in groups.items():
+        try:
+            result.update(_fetch_part_prefix(box, group_uids, part, max_body_chars))
+        except Exception as exc:
+            run_logger.event("imap_fetch_partial", f"IMAP partial fetch error: {exc}")
+            logger.exception("IMAP partial fetch error")
+    if unparsed:
+        result.update(fetch_bodies(box, unparsed, logger, run_logger))
+    logger.info("%s/%s partial bodies opgehaald", len(result), len(uids))
+    return result
+
+
+def select_text_part(structure: list) -> TextPart | None:
+    plain = None
+    html = None
+    for section, part in _walk_parts(structure, ""):
+        subtype = _lower(part[1]) if len(part) > 1 else ""
+        if _lower(part[0]) != "text" or subtype not in ("plain", "html") or _is_attachment(part):
+            continue
+        params = part[2] if len(part) > 2 and isinstance(part[2], list) else []
+        charset = ""
+        for key, value in zip(params[::2], params[1::2]):
+            if _lower(key) == "charset":
+                charset = str(value or "")
+        text_part = TextPart(
+            section=section or "1",
+            subtype=subtype,
+            encoding=_lower(part[5]) if len(part) > 5 else "",
+            charset=charset,
+        )
+        if subtype == "plain" and plain is None:
+            plain = text_part
+        elif subtype == "html" and html is None:
+            html = text_part
+    return plain or html
+
+
+def parse_bodystructures(fetch_data: list) -> dict[str, list]:
+    result = {}
+    for tokens in _group_responses(fetch_data):
+        try:
+            parsed = _parse_tokens(tokens)
+        except (IndexError, ValueError):
+            continue
+        attrs = next((item for item in parsed if isinstance(item, list)), None)
+        if attrs is None:
+            continue
+        uid = None
+        structure = None
+        for key, value in zip(attrs[::2], attrs[1::2]):
+            if _lower(key) == "uid":
+                uid = str(value)
+            elif _lower(key) == "bodystructure":
+                structure = value
+        if uid and isinstance(structure, list):
+            result[uid] = structure
+    return result
+
+
+def _fetch_bodystructures(box: MailBox, uids: list[str]) -> dict[str, list]:
+    status, data = box.client.uid("FETCH", ",".join(uids), "(UID BODYSTRUCTURE)")
+    if status != "OK":
+        raise RuntimeError(f"BODYSTRUCTURE fetch status {status}")
+    return parse_bodystructures(data)
+
+
+def _fetch_part_prefix(box: MailBox, uids: list[str], part: TextPart | None, max_body_chars: int) -> dict[str, object]:
+    if part is None:
+        message_parts = "(UID BODY.PEEK[HEADER])"
+    else:
+        message_parts = f"(UID BODY.PEEK[HEADER] BODY.PEEK[{part.section}]<0.{_partial_byte_budget(part, max_body_chars)}>)"
+    status, data = box.client.uid("FETCH", ",".join(uids), message_parts)
+    if status != "OK":
+        raise RuntimeError(f"partial fetch status {status}")
+
+    result = {}
+    for uid, header_bytes, body_bytes in _split_partial_responses(data):
+        text = _decode_part(body_bytes, part) if part is not None and body_bytes is not None else ""
+        subtype = part.subtype if part is not None else "plain"
+        result[uid] = _build_message(uid, header_bytes, text, subtype)
+    return result
+
+
+def _partial_byte_budget(part: TextPart, max_body_chars: int) -> int:
+    per_char = PARTIAL_HTML_BYTES_PER_CHAR if part.subtype == "html" else PARTIAL_PLAIN_BYTES_PER_CHAR
+    budget = max_body_chars * per_char
+    if part.encoding == "base64":
+        budget = (budget * 4 // 3 + 3) // 4 * 4
+    return budget
+
+
+def _split_partial_responses(fetch_data: list) -> Iterator[tuple[str, bytes, bytes | None]]:
+    uid = None
+    header_bytes = b""
+    body_bytes = None
+    for item in fetch_data:
+        head = item[0] if isinstance(item, tuple) else item
+        if not isinstance(head, bytes):
+            continue
+        if _MSG_START_RE.match(head):
+            if uid:
+                yield uid, header_bytes, body_bytes
+            uid, header_bytes, body_bytes = None, b"", None
+        uid_match = re.search(rb"UID (\d+)", head)
+        if uid_match:
+            uid = uid_match.group(1).decode()
+        if isinstance(item, tuple):
+            if b"BODY[HEADER]" in head.upper():
+                header_bytes = item[1] or b""
+            else:
+                body_bytes = item[1] or b""
+    if uid:
+        yield uid, header_bytes, body_bytes
+
+
+def _decode_part(raw: bytes, part: TextPart) -> str:
+    if part.encoding == "base64":
+        compact = re.sub(rb"[^A-Za-z0-9+/=]", b"", raw)
+        compact = compact[: len(compact) // 4 * 4]
+        try:
+            raw = base64.b64decode(compact)
+        except (binascii.Error, ValueError):
+            raw = b""
+    elif part.encoding == "quoted-printable":
+        raw = quopri.decodestring(re.sub(rb"=[0-9A-Fa-f]?$", b"", raw))
+    try:
+        return raw.decode(part.charset or "utf-8", errors="replace")
+    except LookupError:
+        return raw.decode("utf-8", errors="replace")
+
+
+def _build_message(uid: str, header_bytes: bytes, text: str, subtype: str):
+    kept = []
+    dropping = False
+    for line in header_bytes.splitlines():
+        if not line.strip():
+            continue
+        if line[:1] in (b" ", b"\t"):
+            if not dropping:
+                kept.append(line)
+            continue
+        dropping = bool(_HEADER_DROP_RE.match(line))
+        if not dropping:
+            kept.append(line)
+    kept.append(f"Content-Type: text/{subtype}; charset=utf-8".encode())
+    kept.append(b"Content-Transfer-Encoding: 8bit")
+    raw = b"\r\n".join(kept) + b"\r\n\r\n" + text.encode("utf-8")
+    return MailMessage([(f"UID {uid} BODY[] {{{len(raw)}}}".encode(), raw), b")"])
+
+
+def _walk_parts(structure: list, prefix: str) -> Iterator[tuple[str, list]]:
+    if structure and isinstance(structure[0], list):
+        position = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            position += 1
+            yield from _walk_parts(child, f"{prefix}.{position}" if prefix else str(position))
+        return
+    yield prefix, structure
+
+
+def _is_attachment(part: list) -> bool:
+    # text parts: type subtype params id desc enc size lines md5 disposition
+    if len(part) > 9 and isinstance(part[9], list) and part[9]:
+        return _lower(part[9][0]) == "attachment"
+    return False
+
+
+def _lower(value) -> str:
+    return str(value or "").lower()
+
+
+def _group_responses(fetch_data: list) -> Iterator[list]:
+    tokens: list = []
+    for item in fetch_data:
+        head = item[0] if isinstance(item, tuple) else item
+        if not isinstance(head, bytes):
+            continue
+        if _MSG_START_RE.match(head) and tokens:
+            yield tokens
+            tokens = []
+        if isinstance(item, tuple):
+            text = _LITERAL_RE.sub(b"", head)
+            tokens.extend(_lex(text.decode("utf-8", errors="replace")))
+            tokens.append(_Literal((item[1] or b"").decode("utf-8", errors="replace")))
+        else:
+            tokens.extend(_lex(head.decode("utf-8", errors="replace")))
+    if tokens:
+        yield tokens
+
+
+def _lex(text: str) -> list:
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            break
+        pos = match.end()
+        if match.group(1):
+            tokens.append("(")
+        elif match.group(2):
+            tokens.append(")")
+        elif match.group(3) is not None:
+            tokens.append(_Literal(re.sub(r"\\(.)", r"\1", match.group(3))))
+        elif match.group(4):
+            tokens.append(None if match.group(4).upper() == "NIL" else match.group(4))
+    return tokens
+
+
+def _parse_tokens(tokens: list) -> list:
+    stack: list[list] = [[]]
+    for token in tokens:
+        if isinstance(token, _Literal):
+            stack[-1].append(str(token))
+        elif token == "(":
+            stack.append([])
+        elif token == ")":
+            if len(stack) == 1:
+                raise ValueError("unbalanced BODYSTRUCTURE")
+            closed = stack.pop()
+            stack[-1].append(closed)
+        else:
+            stack[-1].append(token)
+    return stack[0]
@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from cache_store import subject_template
+from payload_format import encode_payloads
+
+
+CHARS_PER_TOKEN = 4
+OUTPUT_TOKENS_PER_MAIL = 12
+# Markering voor mails die niet geclassificeerd konden worden omdat de LLM onbereikbaar was.
+DEFERRED = "uitgesteld"
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text or "") // CHARS_PER_TOKEN)
+
+
+def retry_after_seconds(exc: Exception, default: float) -> float:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms:
+            return max(0.0, float(retry_after_ms) / 1000)
+        retry_after = headers.get("retry-after")
+        if retry_after:
+            return max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        pass
+    return default
+
+
+class TokenBucketLimiter:
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, clock=time.monotonic, sleep=time.sleep) -> None:
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = clock()
+        self._blocked_until = 0.0
+
+    def acquire(self, tokens: int) -> None:
+        while True:
+            with self._lock:
+                wait = self._try_consume(tokens)
+            if wait <= 0:
+                return
+            self._sleep(wait)
+
+    def block_for(self, seconds: float) -> None:
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+    def _try_consume(self, tokens: int) -> float:
+        now = self._clock()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm > 0:
+            self._requests = min(float(self.rpm), self._requests + elapsed * self.rpm / 60)
+        if self.tpm > 0:
+            self._tokens = min(float(self.tpm), self._tokens + elapsed * self.tpm / 60)
+
+        # Een verzoek groter dan de hele bucket mag door zodra de bucket vol is.
+        needed_tokens = min(tokens, self.tpm) if self.tpm > 0 else 0
+        wait = 0.0
+        if self.rpm > 0 and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+        if self.tpm > 0 and self._tokens < needed_tokens:
+            wait = max(wait, (needed_tokens - self._tokens) * 60 / self.tpm)
+        if wait > 0:
+            return wait
+        if self.rpm > 0:
+            self._requests -= 1
+        if self.tpm > 0:
+            self._tokens -= needed_tokens
+        return 0.0
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rand=random.random) -> float:
+    # Exponentieel met "full jitter": gelijktijdige workers lopen niet in de pas opnieuw tegen de API aan.
+    return rand() * min(cap, base * 2**attempt)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_seconds: float, clock=time.monotonic) -> None:
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+
+    def allow(self) -> bool:
+        # Na reset_seconds mag er weer een proefcall door (half-open); faalt die, dan gaat hij direct weer open.
+        with self._lock:
+            return self._opened_at is None or self._clock() - self._opened_at >= self.reset_seconds
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> bool:
+        with self._lock:
+            self._failures += 1
+            if self._failures < self.failure_threshold:
+                return False
+            self._opened_at = self._clock()
+            return True
+
+
+class LlmDispatcher:
+    def __init__(self, classifier, max_in_flight: int) -> None:
+        self.classifier = classifier
+        self.max_in_flight = max(1, max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="llm")
+
+    def submit(self, batch: list) -> Future:
+        return self._executor.submit(self.classifier.batch_classify, batch)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+def coalesce_key(features) -> tuple[str, str] | None:
+    # Mails van dezelfde afzender met hetzelfde onderwerp-sjabloon krijgen een oordeel voor de hele groep.
+    if not features.sender:
+        return None
+    return features.sender, subject_template(features.subject)
+
+
+def coalesce_items(features_list: list) -> tuple[list[int], list[list[int]]]:
+    leaders: list[int] = []
+    members: list[list[int]] = []
+    by_key: dict[tuple[str, str], int] = {}
+    for pos, features in enumerate(features_list):
+        key = coalesce_key(features)
+        if key is not None and key in by_key:
+            members[by_key[key]].append(pos)
+            continue
+        if key is not None:
+            by_key[key] = len(leaders)
+        leaders.append(pos)
+        members.append([pos])
+    return leaders, members
+
+
+@dataclass
+class _PendingState:
+    state: object
+    results: dict[int, str] = field(default_factory=dict)
+    remaining: int = 0
+
+
+class TokenBudgetBatcher:
+    def __init__(
+        self,
+        budget_tokens: int,
+        max_wait: float,
+        overhead_tokens: int,
+        max_mails: int,
+        payload_format: str = "json",
+        coalesce: bool = False,
+    ) -> None:
+        # budget_tokens <= 0: een LLM-call per binnenkomende batch, zoals zonder deze stage.
+        self.budget_tokens = budget_tokens
+        self.max_wait = max_wait
+        self.overhead_tokens = overhead_tokens
+        self.max_mails = max(1, max_mails)
+        self.payload_format = payload_format
+        self.coalesce = coalesce
+        self.coalesced = 0
+        # Registry van openstaande oordelen: sleutel -> mails (uit latere batches) die op hetzelfde oordeel wachten.
+        self._inflight: dict[tuple[str, str], list[tuple[_PendingState, int]]] = {}
+        self._states: deque[_PendingState] = deque()
+        self._pending: deque[tuple] = deque()
+        self._pending_tokens = 0
+
+    @classmethod
+    def from_settings(cls, settings, classifier) -> TokenBudgetBatcher:
+        overhead = estimate_tokens(classifier.system_prompt + classifier.classify_prompt)
+        budget = min(settings.llm_batch_tokens, settings.llm_context_tokens) if settings.llm_batch_tokens > 0 else 0
+        return cls(
+            budget_tokens=budget,
+            max_wait=settings.llm_batch_max_wait,
+            overhead_tokens=overhead,
+            max_mails=settings.llm_max_output_tokens // OUTPUT_TOKENS_PER_MAIL,
+            payload_format=settings.llm_payload_format,
+            coalesce=settings.llm_coalesce,
+        )
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def add(self, state, now: float) -> None:
+        entry = _PendingState(state=state, remaining=len(state.unknown_items))
+        self._states.append(entry)
+        for local_idx, item in enumerate(state.unknown_items):
+            key = coalesce_key(item[1]) if self.coalesce else None
+            if key is not None:
+                if key in self._inflight:
+                    self._inflight[key].append((entry, local_idx))
+                    state.coalesced.add(local_idx)
+                    self.coalesced += 1
+                    continue
+                self._inflight[key] = []
+            tokens = mail_tokens(item[1], local_idx, self.payload_format)
+            self._pending.append((entry, local_idx, item[1], tokens, now))
+            self._pending_tokens += tokens
+
+    def ready(self, now: float) -> bool:
+        if not self._pending:
+            return False
+        if self.budget_tokens <= 0:
+            return True
+        return (
+            self.overhead_tokens + self._pending_tokens >= self.budget_tokens
+            or len(self._pending) >= self.max_mails
+            or now - self._pending[0][4] >= self.max_wait
+        )
+
+    def wait_timeout(self, now: float) -> float | None:
+        if not self._pending or self.budget_tokens <= 0:
+            return None
+        return max(0.0, self._pending[0][4] + self.max_wait - now)
+
+    def take(self) -> list[tuple]:
+        request = []
+        tokens = self.overhead_tokens
+        first_entry = self._pending[0][0] if self._pending else None
+        while self._pending:
+            entry, local_idx, features, item_tokens, _added = self._pending[0]
+            if request:
+                if len(request) >= self.max_mails:
+                    break
+                if self.budget_tokens <= 0 and entry is not first_entry:
+                    break
+                if self.budget_tokens > 0 and tokens + item_tokens > self.budget_tokens:
+                    break
+            self._pending.popleft()
+            self._pending_tokens -= item_tokens
+            tokens += item_tokens
+            request.append((entry, local_idx, features))
+        return request
+
+    def deliver(self, request: list[tuple], results: dict[int, str] | None) -> list[tuple]:
+        for pos, (entry, local_idx, features) in enumerate(request):
+            waiting = self._inflight.pop(coalesce_key(features), []) if self.coalesce else []
+            for target, target_idx in [(entry, local_idx)] + waiting:
+                if results and pos in results:
+                    target.results[target_idx] = results[pos]
+                target.remaining -= 1
+        return self.pop_completed()
+
+    def pop_completed(self) -> list[tuple]:
+        completed = []
+        while self._states and self._states[0].remaining <= 0:
+            entry = self._states.popleft()
+            completed.append((entry.state, entry.results))
+        return completed
+
+
+def mail_tokens(features, index: int, payload_format: str = "json") -> int:
+    payload = encode_payloads([features.to_payload(index)], payload_format)
+    return estimate_tokens(payload) + OUTPUT_TOKENS_PER_MAIL
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import csv
+import re
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from cache_store import subject_template
+from policy_engine import extract_domain_from_sender
+
+
+N_BUCKETS = 1 << 16
+TOKEN_REGEX = re.compile(r"<\w+>|\w+", re.UNICODE)
+# Bronnen die zelf al een lokaal oordeel zijn leren niets nieuws en zouden fouten versterken.
+UNTRUSTED_SOURCES = {"local_model", "onbekend"}
+
+
+def feature_tokens(domain: str, subject: str) -> list[str]:
+    words = TOKEN_REGEX.findall(subject_template(subject))
+    tokens = [f"w:{word}" for word in words]
+    tokens.extend(f"b:{first}_{second}" for first, second in zip(words, words[1:]))
+    labels = (domain or "").lower().split(".")
+    for start in range(max(0, len(labels) - 3), len(labels) - 1):
+        tokens.append(f"d:{'.'.join(labels[start:])}")
+    return tokens
+
+
+def hashed_indices(tokens: list[str], n_buckets: int = N_BUCKETS) -> np.ndarray:
+    return np.fromiter((zlib.crc32(token.encode("utf-8")) & (n_buckets - 1) for token in tokens), dtype=np.int64)
+
+
+def read_training_rows(log_files: list[Path]) -> list[tuple[str, str, str]]:
+    rows = []
+    for log_file in log_files:
+        with log_file.open("r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f, delimiter=";"):
+                categorie = (row.get("categorie") or "").strip().lower()
+                bron = (row.get("bron") or "").strip().lower()
+                if not categorie or categorie == "onbekend" or bron in UNTRUSTED_SOURCES:
+                    continue
+                rows.append((extract_domain_from_sender(row.get("afzender") or ""), row.get("onderwerp") or "", categorie))
+    return rows
+
+
+class LocalModel:
+    def __init__(self, classes: list[str], log_prior: np.ndarray, log_prob: np.ndarray, trained_rows: int) -> None:
+        self.classes = classes
+        self.log_prior = log_prior
+        self.log_prob = log_prob
+        self.trained_rows = trained_rows
+        self.n_buckets = log_prob.shape[1]
+        self.seen = 0
+        self.answered = 0
+        self.seconds = 0.0
+
+    @classmethod
+    def train(cls, rows: list[tuple[str, str, str]], n_buckets: int = N_BUCKETS, alpha: float = 0.5) -> LocalModel:
+        # Multinomiale naive Bayes over gehashte tokens; een pass over de data, geen iteraties.
+        classes = sorted({categorie for _domain, _subject, categorie in rows})
+        class_index = {categorie: pos for pos, categorie in enumerate(classes)}
+        counts = np.zeros((len(classes), n_buckets), dtype=np.float64)
+        class_counts = np.zeros(len(classes), dtype=np.float64)
+        for domain, subject, categorie in rows:
+            pos = class_index[categorie]
+            np.add.at(counts[pos], hashed_indices(feature_tokens(domain, subject), n_buckets), 1.0)
+            class_counts[pos] += 1
+        smoothed = counts + alpha
+        log_prob = np.log(smoothed) - np.log(smoothed.sum(axis=1, keepdims=True))
+        log_prior = np.log(class_counts / max(1.0, class_counts.sum()))
+        return cls(classes, log_prior.astype(np.float32), log_prob.astype(np.float32), trained_rows=len(rows))
+
+    def predict(self, domain: str, subject: str) -> tuple[str, float]:
+        indices = hashed_indices(feature_tokens(domain, subject), self.n_buckets)
+        scores = self.log_prior + self.log_prob[:, indices].sum(axis=1)
+        scores = np.exp(scores - scores.max())
+        probabilities = scores / scores.sum()
+        best = int(probabilities.argmax())
+        return self.classes[best], float(probabilities[best])
+
+    def classify(self, features_list: list, threshold: float) -> list[str | None]:
+        started = time.perf_counter()
+        results = []
+        for features in features_list:
+            categorie, confidence = self.predict(features.domain, features.subject)
+            results.append(categorie if confidence >= threshold else None)
+        self.seconds += time.perf_counter() - started
+        self.seen += len(results)
+        self.answered += sum(1 for result in results if result)
+        return results
+
+    def summary(self) -> str:
+        rate = self.seen / self.seconds if self.seconds else 0.0
+        share = self.answered / self.seen * 100 if self.seen else 0.0
+        return (
+            f"local_model: {self.answered}/{self.seen} lokaal ({share:.0f}%, LLM-calls vermeden), "
+            f"{rate:.0f} mails/s, getraind op {self.trained_rows} regels"
+        )
+
+    def save(self, model_file: Path) -> None:
+        model_file.parent.mkdir(parents=True, exist_ok=True)
+        with model_file.open("wb") as f:
+            np.savez_compressed(
+                f,
+                classes=np.array(self.classes),
+                log_prior=self.log_prior,
+                log_prob=self.log_prob,
+                trained_rows=np.array(self.trained_rows),
+            )
+
+    @classmethod
+    def load(cls, model_file: Path) -> LocalModel:
+        with np.load(model_file) as data:
+            return cls(
+                [str(categorie) for categorie in data["classes"]],
+                data["log_prior"],
+                data["log_prob"],
+                trained_rows=int(data["trained_rows"]),
+            )
+
+
+def _load_existing(model_file: Path, logger, run_logger) -> LocalModel | None:
+    if not model_file.is_file():
+        return None
+    try:
+        return LocalModel.load(model_file)
+    except Exception as exc:
+        run_logger.event("local_model_unreadable", f"{model_file}: {exc}")
+        logger.warning("Lokaal model %s onleesbaar (%s); opnieuw trainen", model_file, exc)
+        return None
+
+
+def load_or_train(settings, logger, run_logger) -> LocalModel | None:
+    log_files = sorted(settings.log_dir.glob("log_*.csv"))
+    model_file = settings.local_model_file
+    existing = _load_existing(model_file, logger, run_logger)
+    if existing is not None:
+        # Elke run schrijft een nieuw log; hertrainen gebeurt daarom pas als het model ouder is dan het interval.
+        model_mtime = model_file.stat().st_mtime
+        newest_log = max((path.stat().st_mtime for path in log_files), default=0.0)
+        if model_mtime >= newest_log or time.time() - model_mtime < settings.local_model_retrain_hours * 3600:
+            return existing
+
+    started = time.perf_counter()
+    rows = read_training_rows(log_files)
+    if len(rows) < settings.local_model_min_rows:
+        logger.info("Lokaal model niet getraind: %s van %s benodigde logregels", len(rows), settings.local_model_min_rows)
+        return existing
+    model = LocalModel.train(rows)
+    model.save(model_file)
+    message = f"{len(rows)} regels uit {len(log_files)} logs, {len(model.classes)} categorieen"
+    run_logger.event("local_model_trained", f"{message}, {time.perf_counter() - started:.1f}s")
+    logger.info("Lokaal model getraind: %s", message)
+    return model
@@ -1,7 +1,12 @@
 from __future__ import annotations
 
+import atexit
 import csv
+import io
 import logging
+import queue
+import threading
+import time
 from datetime import date, datetime
 from pathlib import Path
 from typing import Any
@@ -10,6 +15,54 @@ from config import Settings
 
 
 DATETIME_FMT = "%Y-%m-%d %H:%M:%S"
+EMAIL_HEADER = ["log_datum", "email_datum", "categorie", "afzender", "onderwerp", "bron"]
+EVENT_HEADER = ["tijd", "context", "event"]
+
+
+class BufferedLogFile:
+    def __init__(self, path: Path, header: list[str] | None, flush_bytes: int, flush_seconds: float) -> None:
+        self.path = path
+        self.header = header
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self._handle = None
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, delimiter=";")
+        self._last_flush = time.monotonic()
+
+    def write_row(self, row: list) -> None:
+        self._writer.writerow(row)
+        self._maybe_flush()
+
+    def write_text(self, text: str) -> None:
+        self._buffer.write(text)
+        self._maybe_flush()
+
+    def flush(self) -> None:
+        data = self._buffer.getvalue()
+        self._last_flush = time.monotonic()
+        if not data:
+            return
+        if self._handle is None:
+            # Een keer openen en de handle houden; de header alleen bij een nieuw bestand.
+            is_new = not self.path.is_file() or self.path.stat().st_size == 0
+            self._handle = self.path.open("a", newline="", encoding="utf-8")
+            if is_new and self.header:
+                csv.writer(self._handle, delimiter=";").writerow(self.header)
+        self._handle.write(data)
+        self._handle.flush()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    def close(self) -> None:
+        self.flush()
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def _maybe_flush(self) -> None:
+        if self._buffer.tell() >= self.flush_bytes or time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
 
 
 class RunLogger:
@@ -22,43 +75,107 @@ class RunLogger:
         self.gpt_payload_file = self.log_dir / f"gpt_payload_{settings.runstamp}.txt"
         self.log_gpt_payload_enabled = settings.log_gpt_payload
 
+        flush = (settings.log_flush_bytes, settings.log_flush_seconds)
+        self._files = {
+            "email": BufferedLogFile(self.csv_file, EMAIL_HEADER, *flush),
+            "event": BufferedLogFile(self.err_file, EVENT_HEADER, *flush),
+            "payload": BufferedLogFile(self.gpt_payload_file, None, *flush),
+        }
+        # Pipeline-stages loggen vanuit meerdere threads; een lock of een writer-thread houdt regels heel.
+        self._lock = threading.Lock()
+        self._queue: queue.Queue | None = None
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        if settings.log_writer_thread:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._write_loop, name="run-logger", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self) -> RunLogger:
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self.close()
+
     def event(self, context: str, message: str) -> None:
-        file_exists = self.err_file.is_file()
-        with self.err_file.open("a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f, delimiter=";")
-            if not file_exists:
-                writer.writerow(["tijd", "context", "event"])
-            writer.writerow([datetime.now().strftime(DATETIME_FMT), context, message])
+        self._submit("event", [datetime.now().strftime(DATETIME_FMT), context, message])
 
     def email(self, email_datum: Any, categorie: str, afzender: str, onderwerp: str, bron: str) -> None:
-        file_exists = self.csv_file.is_file()
-        with self.csv_file.open("a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f, delimiter=";")
-            if not file_exists:
-                writer.writerow(["log_datum", "email_datum", "categorie", "afzender", "onderwerp", "bron"])
-            writer.writerow(
-                [
-                    datetime.now().strftime(DATETIME_FMT),
-                    self._format_datetime(email_datum),
-                    categorie,
-                    afzender,
-                    onderwerp,
-                    bron,
-                ]
-            )
+        self._submit(
+            "email",
+            [
+                datetime.now().strftime(DATETIME_FMT),
+                self._format_datetime(email_datum),
+                categorie,
+                afzender,
+                onderwerp,
+                bron,
+            ],
+        )
 
     def gpt_payload(self, prompt_json: str, final_user_prompt: str) -> None:
         if not self.log_gpt_payload_enabled:
             return
-        with self.gpt_payload_file.open("a", encoding="utf-8") as f:
-            f.write("\n===============================================\n")
-            f.write("GPT PAYLOAD\n")
-            f.write("===============================================\n\n")
-            f.write("JSON:\n")
-            f.write(prompt_json)
-            f.write("\n\nPROMPT:\n")
-            f.write(final_user_prompt)
-            f.write("\n\n")
+        self._submit(
+            "payload",
+            "\n===============================================\n"
+            "GPT PAYLOAD\n"
+            "===============================================\n\n"
+            f"JSON:\n{prompt_json}\n\nPROMPT:\n{final_user_prompt}\n\n",
+        )
+
+    def flush(self) -> None:
+        if self._queue is not None and not self._closed:
+            self._queue.join()
+        with self._lock:
+            for log_file in self._files.values():
+                log_file.flush()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        if self._queue is not None:
+            self._queue.put(None)
+            self._thread.join()
+        self._closed = True
+        with self._lock:
+            for log_file in self._files.values():
+                log_file.close()
+
+    def _submit(self, kind: str, item) -> None:
+        if self._queue is not None and not self._closed:
+            self._queue.put((kind, item))
+            return
+        with self._lock:
+            self._write(kind, item)
+            if self._closed:
+                self._files[kind].close()
+
+    def _write(self, kind: str, item) -> None:
+        if kind == "payload":
+            self._files[kind].write_text(item)
+        else:
+            self._files[kind].write_row(item)
+
+    def _write_loop(self) -> None:
+        flush_seconds = self._files["event"].flush_seconds or None
+        while True:
+            try:
+                item = self._queue.get(timeout=flush_seconds)
+            except queue.Empty:
+                # Stil moment: de buffer niet langer dan LOG_FLUSH_SECONDS laten staan.
+                with self._lock:
+                    for log_file in self._files.values():
+                        log_file.flush()
+                continue
+            try:
+                if item is None:
+                    return
+                with self._lock:
+                    self._write(*item)
+            finally:
+                self._queue.task_done()
 
     @staticmethod
     def _format_datetime(value: Any) -> str:
@@ -1,201 +1,144 @@
 from __future__ import annotations
 
-import re
+from itertools import chain
 
 from imap_tools import MailBox
 
-from cache_store import SenderCacheStore
+from cache_store import (
+    ImapWatermarkStore,
+    SenderCacheStore,
+    SubjectTemplateCacheStore,
+    VerdictCacheStore,
+    verdict_namespace,
+)
 from classifier import EmailClassifier
-from config import load_settings
-from imap_reader import fetch_in_chunks
-from logging_setup import RunLogger, setup_app_logger
-from policy_engine import (
-    DomainCacheStore,
-    SpamSenderCacheStore,
-    downgrade_blocked_spam,
-    extract_domain_from_sender,
-    extract_sender_email,
-    extract_url_domains,
-    is_obvious_spam,
+from config import headers_first_enabled, load_settings
+from imap_mover import CategoryMover
+from imap_reader import (
+    fetch_in_chunks,
+    fetch_new_uid_slices,
+    fetch_uid_slices,
+    folder_uidvalidity,
+    stream_uid_slices,
 )
+from local_model import LocalModel, load_or_train
+from logging_setup import RunLogger, setup_app_logger
+from metrics import report_metrics
+from pipeline import run_pipeline
+from policy_engine import DomainCacheStore, SpamSenderCacheStore
+from sqlite_cache import CacheDatabase, SqliteSenderCacheStore, SqliteSpamSenderCacheStore
+from processing import process_batch
 
 
-def _move_to_category_folder(box, msg, categorie: str, settings, logger, run_logger, ensured_folders: set[str]) -> None:
-    if not settings.imap_move_by_category:
-        return
-    uid = getattr(msg, "uid", None)
-    if not uid:
-        return
-
-    prefix = settings.imap_category_prefix or ""
-    folder_delim = "/"
-    try:
-        inbox_info = box.folder.list("", "INBOX")
-        if inbox_info and getattr(inbox_info[0], "delim", None):
-            folder_delim = inbox_info[0].delim
-    except Exception:
-        pass
-    normalized_prefix = re.sub(r"[\\/]+", folder_delim, prefix)
-    primary_folder = f"{normalized_prefix}{categorie}"
-
-    def ensure_and_move(target_folder: str) -> None:
-        if target_folder not in ensured_folders:
-            if not box.folder.exists(target_folder):
-                box.folder.create(target_folder)
-                try:
-                    box.folder.subscribe(target_folder, True)
-                except Exception:
-                    pass
-            ensured_folders.add(target_folder)
-        box.move(uid, target_folder)
-
-    try:
-        ensure_and_move(primary_folder)
-    except Exception as exc:
-        err = str(exc)
-        needs_inbox_prefix = (
-            "nonexistent namespace" in err.lower()
-            or "prefixed with: inbox" in err.lower()
+def _iter_chunks(box, settings, logger, run_logger, since_uid: int | None = None):
+    if since_uid is not None:
+        return fetch_new_uid_slices(
+            box=box,
+            last_uid=since_uid,
+            slice_size=settings.fetch_slice_size,
+            max_bytes=settings.fetch_slice_max_bytes,
+            logger=logger,
+            run_logger=run_logger,
+            headers_only=headers_first_enabled(settings),
         )
-        if needs_inbox_prefix and not primary_folder.upper().startswith("INBOX" + folder_delim):
-            fallback_folder = f"INBOX{folder_delim}{primary_folder}"
-            try:
-                ensure_and_move(fallback_folder)
-                run_logger.event("imap_move_retry", f"{uid} -> {fallback_folder} (fallback from {primary_folder})")
-                logger.info("IMAP move fallback gebruikt: %s -> %s", uid, fallback_folder)
-                return
-            except Exception as exc2:
-                run_logger.event("imap_move", f"{uid} -> {fallback_folder}: {exc2}")
-                logger.warning("IMAP move fallback mislukt: %s -> %s (%s)", uid, fallback_folder, exc2)
-                return
-        run_logger.event("imap_move", f"{uid} -> {primary_folder}: {exc}")
-        logger.warning("IMAP move mislukt: %s -> %s (%s)", uid, primary_folder, exc)
-
-
-def process_batch(batch, box, classifier, exact_cache, domain_cache, spam_cache, settings, logger, run_logger) -> None:
-    unknown_items = []
-    final_results = {}
-    should_save_exact = False
-    should_save_spam_cache = False
-    ensured_folders: set[str] = set()
-
-    for idx, msg in enumerate(batch):
-        payload = classifier.build_email_payload(msg, idx)
-        sender = extract_sender_email(msg.from_ or "")
-        from_domain = extract_domain_from_sender(sender)
-        headers = payload.get("headers", {}) or {}
-        body_snippet = payload.get("body_snippet", "")
-        url_domains = extract_url_domains(payload.get("urls", []))
-
-        domain_decision = domain_cache.evaluate(from_domain)
-        spam_forbidden = domain_decision.spam_forbidden
-
-        if domain_decision.forced_category:
-            final_results[idx] = {"categorie": domain_decision.forced_category, "bron": "domain_cache", "sender": sender}
-            continue
-
-        cached_category = exact_cache.get_category(sender)
-        if cached_category:
-            final_results[idx] = {"categorie": cached_category, "bron": "exact_cache", "sender": sender}
-            continue
-
-        if settings.use_spam_sender_cache and spam_cache.eligible_spam(sender, settings.spam_hits_threshold):
-            if spam_forbidden:
-                downgraded = downgrade_blocked_spam(headers)
-                final_results[idx] = {
-                    "categorie": downgraded,
-                    "bron": "spam_blocked_by_domain_cache",
-                    "sender": sender,
-                }
-            else:
-                final_results[idx] = {"categorie": "spam", "bron": "spam_cache", "sender": sender}
-            continue
-
-        if is_obvious_spam(from_domain, msg.subject or "", body_snippet, url_domains):
-            if spam_forbidden:
-                downgraded = downgrade_blocked_spam(headers)
-                final_results[idx] = {
-                    "categorie": downgraded,
-                    "bron": "spam_blocked_by_domain_cache",
-                    "sender": sender,
-                }
-            else:
-                final_results[idx] = {"categorie": "spam", "bron": "guardrail", "sender": sender}
-                if settings.use_spam_sender_cache:
-                    hits = spam_cache.increment_spam_hit(sender, msg.subject or "")
-                    should_save_spam_cache = True
-                    run_logger.event("spam_hits_incremented", f"{sender};hits={hits};bron=guardrail")
-            continue
-
-        unknown_items.append(
-            (
-                idx,
-                msg,
-                sender,
-                spam_forbidden,
-                headers,
-            )
+    if settings.fetch_strategy == "uid":
+        return fetch_uid_slices(
+            box=box,
+            date_from=settings.date_from,
+            date_to=settings.date_to,
+            slice_size=settings.fetch_slice_size,
+            max_bytes=settings.fetch_slice_max_bytes,
+            logger=logger,
+            run_logger=run_logger,
+            headers_only=headers_first_enabled(settings),
         )
+    return fetch_in_chunks(
+        box=box,
+        date_from=settings.date_from,
+        date_to=settings.date_to,
+        step_days=settings.chunk_days,
+        logger=logger,
+        run_logger=run_logger,
+        headers_only=headers_first_enabled(settings),
+    )
 
-    if unknown_items:
-        unknown_batch = [item[1] for item in unknown_items]
-        gpt_results = classifier.batch_classify(unknown_batch)
-        if gpt_results is None:
-            run_logger.event("batch_fail", "GPT batch kon niet worden geclassificeerd")
-            logger.warning("GPT batch kon niet worden geclassificeerd")
-            gpt_results = {}
-
-        for local_idx, unknown_data in enumerate(unknown_items):
-            orig_idx, _orig_msg, sender, spam_forbidden, headers = unknown_data
-            category = gpt_results.get(local_idx, "onbekend")
-            bron = "llm"
-            if category == "spam":
-                if spam_forbidden:
-                    category = downgrade_blocked_spam(headers)
-                    bron = "spam_blocked_by_domain_cache"
-                else:
-                    if settings.use_spam_sender_cache:
-                        hits = spam_cache.increment_spam_hit(sender, (_orig_msg.subject or ""))
-                        should_save_spam_cache = True
-                        run_logger.event("spam_hits_incremented", f"{sender};hits={hits};bron=llm")
-            final_results[orig_idx] = {"categorie": category, "bron": bron, "sender": sender}
-
-    for idx, msg in enumerate(batch):
-        cat_info = final_results.get(idx, {"categorie": "onbekend", "bron": "onbekend", "sender": extract_sender_email(msg.from_ or "")})
-        categorie = cat_info["categorie"]
-        bron = cat_info["bron"]
-        onderwerp = msg.subject or ""
-        afzender = cat_info["sender"] or extract_sender_email(msg.from_ or "")
-
-        if categorie not in {"spam", "onbekend", ""}:
-            exact_cache.update(afzender, categorie, onderwerp)
-            should_save_exact = True
-
-        run_logger.email(
-            email_datum=msg.date,
-            categorie=categorie,
-            afzender=afzender,
-            onderwerp=onderwerp,
-            bron=bron,
-        )
-        logger.info("[%s] %s -> %s (%s)", categorie, onderwerp[:60], afzender, bron)
-        _move_to_category_folder(box, msg, categorie, settings, logger, run_logger, ensured_folders)
 
-    if should_save_exact:
-        exact_cache.save()
-    if should_save_spam_cache:
-        spam_cache.save()
+def _iter_batches(chunks, batch_size: int):
+    # Slices die door FETCH_SLICE_MAX_BYTES klein uitvallen worden weer aangevuld tot batch_size,
+    # anders gaat elke kleine slice als eigen (halflege) LLM-batch door.
+    pending: list = []
+    for chunk in chunks:
+        pending.extend(chunk)
+        while len(pending) >= batch_size:
+            yield pending[:batch_size]
+            pending = pending[batch_size:]
+    if pending:
+        yield pending
+
+
+def _batch_max_uid(batch) -> int:
+    uids = [int(msg.uid) for msg in batch if getattr(msg, "uid", None)]
+    return max(uids) if uids else 0
+
+
+def open_stores(settings, logger, run_logger) -> tuple[SenderCacheStore, DomainCacheStore, SpamSenderCacheStore]:
+    domain_cache = DomainCacheStore(settings.domain_cache_file)
+    if settings.cache_backend == "sqlite":
+        # Eenmalige migratie uit de JSON-bestanden; daarna is de database leidend.
+        db = CacheDatabase(settings.cache_db_file)
+        exact_cache = SqliteSenderCacheStore(db, settings.cache_file, logger=logger, run_logger=run_logger)
+        spam_cache = SqliteSpamSenderCacheStore(db, settings.sender_spam_cache_file, run_logger=run_logger)
+    else:
+        exact_cache = SenderCacheStore(settings.cache_file, logger=logger, run_logger=run_logger)
+        spam_cache = SpamSenderCacheStore(settings.sender_spam_cache_file, run_logger=run_logger)
+    spam_cache.apply_startup_reconciliation(exact_cache, domain_cache)
+    return exact_cache, domain_cache, spam_cache
+
+
+def open_verdict_cache(settings, classifier, run_logger) -> VerdictCacheStore | None:
+    if not settings.use_verdict_cache:
+        return None
+    return VerdictCacheStore(
+        settings.verdict_cache_file,
+        namespace=verdict_namespace(settings.gpt_model, classifier.system_prompt, classifier.classify_prompt),
+        ttl_days=settings.verdict_cache_ttl_days,
+        max_entries=settings.verdict_cache_max_entries,
+        run_logger=run_logger,
+    )
+
+
+def open_template_cache(settings, run_logger) -> SubjectTemplateCacheStore | None:
+    if not settings.use_template_cache:
+        return None
+    return SubjectTemplateCacheStore(
+        settings.template_cache_file, min_votes=settings.template_cache_min_votes, run_logger=run_logger
+    )
+
+
+def open_local_model(settings, logger, run_logger) -> LocalModel | None:
+    if not settings.use_local_model:
+        return None
+    return load_or_train(settings, logger, run_logger)
+
+
+def log_local_model_summary(local_model: LocalModel | None, logger, run_logger) -> None:
+    if local_model is None:
+        return
+    summary = local_model.summary()
+    run_logger.event("local_model_stats", summary)
+    logger.info(summary)
 
 
 def main() -> int:
     settings = load_settings()
     logger = setup_app_logger(settings)
     run_logger = RunLogger(settings)
-    exact_cache = SenderCacheStore(settings.cache_file, logger=logger, run_logger=run_logger)
-    domain_cache = DomainCacheStore(settings.domain_cache_file)
-    spam_cache = SpamSenderCacheStore(settings.sender_spam_cache_file, run_logger=run_logger)
-    spam_cache.apply_startup_reconciliation(exact_cache, domain_cache)
+    exact_cache, domain_cache, spam_cache = open_stores(settings, logger, run_logger)
     classifier = EmailClassifier(settings, logger=logger, run_logger=run_logger)
+    verdict_cache = open_verdict_cache(settings, classifier, run_logger)
+    template_cache = open_template_cache(settings, run_logger)
+    local_model = open_local_model(settings, logger, run_logger)
+    watermark = ImapWatermarkStore(settings.watermark_file, run_logger=run_logger) if settings.incremental else None
 
     logger.info("Verbinden met mailbox")
     logger.info(
@@ -203,21 +146,82 @@ def main() -> int:
         settings.imap_move_by_category,
         settings.imap_category_prefix,
     )
+    logger.info("IMAP fetch strategy=%s incremental=%s", settings.fetch_strategy, settings.incremental)
+    logger.info("Pipeline=%s queue size=%s", settings.pipeline, settings.pipeline_queue_size)
+    if settings.llm_batch_tokens and not settings.pipeline:
+        logger.warning("LLM_BATCH_TOKENS werkt alleen met PIPELINE=true; vaste batches van BATCH_SIZE worden gebruikt")
+    if settings.llm_concurrency > 1 and not settings.pipeline:
+        logger.warning("LLM_CONCURRENCY werkt alleen met PIPELINE=true; GPT-batches gaan een voor een")
+    if settings.llm_stream and settings.pipeline:
+        logger.info("LLM_STREAM met PIPELINE=true: mails worden per GPT-request afgerond, niet per regel")
+    logger.info(
+        "IMAP headers-first fetch=%s partial body=%s",
+        settings.imap_headers_first,
+        settings.imap_partial_body,
+    )
     try:
         with MailBox(settings.imap_host).login(settings.imap_user, settings.imap_password) as box:
-            for chunk in fetch_in_chunks(
-                box=box,
-                date_from=settings.date_from,
-                date_to=settings.date_to,
-                step_days=settings.chunk_days,
-                logger=logger,
-                run_logger=run_logger,
-            ):
-                if not chunk:
-                    continue
-                for start in range(0, len(chunk), settings.batch_size):
-                    batch = chunk[start : start + settings.batch_size]
-                    process_batch(
+            since_uid = None
+            deferred_uids: list[int] = []
+            if watermark is not None:
+                folder, uidvalidity = folder_uidvalidity(box)
+                since_uid = watermark.last_uid(folder, uidvalidity)
+                if since_uid is None:
+                    logger.info("Geen bruikbaar watermark voor %s; volledige datumscan", folder)
+                else:
+                    logger.info("Incrementele run voor %s vanaf UID %s", folder, since_uid + 1)
+                    deferred_uids = watermark.deferred_uids(folder, uidvalidity)
+
+            def on_batch_done(batch) -> None:
+                if watermark is None:
+                    return
+                watermark.advance(folder, uidvalidity, _batch_max_uid(batch))
+                watermark.resolve_deferred(folder, uidvalidity, [msg.uid for msg in batch])
+                # Incrementeel loopt oplopend op UID, dus tussentijds opslaan is veilig;
+                # een datumscan (nieuwste eerst) slaat het watermark pas aan het eind op.
+                if since_uid is not None:
+                    watermark.save()
+
+            def on_deferred(uids) -> None:
+                if watermark is None:
+                    return
+                watermark.defer(folder, uidvalidity, uids)
+                if since_uid is not None:
+                    watermark.save()
+
+            chunks = _iter_chunks(box, settings, logger, run_logger, since_uid=since_uid)
+            if deferred_uids:
+                logger.info("%s uitgestelde mails uit een vorige run opnieuw aangeboden", len(deferred_uids))
+                deferred_chunks = stream_uid_slices(
+                    box,
+                    [str(uid) for uid in deferred_uids],
+                    settings.fetch_slice_size,
+                    settings.fetch_slice_max_bytes,
+                    logger,
+                    run_logger,
+                    headers_only=headers_first_enabled(settings),
+                )
+                chunks = chain(deferred_chunks, chunks)
+            batches = _iter_batches(chunks, settings.batch_size)
+            if settings.pipeline:
+                run_pipeline(
+                    box,
+                    batches,
+                    settings,
+                    classifier,
+                    (exact_cache, domain_cache, spam_cache),
+                    logger,
+                    run_logger,
+                    on_batch_done,
+                    verdict_cache=verdict_cache,
+                    template_cache=template_cache,
+                    local_model=local_model,
+                    on_deferred=on_deferred,
+                )
+            else:
+                mover = CategoryMover(box, settings, logger, run_logger)
+                for batch in batches:
+                    state = process_batch(
                         batch=batch,
                         box=box,
                         classifier=classifier,
@@ -227,12 +231,27 @@ def main() -> int:
                         settings=settings,
                         logger=logger,
                         run_logger=run_logger,
+                        mover=mover,
+                        verdict_cache=verdict_cache,
+                        template_cache=template_cache,
+                        local_model=local_model,
                     )
+                    on_batch_done(batch)
+                    if state.deferred:
+                        on_deferred(state.deferred_uids)
+            if watermark is not None:
+                watermark.save()
+            if verdict_cache is not None:
+                verdict_cache.save()
+            log_local_model_summary(local_model, logger, run_logger)
+            report_metrics(settings, logger, run_logger)
         return 0
     except Exception as exc:
         run_logger.event("main_exception", str(exc))
         logger.exception("Onverwachte fout in main")
         return 1
+    finally:
+        run_logger.close()
 
 
 if __name__ == "__main__":
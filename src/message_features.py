@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Any
+
+from bs4 import BeautifulSoup
+
+from html_text import stream_html_text
+from policy_engine import extract_sender_email, extract_url_domains
+
+
+URL_REGEX = re.compile(r"(https?://[^\s\"'>)]+)", re.IGNORECASE)
+HREF_REGEX = re.compile(r'href=["\']([^"\']+)["\']', re.IGNORECASE)
+AUTH_RESULT_REGEX = re.compile(r"\b(spf|dkim|dmarc)\s*=\s*([a-z0-9_-]+)", re.IGNORECASE)
+WHITESPACE_REGEX = re.compile(r"\s+")
+
+
+@dataclass(slots=True)
+class MessageFeatures:
+    uid: str | None
+    subject: str
+    from_: str
+    to: Any
+    cc: Any
+    date: Any
+    sender: str
+    domain: str
+    snippet: str
+    urls: list[str]
+    url_domains: list[str]
+    headers: dict[str, str]
+
+    def to_payload(self, index: int = 0) -> dict:
+        return {
+            "index": index,
+            "subject": self.subject,
+            "from": self.from_,
+            "to": self.to,
+            "cc": self.cc,
+            "date": self.date.isoformat() if self.date else "",
+            "body_snippet": self.snippet,
+            "urls": self.urls,
+            "headers": self.headers,
+        }
+
+
+def extract_features(msg, max_body_chars: int) -> MessageFeatures:
+    if isinstance(msg, MessageFeatures):
+        return msg
+    sender = extract_sender_email(msg.from_ or "")
+    snippet = _extract_text(msg, max_body_chars)
+    urls = _extract_urls(snippet, msg.html or "")
+    return MessageFeatures(
+        uid=getattr(msg, "uid", None),
+        subject=msg.subject or "",
+        from_=msg.from_,
+        to=getattr(msg, "to", ()),
+        cc=getattr(msg, "cc", ()),
+        date=msg.date,
+        sender=sender,
+        domain=sender.split("@", 1)[1].strip() if "@" in sender else "",
+        snippet=snippet,
+        urls=urls,
+        url_domains=extract_url_domains(urls),
+        headers=_extract_relevant_headers(msg),
+    )
+
+
+def _extract_text(msg, max_chars: int) -> str:
+    body = msg.text or msg.html or ""
+    is_html = any(tag in body.lower() for tag in ("<html", "<body", "<div", "<table", "<span"))
+
+    if is_html:
+        try:
+            return stream_html_text(body, max_chars)
+        except Exception:
+            text = _soup_text(body)
+    else:
+        text = body
+
+    text = WHITESPACE_REGEX.sub(" ", text).strip()
+    return text[:max_chars]
+
+
+def _soup_text(body: str) -> str:
+    try:
+        soup = BeautifulSoup(body, "html.parser")
+        for node in soup(("script", "style", "title", "noscript", "template")):
+            node.extract()
+        return soup.get_text(" ")
+    except Exception:
+        return body
+
+
+def _extract_urls(body: str, html: str) -> list[str]:
+    urls = set()
+    for match in URL_REGEX.findall(body or ""):
+        urls.add(match.strip())
+    if html:
+        for match in HREF_REGEX.findall(html):
+            urls.add(match.strip())
+    return list(urls)
+
+
+def _extract_relevant_headers(msg) -> dict[str, str]:
+    headers = msg.headers
+
+    def norm(value) -> str:
+        if not value:
+            return ""
+        return str(value).strip().lower()
+
+    def first_header(*names: str) -> str:
+        for name in names:
+            values = headers.get(name.lower())
+            if not values:
+                continue
+            if isinstance(values, (tuple, list)):
+                flattened = [str(v).strip() for v in values if str(v).strip()]
+                if flattened:
+                    return "; ".join(flattened)
+            else:
+                value = str(values).strip()
+                if value:
+                    return value
+        return ""
+
+    # Authentication-Results in een keer doorlopen; de eerste waarde per mechanisme telt.
+    auth_results: dict[str, str] = {}
+    for name, value in AUTH_RESULT_REGEX.findall(first_header("Authentication-Results")):
+        auth_results.setdefault(name.lower(), value)
+
+    return {
+        "spf": norm(auth_results.get("spf") or first_header("Received-SPF")),
+        "dkim": norm(auth_results.get("dkim") or first_header("DKIM-Signature")),
+        "dmarc": norm(auth_results.get("dmarc") or first_header("DMARC-Filter")),
+        "return_path": norm(first_header("Return-Path")),
+        "message_id": norm(first_header("Message-ID")),
+        "list_id": norm(first_header("List-ID")),
+        "list_unsubscribe": norm(first_header("List-Unsubscribe")),
+        "precedence": norm(first_header("Precedence")),
+        "x_mailer": norm(first_header("X-Mailer")),
+        "x_spam_flag": norm(first_header("X-Spam-Flag")),
+        "x_spam_status": norm(first_header("X-Spam-Status")),
+    }
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# Emmergrenzen in seconden, van een header-parse tot een trage LLM-call.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROM_FILE_NAME = "emailsorteerder.prom"
+CACHES = ("domain_cache", "exact_cache", "spam_cache", "verdict_cache", "template_cache", "local_model")
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        pos = next((pos for pos, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[pos] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        # Bovengrens van de emmer waarin het kwantiel valt; grof, maar zonder alle waarnemingen te bewaren.
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for pos, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.buckets[pos] if pos < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages: dict[str, Histogram] = {}
+            self.bron: Counter = Counter()
+            self.cache_lookups: Counter = Counter()
+            self.cache_hits: Counter = Counter()
+            self.tokens: Counter = Counter()
+            self.started = time.time()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def count_bron(self, bron: str) -> None:
+        # guardrail:<regel> telt als guardrail; de regelnaam staat al in de run log.
+        with self._lock:
+            self.bron[(bron or "onbekend").split(":", 1)[0]] += 1
+
+    def cache_lookup(self, cache: str, hits: int, lookups: int = 1) -> None:
+        with self._lock:
+            self.cache_lookups[cache] += lookups
+            self.cache_hits[cache] += int(hits)
+
+    def record_usage(self, usage) -> None:
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        with self._lock:
+            self.tokens["prompt"] += int(getattr(usage, "prompt_tokens", 0) or 0)
+            self.tokens["completion"] += int(getattr(usage, "completion_tokens", 0) or 0)
+            self.tokens["cached_prompt"] += int(getattr(details, "cached_tokens", 0) or 0)
+            self.tokens["requests"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "started": self.started,
+                "duration_seconds": round(time.time() - self.started, 3),
+                "stages": {
+                    stage: {
+                        "count": hist.count,
+                        "sum_seconds": round(hist.total, 6),
+                        "p50_seconds": _finite(hist.quantile(0.5)),
+                        "p95_seconds": _finite(hist.quantile(0.95)),
+                        "buckets": dict(zip([str(bound) for bound in hist.buckets] + ["+Inf"], hist.counts)),
+                    }
+                    for stage, hist in sorted(self.stages.items())
+                },
+                "mails_by_bron": dict(sorted(self.bron.items())),
+                "cache": {
+                    cache: {
+                        "lookups": self.cache_lookups[cache],
+                        "hits": self.cache_hits[cache],
+                        "hit_ratio": round(self.cache_hits[cache] / self.cache_lookups[cache], 4),
+                    }
+                    for cache in CACHES
+                    if self.cache_lookups[cache]
+                },
+                "llm_tokens": dict(sorted(self.tokens.items())),
+            }
+
+    def summary_lines(self) -> list[str]:
+        data = self.snapshot()
+        lines = [f"Run duur {data['duration_seconds']:.1f}s"]
+        for stage, entry in data["stages"].items():
+            lines.append(
+                f"  {stage}: {entry['count']}x, totaal {entry['sum_seconds']:.2f}s, "
+                f"p50<={entry['p50_seconds']}s p95<={entry['p95_seconds']}s"
+            )
+        if data["mails_by_bron"]:
+            lines.append("  mails per bron: " + ", ".join(f"{bron}={count}" for bron, count in data["mails_by_bron"].items()))
+        for cache, entry in data["cache"].items():
+            lines.append(f"  {cache}: {entry['hits']}/{entry['lookups']} hits ({entry['hit_ratio']:.0%})")
+        if data["llm_tokens"]:
+            lines.append("  LLM tokens: " + ", ".join(f"{kind}={count}" for kind, count in data["llm_tokens"].items()))
+        return lines
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            lines = [
+                "# HELP emailsorteerder_stage_seconds Latency per stage.",
+                "# TYPE emailsorteerder_stage_seconds histogram",
+            ]
+            for stage, hist in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+                    cumulative += count
+                    lines.append(f'emailsorteerder_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'emailsorteerder_stage_seconds_sum{{stage="{stage}"}} {hist.total:.6f}')
+                lines.append(f'emailsorteerder_stage_seconds_count{{stage="{stage}"}} {hist.count}')
+            lines += ["# HELP emailsorteerder_mails_total Mails per bron.", "# TYPE emailsorteerder_mails_total counter"]
+            lines += [f'emailsorteerder_mails_total{{bron="{bron}"}} {count}' for bron, count in sorted(self.bron.items())]
+            lines += [
+                "# HELP emailsorteerder_cache_lookups_total Cache lookups.",
+                "# TYPE emailsorteerder_cache_lookups_total counter",
+            ]
+            lines += [f'emailsorteerder_cache_lookups_total{{cache="{c}"}} {n}' for c, n in sorted(self.cache_lookups.items())]
+            lines += ["# HELP emailsorteerder_cache_hits_total Cache hits.", "# TYPE emailsorteerder_cache_hits_total counter"]
+            lines += [f'emailsorteerder_cache_hits_total{{cache="{c}"}} {n}' for c, n in sorted(self.cache_hits.items())]
+            lines += ["# HELP emailsorteerder_llm_tokens_total LLM token usage.", "# TYPE emailsorteerder_llm_tokens_total counter"]
+            lines += [f'emailsorteerder_llm_tokens_total{{kind="{kind}"}} {n}' for kind, n in sorted(self.tokens.items())]
+        return "\n".join(lines) + "\n"
+
+    def export(self, log_dir: Path, runstamp: str, textfile_dir: Path) -> tuple[Path, Path]:
+        # Een vaste .prom-naam: de textfile collector leest elk *.prom bestand en zou oude runs dubbel melden.
+        log_dir.mkdir(parents=True, exist_ok=True)
+        textfile_dir.mkdir(parents=True, exist_ok=True)
+        prom_file = textfile_dir / PROM_FILE_NAME
+        json_file = log_dir / f"metrics_{runstamp}.json"
+        # Eerst naar een tijdelijk bestand: de textfile collector mag nooit een half bestand lezen.
+        tmp_file = prom_file.with_suffix(".prom.tmp")
+        tmp_file.write_text(self.prometheus_text(), encoding="utf-8")
+        tmp_file.replace(prom_file)
+        with json_file.open("w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        return prom_file, json_file
+
+
+def _finite(value: float) -> float | None:
+    return None if value == float("inf") else value
+
+
+metrics = Metrics()
+
+
+def report_metrics(settings, logger, run_logger) -> None:
+    for line in metrics.summary_lines():
+        logger.info(line)
+    prom_file, json_file = metrics.export(settings.log_dir, settings.runstamp, settings.metrics_textfile_dir)
+    run_logger.event("metrics", f"{prom_file}, {json_file.name}")
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+from email.utils import parseaddr
+from pathlib import Path
+from urllib.parse import urlparse
+
+
+# Korte sleutels; de legenda staat in prompts/classify_prompt_compact.txt.
+COMPACT_FIELDS = (
+    ("f", "from_email"),
+    ("s", "subject"),
+    ("b", "body_snippet"),
+    ("spf", "spf"),
+    ("dkim", "dkim"),
+    ("dmarc", "dmarc"),
+    ("rp", "return_path_domain"),
+    ("mid", "message_id_domain"),
+    ("lid", "list_id"),
+    ("lu", "list_unsubscribe"),
+    ("pr", "precedence"),
+    ("xs", "x_spam_flag"),
+    ("u", "url_domains"),
+)
+WHITESPACE_REGEX = re.compile(r"\s+")
+AUTH_VERDICT_REGEX = re.compile(r"^(pass|fail|softfail|neutral|none|temperror|permerror|policy|bestguesspass)\b")
+
+
+def signal_fields(payload: dict) -> dict[str, str]:
+    headers = payload.get("headers") or {}
+    _, from_email = parseaddr(str(payload.get("from") or ""))
+    url_domains = []
+    for url in payload.get("urls") or []:
+        host = (urlparse(url).hostname or "").lower()
+        if host and host not in url_domains:
+            url_domains.append(host)
+    return {
+        "from_email": from_email.lower(),
+        "subject": payload.get("subject") or "",
+        "body_snippet": payload.get("body_snippet") or "",
+        "spf": _auth_verdict(headers.get("spf")),
+        "dkim": _auth_verdict(headers.get("dkim")),
+        "dmarc": _auth_verdict(headers.get("dmarc")),
+        "return_path_domain": _address_domain(headers.get("return_path")),
+        "message_id_domain": _address_domain(headers.get("message_id")),
+        "list_id": str(headers.get("list_id") or "").strip("<> "),
+        "list_unsubscribe": "1" if headers.get("list_unsubscribe") else "",
+        "precedence": headers.get("precedence") or "",
+        "x_spam_flag": headers.get("x_spam_flag") or "",
+        "url_domains": ",".join(sorted(url_domains)),
+    }
+
+
+def encode_compact_line(payload: dict) -> str:
+    # Een regel per mail: index gevolgd door key=value velden met tabs ertussen; lege velden vallen weg.
+    signals = signal_fields(payload)
+    parts = [str(payload.get("index", 0))]
+    for key, name in COMPACT_FIELDS:
+        value = WHITESPACE_REGEX.sub(" ", str(signals.get(name) or "")).strip()
+        if value:
+            parts.append(f"{key}={value}")
+    return "\t".join(parts)
+
+
+def encode_payloads(payloads: list[dict], payload_format: str) -> str:
+    if payload_format == "compact":
+        return "\n".join(encode_compact_line(payload) for payload in payloads)
+    return json.dumps(payloads, ensure_ascii=False, default=str)
+
+
+def _auth_verdict(value) -> str:
+    text = str(value or "").strip().lower()
+    if not text:
+        return ""
+    match = AUTH_VERDICT_REGEX.match(text)
+    if match:
+        return match.group(1)
+    # Een ruwe DKIM-Signature header zegt alleen dat er getekend is, niet of de handtekening klopt.
+    return "signed" if "v=1" in text else text.split()[0][:20]
+
+
+def _address_domain(value) -> str:
+    text = str(value or "").strip().strip("<>").lower()
+    if "@" not in text:
+        return ""
+    return text.rsplit("@", 1)[1].strip("<> ")
+
+
+def read_logged_payloads(payload_file: Path) -> list[list[dict]]:
+    batches = []
+    text = payload_file.read_text(encoding="utf-8")
+    for block in text.split("GPT PAYLOAD\n")[1:]:
+        if "JSON:\n" not in block:
+            continue
+        raw = block.split("JSON:\n", 1)[1].split("\n\nPROMPT:\n", 1)[0]
+        try:
+            batches.append(json.loads(raw))
+        except json.JSONDecodeError:
+            continue
+    return batches
+
+
+def measure(payload_files: list[Path]) -> dict[str, float]:
+    from llm_dispatch import estimate_tokens
+
+    mails = json_tokens = compact_tokens = 0
+    for payload_file in payload_files:
+        for batch in read_logged_payloads(payload_file):
+            mails += len(batch)
+            json_tokens += estimate_tokens(encode_payloads(batch, "json"))
+            compact_tokens += estimate_tokens(encode_payloads(batch, "compact"))
+    return {
+        "mails": mails,
+        "json_tokens_per_mail": json_tokens / mails if mails else 0.0,
+        "compact_tokens_per_mail": compact_tokens / mails if mails else 0.0,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Meet tokens per mail van JSON vs compact payload")
+    parser.add_argument("payload_files", nargs="+", type=Path, help="gelogde gpt_payload_*.txt bestanden")
+    args = parser.parse_args()
+
+    stats = measure(args.payload_files)
+    if not stats["mails"]:
+        print("Geen gelogde payloads gevonden (staat LOG_GPT_PAYLOAD aan?)")
+        return 1
+    saving = 1 - stats["compact_tokens_per_mail"] / stats["json_tokens_per_mail"]
+    print(f"Mails: {stats['mails']}")
+    print(f"JSON:    {stats['json_tokens_per_mail']:.1f} tokens/mail")
+    print(f"Compact: {stats['compact_tokens_per_mail']:.1f} tokens/mail ({saving:.0%} minder)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from collections import deque
+
+from imap_tools import MailBox
+
+from imap_mover import CategoryMover
+from llm_dispatch import LlmDispatcher, TokenBudgetBatcher
+from processing import (
+    apply_llm_results,
+    apply_local_model,
+    apply_template_cache,
+    apply_verdict_cache,
+    finalize_batch,
+    resolve_batch,
+)
+
+
+_DONE = object()
+
+
+def run_pipeline(
+    box,
+    batches,
+    settings,
+    classifier,
+    stores,
+    logger,
+    run_logger,
+    on_batch_done,
+    verdict_cache=None,
+    template_cache=None,
+    local_model=None,
+    on_deferred=None,
+) -> None:
+    exact_cache, domain_cache, spam_cache = stores
+    fetched: queue.Queue = queue.Queue(maxsize=settings.pipeline_queue_size)
+    resolved: queue.Queue = queue.Queue(maxsize=settings.pipeline_queue_size)
+    classified: queue.Queue = queue.Queue(maxsize=settings.pipeline_queue_size)
+    # De fetch-sessie wordt gedeeld door producer en policy-stage (body fetch); imaplib is niet thread-safe,
+    # dus de lock dekt alleen de IMAP-calls zelf.
+    box_lock = threading.Lock()
+    stop = threading.Event()
+    errors: list[BaseException] = []
+
+    move_box = None
+    if settings.imap_move_by_category:
+        move_box = MailBox(settings.imap_host).login(settings.imap_user, settings.imap_password)
+    mover = CategoryMover(move_box, settings, logger, run_logger) if move_box is not None else None
+
+    def produce() -> None:
+        iterator = iter(batches)
+        try:
+            while not stop.is_set():
+                with box_lock:
+                    batch = next(iterator, _DONE)
+                if batch is _DONE:
+                    break
+                fetched.put(batch)
+        except Exception as exc:
+            _fail("imap_producer", exc)
+        finally:
+            fetched.put(_DONE)
+
+    def resolve(batch):
+        return resolve_batch(
+            batch, box, classifier, exact_cache, domain_cache, spam_cache, settings, logger, run_logger, box_lock=box_lock
+        )
+
+    def classify() -> None:
+        # Verzamelt onbekende mails over batches heen tot een token-budget (of max wachttijd) en houdt tot
+        # LLM_CONCURRENCY requests tegelijk bij de LLM; batches gaan in binnenkomstvolgorde door.
+        dispatcher = None
+        upstream_done = False
+        in_flight: deque = deque()
+        batcher = TokenBudgetBatcher.from_settings(settings, classifier)
+
+        def emit(completed) -> None:
+            for state, results in completed:
+                apply_llm_results(
+                    state,
+                    results,
+                    logger,
+                    run_logger,
+                    verdict_cache=verdict_cache,
+                    template_cache=template_cache,
+                )
+                classified.put(state)
+
+        def complete_ready(limit: int) -> None:
+            while in_flight and (len(in_flight) > limit or in_flight[0][1].done()):
+                request, future = in_flight.popleft()
+                results = future.result()
+                if results is None:
+                    run_logger.event("batch_fail", f"GPT request met {len(request)} mails kon niet worden geclassificeerd")
+                    logger.warning("GPT request met %s mails kon niet worden geclassificeerd", len(request))
+                emit(batcher.deliver(request, results))
+
+        def dispatch(force: bool) -> None:
+            while batcher.has_pending and (force or batcher.ready(time.monotonic())):
+                request = batcher.take()
+                in_flight.append((request, dispatcher.submit([features for _entry, _idx, features in request])))
+                complete_ready(dispatcher.max_in_flight)
+
+        def next_timeout() -> float | None:
+            timeouts = [0.1] if in_flight else []
+            wait = batcher.wait_timeout(time.monotonic())
+            if wait is not None:
+                timeouts.append(wait)
+            return min(timeouts) if timeouts else None
+
+        try:
+            dispatcher = LlmDispatcher(classifier, settings.llm_concurrency)
+            while True:
+                try:
+                    state = resolved.get(timeout=next_timeout())
+                except queue.Empty:
+                    dispatch(force=False)
+                    complete_ready(dispatcher.max_in_flight)
+                    continue
+                if state is _DONE:
+                    upstream_done = True
+                    break
+                if stop.is_set():
+                    continue
+                apply_verdict_cache(state, verdict_cache)
+                apply_template_cache(state, template_cache)
+                apply_local_model(state, local_model, settings)
+                batcher.add(state, time.monotonic())
+                emit(batcher.pop_completed())
+                dispatch(force=False)
+                complete_ready(dispatcher.max_in_flight)
+            if not stop.is_set():
+                dispatch(force=True)
+                complete_ready(0)
+            if batcher.coalesced:
+                run_logger.event("llm_coalesced", f"{batcher.coalesced} mails kregen het oordeel van een gelijke mail")
+        except Exception as exc:
+            _fail("llm", exc)
+            while not upstream_done and resolved.get() is not _DONE:
+                pass
+        finally:
+            if dispatcher is not None:
+                dispatcher.shutdown()
+            classified.put(_DONE)
+
+    def finalize(state) -> None:
+        finalize_batch(state, move_box, exact_cache, spam_cache, settings, logger, run_logger, mover=mover)
+        on_batch_done(state.batch)
+        if on_deferred is not None and state.deferred:
+            on_deferred(state.deferred_uids)
+
+    def _fail(stage: str, exc: BaseException) -> None:
+        errors.append(exc)
+        stop.set()
+        run_logger.event("pipeline_error", f"{stage}: {exc}")
+        logger.exception("Pipeline fout in stage %s", stage)
+
+    def stage(name: str, inbox: queue.Queue, outbox: queue.Queue | None, handle, finish_queued: bool = False) -> None:
+        # finish_queued: states met een GPT-oordeel worden ook na een fout elders nog gelogd, gecachet en verplaatst;
+        # alleen de stages ervoor stoppen met nieuw werk.
+        try:
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    return
+                if stop.is_set() and not finish_queued:
+                    continue
+                result = handle(item)
+                if outbox is not None:
+                    outbox.put(result)
+        except Exception as exc:
+            _fail(name, exc)
+            while inbox.get() is not _DONE:
+                pass
+        finally:
+            if outbox is not None:
+                outbox.put(_DONE)
+
+    threads = [
+        threading.Thread(target=produce, name="imap-producer"),
+        threading.Thread(target=stage, args=("policy", fetched, resolved, resolve), name="policy"),
+        threading.Thread(target=classify, name="llm"),
+        threading.Thread(target=stage, args=("mover", classified, None, finalize, True), name="mover"),
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if move_box is not None:
+            try:
+                move_box.logout()
+            except Exception:
+                pass
+
+    if errors:
+        raise errors[0]
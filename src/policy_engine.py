@@ -1,14 +1,15 @@
 from __future__ import annotations
 
 import json
-import re
 from dataclasses import dataclass
 from datetime import datetime
 from email.utils import parseaddr
+from functools import lru_cache
 from pathlib import Path
 from urllib.parse import urlparse
 
 from cache_store import SenderCacheStore
+from guardrails import DEFAULT_RULES_FILE, load_guardrails
 from logging_setup import RunLogger
 
 
@@ -36,6 +37,43 @@ def extract_url_domains(urls: list[str]) -> list[str]:
     return result
 
 
+DEFAULT_PUBLIC_SUFFIX_FILE = Path(__file__).resolve().parents[1] / "config" / "public_suffix_list.dat"
+
+
+@lru_cache(maxsize=None)
+def load_public_suffixes(suffix_file: Path = DEFAULT_PUBLIC_SUFFIX_FILE) -> frozenset[str]:
+    if not Path(suffix_file).is_file():
+        return frozenset()
+    rules = set()
+    with Path(suffix_file).open("r", encoding="utf-8") as f:
+        for line in f:
+            rule = line.strip().split(" ", 1)[0].lower()
+            if rule and not rule.startswith("//"):
+                rules.add(rule)
+    return frozenset(rules)
+
+
+def is_public_suffix(domain: str, suffixes: frozenset[str]) -> bool:
+    labels = domain.split(".")
+    if len(labels) == 1:
+        return True
+    if f"!{domain}" in suffixes:
+        return False
+    return domain in suffixes or f"*.{'.'.join(labels[1:])}" in suffixes
+
+
+def parent_domains(domain: str, suffixes: frozenset[str]) -> list[str]:
+    # mail.nieuws.adobe.com -> [mail.nieuws.adobe.com, nieuws.adobe.com, adobe.com]; stopt voor het publieke suffix.
+    labels = (domain or "").strip().strip(".").lower().split(".")
+    result = []
+    for start in range(len(labels)):
+        candidate = ".".join(labels[start:])
+        if not candidate or is_public_suffix(candidate, suffixes):
+            break
+        result.append(candidate)
+    return result
+
+
 @dataclass(frozen=True)
 class DomainDecision:
     forced_category: str | None
@@ -43,12 +81,17 @@ class DomainDecision:
 
 
 class DomainCacheStore:
-    def __init__(self, cache_file: Path) -> None:
+    def __init__(
+        self, cache_file: Path, public_suffix_file: Path = DEFAULT_PUBLIC_SUFFIX_FILE, read_only: bool = False
+    ) -> None:
         self.cache_file = cache_file
-        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
-        if not self.cache_file.exists():
-            self.cache_file.write_text("{}", encoding="utf-8")
-        self._data = self._load()
+        if not read_only:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            if not self.cache_file.exists():
+                self.cache_file.write_text("{}", encoding="utf-8")
+        self._data = {str(domain).lower(): entry for domain, entry in self._load().items()}
+        self._suffixes = load_public_suffixes(public_suffix_file)
+        self._resolved: dict[str, dict | None] = {}
 
     def _load(self) -> dict:
         if not self.cache_file.is_file():
@@ -62,14 +105,32 @@ class DomainCacheStore:
             return {}
         return {}
 
+    def lookup(self, domain: str) -> dict | None:
+        key = (domain or "").lower()
+        if key in self._resolved:
+            return self._resolved[key]
+        # Meest specifieke regel wint: eerst het exacte domein, dan steeds een label eraf tot het publieke suffix.
+        entry = self._data.get(key)
+        if not isinstance(entry, dict):
+            entry = None
+            for candidate in parent_domains(key, self._suffixes)[1:]:
+                if isinstance(self._data.get(candidate), dict):
+                    entry = self._data[candidate]
+                    break
+        self._resolved[key] = entry
+        return entry
+
     def is_spam_forbidden_domain(self, domain: str) -> bool:
-        entry = self._data.get((domain or "").lower())
+        entry = self.lookup(domain)
         if not isinstance(entry, dict):
             return False
         return entry.get("spam") is False
 
+    def spam_forbidden_domains(self) -> list[str]:
+        return [domain for domain, entry in self._data.items() if isinstance(entry, dict) and entry.get("spam") is False]
+
     def evaluate(self, domain: str) -> DomainDecision:
-        entry = self._data.get((domain or "").lower())
+        entry = self.lookup(domain)
         if not isinstance(entry, dict):
             return DomainDecision(forced_category=None, spam_forbidden=False)
 
@@ -183,66 +244,18 @@ class SpamSenderCacheStore:
         return moved_overrides, removed_domain_entries
 
 
-def _is_rare_domain(domain: str) -> bool:
-    if not domain:
-        return True
-    common = {
-        "gmail.com",
-        "outlook.com",
-        "hotmail.com",
-        "yahoo.com",
-        "icloud.com",
-        "google.com",
-        "microsoft.com",
-        "apple.com",
-        "paypal.com",
-        "amazon.com",
-        "bol.com",
-    }
-    d = domain.lower()
-    if d in common:
-        return False
-    if d.count("-") >= 2:
-        return True
-    return bool(re.search(r"\d{3,}", d))
-
-
 def is_obvious_spam(from_domain: str, subject: str, body_snippet: str, url_domains: list[str]) -> bool:
-    text = f"{subject or ''} {body_snippet or ''}".lower()
-
-    gambling_terms = [
-        "casino",
-        "bet",
-        "winplay",
-        "luckythrillz",
-        "gowinspin",
-        "zodiacbet",
-        "bonus",
-        "jackpot",
-        "you won",
-        "crypto-giveaway",
-    ]
-    if any(term in text for term in gambling_terms):
-        return True
+    return guardrail_rule(from_domain, subject, body_snippet, url_domains) is not None
 
-    has_phone = bool(re.search(r"(?:\+?\d[\d\s\-()]{7,}\d)", text))
-    has_call_now = any(term in text for term in ["call now", "call immediately", "bel nu", "bel direct"])
-    has_urgent_payment_verify = any(term in text for term in ["urgent", "betaal", "betaling", "verify", "verifieer"])
-    if has_phone and has_call_now and has_urgent_payment_verify:
-        return True
 
-    receipt_terms = [
-        "receipt",
-        "payment completed",
-        "pdf token",
-        "bookkeeping",
-        "keep your document pdf",
-    ]
-    if any(term in text for term in receipt_terms):
-        if _is_rare_domain(from_domain) or any(_is_rare_domain(d) for d in (url_domains or [])):
-            return True
-
-    return False
+def guardrail_rule(
+    from_domain: str,
+    subject: str,
+    body_snippet: str,
+    url_domains: list[str],
+    rules_file: Path = DEFAULT_RULES_FILE,
+) -> str | None:
+    return load_guardrails(rules_file).match(from_domain, subject, body_snippet, url_domains)
 
 
 def downgrade_blocked_spam(headers: dict[str, str]) -> str:
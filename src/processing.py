@@ -0,0 +1,369 @@
+from __future__ import annotations
+
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+
+from cache_store import payload_fingerprint
+from config import headers_first_enabled
+from imap_mover import CategoryMover
+from imap_reader import fetch_bodies, fetch_partial_bodies
+from llm_dispatch import DEFERRED, coalesce_items
+from message_features import MessageFeatures
+from metrics import metrics
+from policy_engine import downgrade_blocked_spam, guardrail_rule
+
+
+@dataclass
+class BatchState:
+    batch: list
+    final_results: dict[int, dict] = field(default_factory=dict)
+    unknown_items: list[tuple] = field(default_factory=list)
+    fingerprints: dict[int, str] = field(default_factory=dict)
+    deferred: set[int] = field(default_factory=set)
+    finalized: set[int] = field(default_factory=set)
+    # Posities in unknown_items die het oordeel van een gelijke mail kregen; die leren de caches niets nieuws.
+    coalesced: set[int] = field(default_factory=set)
+    learned: bool = False
+
+    @property
+    def deferred_uids(self) -> list[str]:
+        return [self.batch[idx].uid for idx in sorted(self.deferred)]
+
+
+def process_batch(
+    batch,
+    box,
+    classifier,
+    exact_cache,
+    domain_cache,
+    spam_cache,
+    settings,
+    logger,
+    run_logger,
+    mover=None,
+    verdict_cache=None,
+    template_cache=None,
+    local_model=None,
+) -> BatchState:
+    with metrics.timer("batch"):
+        state = resolve_batch(batch, box, classifier, exact_cache, domain_cache, spam_cache, settings, logger, run_logger)
+        apply_verdict_cache(state, verdict_cache)
+        apply_template_cache(state, template_cache)
+        apply_local_model(state, local_model, settings)
+        if settings.imap_move_by_category and mover is None:
+            mover = CategoryMover(box, settings, logger, run_logger)
+
+        on_verdict = None
+        if settings.llm_stream:
+
+            def on_verdict(local_idx: int, category: str) -> None:
+                # Streaming: elk oordeel meteen loggen, in de cache zetten en verplaatsen.
+                record_llm_verdict(state, local_idx, category, verdict_cache, template_cache)
+                orig_idx = state.unknown_items[local_idx][0]
+                move = finalize_mail(state, orig_idx, exact_cache, spam_cache, settings, logger, run_logger)
+                if move is not None and settings.imap_move_by_category:
+                    mover.move_batch([move])
+
+        classify_unknowns(
+            state,
+            classifier,
+            settings,
+            logger,
+            run_logger,
+            verdict_cache=verdict_cache,
+            template_cache=template_cache,
+            on_verdict=on_verdict,
+        )
+        finalize_batch(state, box, exact_cache, spam_cache, settings, logger, run_logger, mover=mover)
+        return state
+
+
+def resolve_batch(
+    batch, box, classifier, exact_cache, domain_cache, spam_cache, settings, logger, run_logger, box_lock=None
+) -> BatchState:
+    with metrics.timer("policy"):
+        return _resolve_batch(
+            batch, box, classifier, exact_cache, domain_cache, spam_cache, settings, logger, run_logger, box_lock
+        )
+
+
+def _resolve_batch(
+    batch, box, classifier, exact_cache, domain_cache, spam_cache, settings, logger, run_logger, box_lock=None
+) -> BatchState:
+    state = BatchState(batch=batch)
+    final_results = state.final_results
+    pending_items = []
+
+    for idx, msg in enumerate(batch):
+        # Features een keer per mail; daarna werkt alles op het compacte record en valt de MailMessage weg.
+        features = classifier.build_features(msg)
+        batch[idx] = features
+        sender = features.sender
+
+        domain_decision = domain_cache.evaluate(features.domain)
+        spam_forbidden = domain_decision.spam_forbidden
+        metrics.cache_lookup("domain_cache", bool(domain_decision.forced_category))
+
+        if domain_decision.forced_category:
+            final_results[idx] = {"categorie": domain_decision.forced_category, "bron": "domain_cache", "sender": sender}
+            continue
+
+        cached_category = exact_cache.get_category(sender)
+        metrics.cache_lookup("exact_cache", bool(cached_category))
+        if cached_category:
+            final_results[idx] = {"categorie": cached_category, "bron": "exact_cache", "sender": sender}
+            continue
+
+        spam_hit = settings.use_spam_sender_cache and spam_cache.eligible_spam(sender, settings.spam_hits_threshold)
+        if settings.use_spam_sender_cache:
+            metrics.cache_lookup("spam_cache", spam_hit)
+        if spam_hit:
+            if spam_forbidden:
+                downgraded = downgrade_blocked_spam(features.headers)
+                final_results[idx] = {
+                    "categorie": downgraded,
+                    "bron": "spam_blocked_by_domain_cache",
+                    "sender": sender,
+                }
+            else:
+                final_results[idx] = {"categorie": "spam", "bron": "spam_cache", "sender": sender}
+            continue
+
+        pending_items.append((idx, spam_forbidden))
+
+    if headers_first_enabled(settings) and pending_items:
+        pending_uids = [batch[idx].uid for idx, _spam_forbidden in pending_items]
+        # Alleen de IMAP-call onder de lock; features en policy lopen parallel aan de fetch van de volgende batch.
+        with box_lock or nullcontext(), metrics.timer("imap_fetch_bodies"):
+            if settings.imap_partial_body:
+                bodies = fetch_partial_bodies(box, pending_uids, settings.max_body_chars, logger, run_logger)
+            else:
+                bodies = fetch_bodies(box, pending_uids, logger, run_logger)
+        for idx, _spam_forbidden in pending_items:
+            full_msg = bodies.get(batch[idx].uid)
+            if full_msg is not None:
+                batch[idx] = classifier.build_features(full_msg)
+
+    for idx, spam_forbidden in pending_items:
+        features = batch[idx]
+        rule = guardrail_rule(
+            features.domain,
+            features.subject,
+            features.snippet,
+            features.url_domains,
+            rules_file=settings.guardrail_rules_file,
+        )
+        if rule:
+            if spam_forbidden:
+                downgraded = downgrade_blocked_spam(features.headers)
+                final_results[idx] = {
+                    "categorie": downgraded,
+                    "bron": "spam_blocked_by_domain_cache",
+                    "sender": features.sender,
+                }
+            else:
+                final_results[idx] = {
+                    "categorie": "spam",
+                    "bron": f"guardrail:{rule}",
+                    "sender": features.sender,
+                    "spam_hit": True,
+                }
+            continue
+
+        state.unknown_items.append((idx, features, spam_forbidden))
+    return state
+
+
+def apply_verdict_cache(state: BatchState, verdict_cache) -> None:
+    if verdict_cache is None or not state.unknown_items:
+        return
+    remaining = []
+    for item in state.unknown_items:
+        orig_idx, features, spam_forbidden = item
+        key = payload_fingerprint(features.to_payload(orig_idx))
+        state.fingerprints[orig_idx] = key
+        cached = verdict_cache.get(key)
+        if cached:
+            state.final_results[orig_idx] = _verdict_result(cached, "verdict_cache", features, spam_forbidden)
+        else:
+            remaining.append(item)
+    metrics.cache_lookup("verdict_cache", len(state.unknown_items) - len(remaining), len(state.unknown_items))
+    state.unknown_items = remaining
+
+
+def apply_template_cache(state: BatchState, template_cache) -> None:
+    if template_cache is None or not state.unknown_items:
+        return
+    remaining = []
+    for item in state.unknown_items:
+        orig_idx, features, spam_forbidden = item
+        cached = template_cache.get(features.domain, features.subject)
+        if cached:
+            state.final_results[orig_idx] = _verdict_result(cached, "template_cache", features, spam_forbidden)
+        else:
+            remaining.append(item)
+    metrics.cache_lookup("template_cache", len(state.unknown_items) - len(remaining), len(state.unknown_items))
+    state.unknown_items = remaining
+
+
+def apply_local_model(state: BatchState, local_model, settings) -> None:
+    if local_model is None or not state.unknown_items:
+        return
+    predictions = local_model.classify([item[1] for item in state.unknown_items], settings.local_model_threshold)
+    remaining = []
+    for item, predicted in zip(state.unknown_items, predictions):
+        orig_idx, features, spam_forbidden = item
+        if predicted:
+            state.final_results[orig_idx] = _verdict_result(predicted, "local_model", features, spam_forbidden)
+        else:
+            remaining.append(item)
+    metrics.cache_lookup("local_model", len(state.unknown_items) - len(remaining), len(state.unknown_items))
+    state.unknown_items = remaining
+
+
+def classify_unknowns(
+    state: BatchState, classifier, settings, logger, run_logger, verdict_cache=None, template_cache=None, on_verdict=None
+) -> None:
+    if not state.unknown_items:
+        return
+    unknown_batch = [item[1] for item in state.unknown_items]
+    if settings.llm_coalesce:
+        leaders, members = coalesce_items(unknown_batch)
+    else:
+        leaders, members = list(range(len(unknown_batch))), [[pos] for pos in range(len(unknown_batch))]
+    state.coalesced.update(local_idx for group in members for local_idx in group[1:])
+    if len(leaders) < len(unknown_batch):
+        run_logger.event("llm_coalesced", f"{len(unknown_batch)} mails, {len(leaders)} naar de LLM")
+
+    fan_out = None
+    if on_verdict is not None:
+
+        def fan_out(leader_pos: int, category: str) -> None:
+            for local_idx in members[leader_pos]:
+                on_verdict(local_idx, category)
+
+    leader_batch = [unknown_batch[pos] for pos in leaders]
+    if fan_out is None:
+        leader_results = classifier.batch_classify(leader_batch)
+    else:
+        leader_results = classifier.batch_classify(leader_batch, on_result=fan_out)
+    gpt_results = None
+    if leader_results is not None:
+        gpt_results = {
+            local_idx: category
+            for leader_pos, category in leader_results.items()
+            for local_idx in members[leader_pos]
+        }
+    apply_llm_results(state, gpt_results, logger, run_logger, verdict_cache=verdict_cache, template_cache=template_cache)
+
+
+def apply_llm_results(
+    state: BatchState,
+    gpt_results: dict[int, str] | None,
+    logger,
+    run_logger,
+    verdict_cache=None,
+    template_cache=None,
+) -> None:
+    if gpt_results is None:
+        run_logger.event("batch_fail", "GPT batch kon niet worden geclassificeerd")
+        logger.warning("GPT batch kon niet worden geclassificeerd")
+        gpt_results = {}
+
+    for local_idx, (orig_idx, _features, _spam_forbidden) in enumerate(state.unknown_items):
+        if orig_idx in state.finalized:
+            continue
+        record_llm_verdict(state, local_idx, gpt_results.get(local_idx, "onbekend"), verdict_cache, template_cache)
+    if state.learned:
+        if verdict_cache is not None:
+            verdict_cache.save()
+        if template_cache is not None:
+            template_cache.save()
+
+
+def record_llm_verdict(state: BatchState, local_idx: int, category: str, verdict_cache=None, template_cache=None) -> None:
+    orig_idx, features, spam_forbidden = state.unknown_items[local_idx]
+    if category == DEFERRED:
+        state.deferred.add(orig_idx)
+        return
+    state.final_results[orig_idx] = _verdict_result(category, "llm", features, spam_forbidden)
+    if category in {"onbekend", ""} or local_idx in state.coalesced:
+        return
+    if verdict_cache is not None and orig_idx in state.fingerprints:
+        verdict_cache.put(state.fingerprints[orig_idx], category)
+        state.learned = True
+    if template_cache is not None:
+        template_cache.vote(features.domain, features.subject, category)
+        state.learned = True
+
+
+def _verdict_result(category: str, bron: str, features: MessageFeatures, spam_forbidden: bool) -> dict:
+    result = {"categorie": category, "bron": bron, "sender": features.sender}
+    if bron == "local_model":
+        # Lokale oordelen niet in exact/spam cache: die regels zouden bij hertrainen als betrouwbare bron terugkomen.
+        result["untrusted"] = True
+    if category == "spam":
+        if spam_forbidden:
+            result["categorie"] = downgrade_blocked_spam(features.headers)
+            result["bron"] = "spam_blocked_by_domain_cache"
+        elif not result.get("untrusted"):
+            result["spam_hit"] = True
+    return result
+
+
+def finalize_batch(state: BatchState, box, exact_cache, spam_cache, settings, logger, run_logger, mover=None) -> None:
+    moves: list[tuple[str, str]] = []
+    for idx in range(len(state.batch)):
+        if idx in state.finalized:
+            continue
+        move = finalize_mail(state, idx, exact_cache, spam_cache, settings, logger, run_logger)
+        if move is not None:
+            moves.append(move)
+
+    if state.deferred:
+        run_logger.event("llm_deferred", f"{len(state.deferred)} mails uitgesteld: {','.join(state.deferred_uids)}")
+
+    if settings.imap_move_by_category:
+        if mover is None:
+            mover = CategoryMover(box, settings, logger, run_logger)
+        mover.move_batch(moves)
+
+    results = [state.final_results.get(idx, {}) for idx in state.finalized]
+    if any(
+        result.get("categorie") not in {None, "spam", "onbekend", ""} and not result.get("untrusted") for result in results
+    ):
+        exact_cache.save()
+    if settings.use_spam_sender_cache and any(result.get("spam_hit") for result in results):
+        spam_cache.save()
+
+
+def finalize_mail(state: BatchState, idx: int, exact_cache, spam_cache, settings, logger, run_logger) -> tuple[str, str] | None:
+    features = state.batch[idx]
+    if idx in state.deferred:
+        # Geen log, cache of move: de mail blijft staan voor een volgende run.
+        logger.info("[%s] %s -> %s", DEFERRED, features.subject[:60], features.sender)
+        return None
+    state.finalized.add(idx)
+    cat_info = state.final_results.get(idx, {"categorie": "onbekend", "bron": "onbekend", "sender": features.sender})
+    categorie = cat_info["categorie"]
+    bron = cat_info["bron"]
+    onderwerp = features.subject
+    afzender = cat_info["sender"] or features.sender
+
+    if cat_info.get("spam_hit") and settings.use_spam_sender_cache:
+        hits = spam_cache.increment_spam_hit(afzender, onderwerp)
+        run_logger.event("spam_hits_incremented", f"{afzender};hits={hits};bron={bron}")
+
+    if categorie not in {"spam", "onbekend", ""} and not cat_info.get("untrusted"):
+        exact_cache.update(afzender, categorie, onderwerp)
+
+    metrics.count_bron(bron)
+    run_logger.email(
+        email_datum=features.date,
+        categorie=categorie,
+        afzender=afzender,
+        onderwerp=onderwerp,
+        bron=bron,
+    )
+    logger.info("[%s] %s -> %s (%s)", categorie, onderwerp[:60], afzender, bron)
+    return features.uid, categorie
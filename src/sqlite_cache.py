@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from logging_setup import RunLogger
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sender_exact (
+    sender TEXT PRIMARY KEY,
+    categorie TEXT NOT NULL,
+    subject TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sender_spam (
+    sender TEXT PRIMARY KEY,
+    domain TEXT NOT NULL,
+    spam_hits INTEGER NOT NULL DEFAULT 0,
+    last_seen TEXT NOT NULL DEFAULT '',
+    manual_override TEXT,
+    subject TEXT NOT NULL DEFAULT '(geen subject)'
+);
+CREATE INDEX IF NOT EXISTS sender_spam_domain ON sender_spam (domain);
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    migrated_at TEXT NOT NULL
+);
+"""
+
+
+class CacheDatabase:
+    def __init__(self, db_file: Path) -> None:
+        self.db_file = db_file
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        # De pipeline leest in de policy-thread en schrijft in de mover-thread; een lock serialiseert de connectie.
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(str(db_file), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def execute(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def write(self, sql: str, rows: list[tuple]) -> None:
+        if not rows:
+            return
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(sql, rows)
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def migrate_json(self, name: str, json_file: Path, sql: str, rows_from_json) -> int | None:
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM migrations WHERE name = ?", (name,)).fetchone():
+                return None
+            raw = _read_json(json_file)
+            rows = rows_from_json(raw)
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(sql, rows)
+                self.conn.execute(
+                    "INSERT INTO migrations (name, source, rows, migrated_at) VALUES (?, ?, ?, ?)",
+                    (name, str(json_file), len(rows), datetime.now().isoformat(timespec="seconds")),
+                )
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return len(rows)
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class SqliteSenderCacheStore:
+    UPSERT = (
+        "INSERT INTO sender_exact (sender, categorie, subject) VALUES (?, ?, ?) "
+        "ON CONFLICT(sender) DO UPDATE SET categorie = excluded.categorie, subject = excluded.subject"
+    )
+
+    def __init__(self, db: CacheDatabase, json_file: Path, logger: logging.Logger, run_logger: RunLogger) -> None:
+        self.db = db
+        self.logger = logger
+        self.run_logger = run_logger
+        self._loaded: dict[str, dict[str, str] | None] = {}
+        self._dirty: set[str] = set()
+        migrated = db.migrate_json("sender_exact", json_file, self.UPSERT, _exact_rows)
+        if migrated is not None:
+            self.logger.info("Sender cache gemigreerd naar SQLite: %s regels", migrated)
+            self.run_logger.event("cache_migrate", f"sender_exact: {migrated} regels uit {json_file}")
+
+    def get_category(self, sender: str) -> str | None:
+        item = self._get((sender or "").lower())
+        if not item:
+            return None
+        categorie = str(item.get("categorie") or "").strip().lower()
+        if categorie == "spam":
+            return None
+        return categorie or None
+
+    def update(self, sender: str, categorie: str, subject: str) -> None:
+        normalized_sender = (sender or "").strip().lower()
+        normalized_categorie = (categorie or "onbekend").strip().lower()
+        if not normalized_sender:
+            return
+        if normalized_categorie == "spam":
+            return
+        self._loaded[normalized_sender] = {
+            "categorie": normalized_categorie,
+            "subject": subject or "(geen subject)",
+        }
+        self._dirty.add(normalized_sender)
+
+    def save(self) -> None:
+        dirty, self._dirty = self._dirty, set()
+        rows = [(sender, self._loaded[sender]["categorie"], self._loaded[sender]["subject"]) for sender in dirty]
+        self.db.write(self.UPSERT, rows)
+
+    def items(self):
+        self.save()
+        for sender, categorie, subject in self.db.execute("SELECT sender, categorie, subject FROM sender_exact"):
+            yield sender, {"categorie": categorie, "subject": subject}
+
+    def _get(self, sender: str) -> dict[str, str] | None:
+        if sender not in self._loaded:
+            rows = self.db.execute("SELECT categorie, subject FROM sender_exact WHERE sender = ?", (sender,))
+            self._loaded[sender] = {"categorie": rows[0][0], "subject": rows[0][1]} if rows else None
+        return self._loaded[sender]
+
+
+class SqliteSpamSenderCacheStore:
+    UPSERT = (
+        "INSERT INTO sender_spam (sender, domain, spam_hits, last_seen, manual_override, subject) "
+        "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(sender) DO UPDATE SET domain = excluded.domain, "
+        "spam_hits = excluded.spam_hits, last_seen = excluded.last_seen, "
+        "manual_override = excluded.manual_override, subject = excluded.subject"
+    )
+
+    def __init__(self, db: CacheDatabase, json_file: Path, run_logger: RunLogger | None = None) -> None:
+        self.db = db
+        self.run_logger = run_logger
+        self._loaded: dict[str, dict | None] = {}
+        self._dirty: set[str] = set()
+        migrated = db.migrate_json("sender_spam", json_file, self.UPSERT, _spam_rows)
+        if migrated is not None and self.run_logger:
+            self.run_logger.event("cache_migrate", f"sender_spam: {migrated} regels uit {json_file}")
+
+    def save(self) -> None:
+        dirty, self._dirty = self._dirty, set()
+        rows = [_spam_row(sender, self._loaded[sender]) for sender in dirty]
+        self.db.write(self.UPSERT, rows)
+
+    def eligible_spam(self, sender: str, threshold: int) -> bool:
+        entry = self._get(sender.lower())
+        if not entry:
+            return False
+        if entry.get("manual_override") not in (None, "", "spam"):
+            return False
+        return int(entry.get("spam_hits", 0) or 0) >= threshold
+
+    def increment_spam_hit(self, sender: str, subject: str) -> int:
+        key = sender.lower()
+        entry = self._get(key)
+        if entry is None:
+            entry = {"spam_hits": 0, "last_seen": "", "manual_override": None, "subject": "(geen subject)"}
+            self._loaded[key] = entry
+        entry["spam_hits"] = int(entry.get("spam_hits", 0) or 0) + 1
+        entry["last_seen"] = datetime.now().date().isoformat()
+        entry["subject"] = (subject or "(geen subject)").strip() or "(geen subject)"
+        self._dirty.add(key)
+        return entry["spam_hits"]
+
+    def apply_startup_reconciliation(self, sender_exact_cache, domain_cache) -> tuple[int, int]:
+        # Alleen de relevante rijen ophalen; de rest van de tabel blijft op schijf.
+        overrides = self.db.execute(
+            "SELECT sender, manual_override FROM sender_spam "
+            "WHERE manual_override IS NOT NULL AND manual_override != '' AND lower(manual_override) != 'spam'"
+        )
+        for sender, manual_override in overrides:
+            sender_exact_cache.update(sender, manual_override.strip().lower(), "(manual_override)")
+        override_senders = {sender for sender, _ in overrides}
+
+        blocked = []
+        forbidden_domains = list(domain_cache.spam_forbidden_domains())
+        for start in range(0, len(forbidden_domains), 200):
+            chunk = forbidden_domains[start : start + 200]
+            where = " OR ".join("domain = ? OR domain LIKE ?" for _ in chunk)
+            params = tuple(value for domain in chunk for value in (domain, f"%.{domain}"))
+            # Subdomeinen via LIKE voorselecteren; de domain cache beslist welke regel het meest specifiek is.
+            blocked.extend(
+                sender
+                for sender, domain in self.db.execute(f"SELECT sender, domain FROM sender_spam WHERE {where}", params)
+                if sender not in override_senders and domain_cache.is_spam_forbidden_domain(domain)
+            )
+        blocked = list(dict.fromkeys(blocked))
+
+        removed = list(override_senders) + blocked
+        self.db.write("DELETE FROM sender_spam WHERE sender = ?", [(sender,) for sender in removed])
+        for sender in removed:
+            self._loaded[sender] = None
+            self._dirty.discard(sender)
+
+        if overrides:
+            sender_exact_cache.save()
+        if self.run_logger:
+            if overrides:
+                self.run_logger.event("startup_reconcile", f"manual_override->exact: {len(overrides)}")
+            if blocked:
+                self.run_logger.event("startup_reconcile", f"spam_cache_removed_by_domain: {len(blocked)}")
+        return len(overrides), len(blocked)
+
+    def _get(self, sender: str) -> dict | None:
+        if sender not in self._loaded:
+            rows = self.db.execute(
+                "SELECT spam_hits, last_seen, manual_override, subject FROM sender_spam WHERE sender = ?", (sender,)
+            )
+            self._loaded[sender] = (
+                {"spam_hits": rows[0][0], "last_seen": rows[0][1], "manual_override": rows[0][2], "subject": rows[0][3]}
+                if rows
+                else None
+            )
+        return self._loaded[sender]
+
+
+def read_sender_items(db_file: Path | None, json_file: Path) -> list[tuple[str, dict[str, str]]]:
+    # Voor rapportages: geen schema, migratie of upgrade, dus de cachebestanden blijven onaangeroerd.
+    rows = None
+    if db_file is not None and db_file.is_file():
+        try:
+            conn = sqlite3.connect(f"{db_file.resolve().as_uri()}?mode=ro", uri=True)
+            try:
+                if conn.execute("SELECT 1 FROM migrations WHERE name = 'sender_exact'").fetchone():
+                    rows = conn.execute("SELECT sender, categorie, subject FROM sender_exact").fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            rows = None
+    if rows is None:
+        rows = _exact_rows(_read_json(json_file))
+    return [(sender, {"categorie": categorie, "subject": subject}) for sender, categorie, subject in rows]
+
+
+def _read_json(json_file: Path) -> dict:
+    if not json_file.is_file():
+        return {}
+    try:
+        with json_file.open("r", encoding="utf-8") as f:
+            raw = json.load(f)
+    except Exception:
+        return {}
+    return raw if isinstance(raw, dict) else {}
+
+
+def _exact_rows(raw: dict) -> list[tuple]:
+    rows = []
+    for sender, value in raw.items():
+        sender_key = str(sender).strip().lower()
+        if isinstance(value, str):
+            rows.append((sender_key, value, "(onbekend)"))
+        elif isinstance(value, dict):
+            rows.append((sender_key, value.get("categorie", "onbekend"), value.get("subject", "(onbekend)")))
+        else:
+            rows.append((sender_key, "onbekend", "(onbekend)"))
+    return rows
+
+
+def _spam_rows(raw: dict) -> list[tuple]:
+    rows = []
+    for sender, value in raw.items():
+        entry = value if isinstance(value, dict) else {}
+        rows.append(
+            _spam_row(
+                str(sender).lower(),
+                {
+                    "spam_hits": int(entry.get("spam_hits", 0) or 0),
+                    "last_seen": str(entry.get("last_seen", "")),
+                    "manual_override": entry.get("manual_override"),
+                    "subject": str(entry.get("subject", "(geen subject)") or "(geen subject)"),
+                },
+            )
+        )
+    return rows
+
+
+def _spam_row(sender: str, entry: dict) -> tuple:
+    domain = sender.split("@", 1)[1] if "@" in sender else ""
+    return (
+        sender,
+        domain,
+        int(entry.get("spam_hits", 0) or 0),
+        entry.get("last_seen", ""),
+        entry.get("manual_override"),
+        entry.get("subject", "(geen subject)"),
+    )
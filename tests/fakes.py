@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+from guardrails import DEFAULT_RULES_FILE
+from message_features import extract_features
+
+
+# Gedeelde test-doubles voor processing en pipeline; pytest zet tests/ op sys.path.
+
+
+class DummyRunLogger:
+    def __init__(self) -> None:
+        self.events = []
+        self.emails = []
+
+    def event(self, context: str, message: str) -> None:
+        self.events.append((context, message))
+
+    def email(self, **kwargs) -> None:
+        self.emails.append(kwargs)
+
+    def flush(self) -> None:
+        return
+
+
+class FakeMsg:
+    def __init__(self, uid: str, subject: str | None = None, sender: str | None = None, body: str = "") -> None:
+        self.uid = uid
+        self.from_ = sender or f"user{uid}@example.com"
+        self.subject = f"Mail {uid}" if subject is None else subject
+        self.text = body
+        self.html = ""
+        self.date = None
+        self.headers = {}
+
+
+class FakeClock:
+    def __init__(self, now: float = 0.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class StopSession(Exception):
+    pass
+
+
+class FakeMailbox:
+    # Scriptbare IMAP-sessie: elke idle.wait voert de volgende stap uit en laat de klok lopen.
+    def __init__(self, uids: list[str], steps: list, clock: FakeClock, uidvalidity: int = 7) -> None:
+        self.messages = {uid: FakeMsg(uid) for uid in uids}
+        self.steps = list(steps)
+        self.clock = clock
+        self.fetched = []
+        self.noops = 0
+        self.folder = SimpleNamespace(
+            get=lambda: "INBOX",
+            status=lambda _folder, _items: {"UIDVALIDITY": uidvalidity},
+        )
+        self.idle = SimpleNamespace(wait=self._idle_wait)
+        self.client = SimpleNamespace(noop=self._noop)
+
+    def deliver(self, *uids: str) -> None:
+        for uid in uids:
+            self.messages[uid] = FakeMsg(uid)
+
+    def uids(self, _criteria: str) -> list[str]:
+        return list(self.messages)
+
+    def fetch(self, uid_list=None, bulk=False, **_kwargs):
+        self.fetched.append(list(uid_list))
+        return [self.messages[uid] for uid in uid_list]
+
+    def _idle_wait(self, timeout: float):
+        if not self.steps:
+            raise StopSession()
+        return self.steps.pop(0)(self, timeout)
+
+    def _noop(self) -> None:
+        self.noops += 1
+
+
+class FakeClassifier:
+    def __init__(self, category: str = "updates", fail_on_uid: str | None = None) -> None:
+        self.category = category
+        self.fail_on_uid = fail_on_uid
+        self.classified = []
+        self.batch_sizes = []
+        self.system_prompt = "systeem"
+        self.classify_prompt = "{emails_json}"
+
+    def build_features(self, msg):
+        return extract_features(msg, 500)
+
+    def batch_classify(self, batch, on_result=None):
+        self.batch_sizes.append(len(batch))
+        # Met LLM_CONCURRENCY=2 is de volgorde van calls niet vast; faal op inhoud, niet op volgnummer.
+        if any(features.uid == self.fail_on_uid for features in batch):
+            raise RuntimeError("LLM stage kapot")
+        self.classified.extend(batch)
+        return {idx: self.category for idx in range(len(batch))}
+
+
+class FakeStore:
+    # Exact, domain en spam cache in een: alleen afzenders in known hebben een categorie.
+    def __init__(self, known: dict[str, str] | None = None) -> None:
+        self.known = known or {}
+
+    def get_category(self, sender: str):
+        return self.known.get(sender)
+
+    def evaluate(self, _domain: str):
+        return SimpleNamespace(forced_category=None, spam_forbidden=False)
+
+    def eligible_spam(self, _sender: str, _threshold: int) -> bool:
+        return False
+
+    def update(self, *_args) -> None:
+        return
+
+    def save(self) -> None:
+        return
+
+
+def processing_settings(**overrides) -> SimpleNamespace:
+    settings = SimpleNamespace(
+        pipeline_queue_size=1,
+        llm_concurrency=2,
+        llm_batch_tokens=0,
+        llm_batch_max_wait=2.0,
+        llm_context_tokens=128000,
+        llm_max_output_tokens=16384,
+        llm_payload_format="json",
+        imap_move_by_category=False,
+        llm_stream=False,
+        llm_coalesce=True,
+        imap_headers_first=False,
+        imap_partial_body=False,
+        use_spam_sender_cache=True,
+        spam_hits_threshold=2,
+        guardrail_rules_file=DEFAULT_RULES_FILE,
+    )
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    return settings
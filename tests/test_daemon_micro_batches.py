@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import logging
+
+import pytest
+
+import daemon
+from cache_store import ImapWatermarkStore
+from daemon import MicroBatchWindow
+from fakes import DummyRunLogger, FakeClassifier, FakeClock, FakeMailbox, FakeStore, StopSession, processing_settings
+
+
+def test_single_mail_flushes_after_latency_cap():
+    window = MicroBatchWindow(batch_size=30, max_latency=5)
+    window.add(["101"], now=100.0)
+
+    assert window.ready(now=102.0) is False
+    assert window.wait_timeout(now=102.0, idle_timeout=300) == 3.0
+    assert window.ready(now=105.0) is True
+    assert window.take() == ["101"]
+    assert window.wait_timeout(now=106.0, idle_timeout=300) == 300
+
+
+def test_full_batch_flushes_immediately_and_keeps_remainder():
+    window = MicroBatchWindow(batch_size=2, max_latency=5)
+    window.add(["1", "2", "3"], now=10.0)
+
+    assert window.ready(now=10.0) is True
+    assert window.take() == ["1", "2"]
+    assert window.uids == ["3"]
+    assert window.ready(now=10.0) is False
+
+
+def test_session_flushes_new_mail_after_latency_and_saves_watermark(tmp_path, monkeypatch):
+    clock = FakeClock(100.0)
+    monkeypatch.setattr(daemon.time, "monotonic", clock)
+    watermark_file = tmp_path / "watermark.json"
+    watermark = ImapWatermarkStore(watermark_file)
+    watermark.advance("INBOX", 7, 10)
+    watermark.save()
+    saved_before_flush = []
+
+    def new_mail(box, _timeout):
+        clock.now += 1
+        box.deliver("11")
+        return [b"* 11 EXISTS"]
+
+    def quiet(_box, timeout):
+        saved_before_flush.append(ImapWatermarkStore(watermark_file).last_uid("INBOX", 7))
+        clock.now += timeout
+        return []
+
+    box = FakeMailbox([str(uid) for uid in range(1, 11)], [new_mail, quiet], clock)
+    classifier = FakeClassifier()
+    settings = processing_settings(
+        llm_concurrency=1,
+        batch_size=30,
+        fetch_slice_max_bytes=0,
+        daemon_max_latency=5,
+        daemon_keepalive_seconds=300,
+        log_dir=tmp_path / "logs",
+        runstamp="test",
+        metrics_textfile_dir=tmp_path / "metrics",
+    )
+
+    with pytest.raises(StopSession):
+        daemon._run_session(
+            box,
+            settings,
+            classifier,
+            (FakeStore(), FakeStore(), FakeStore()),
+            watermark,
+            (None, None, None),
+            logging.getLogger("test"),
+            DummyRunLogger(),
+        )
+
+    # Mail 11 komt binnen op t=101 en gaat pas mee als de latency-grens van 5s verstreken is.
+    assert saved_before_flush == [10]
+    assert clock.now == 106.0
+    assert box.fetched == [["11"]]
+    assert [features.uid for features in classifier.classified] == ["11"]
+    assert ImapWatermarkStore(watermark_file).last_uid("INBOX", 7) == 11
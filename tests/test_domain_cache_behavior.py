@@ -38,3 +38,26 @@ def test_domain_cache_spam_false_without_category_blocks_spam_and_downgrades(tmp
     downgrade_promotions = downgrade_blocked_spam({"list_unsubscribe": "", "list_id": "", "precedence": ""})
     assert downgrade_updates == "updates"
     assert downgrade_promotions == "promotions"
+
+
+def test_domain_cache_matches_parent_domain_most_specific_wins(tmp_path):
+    cache_file = tmp_path / "domain_cache.json"
+    cache_file.write_text(
+        json.dumps(
+            {
+                "adobe.com": {"spam": False, "category": "updates"},
+                "promo.adobe.com": {"spam": True, "category": None},
+                "shop.co.uk": {"spam": False, "category": "purchases"},
+                "co.uk": {"spam": True, "category": None},
+            }
+        ),
+        encoding="utf-8",
+    )
+    store = DomainCacheStore(cache_file)
+
+    assert store.evaluate("mail.nieuwsbrief.adobe.com").forced_category == "updates"
+    assert store.evaluate("x.promo.adobe.com").forced_category == "spam"
+    assert store.evaluate("mail.shop.co.uk").forced_category == "purchases"
+    assert store.evaluate("other.co.uk").forced_category is None
+    assert store.evaluate("notadobe.com").forced_category is None
+    assert store.is_spam_forbidden_domain("news.adobe.com") is True
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import csv
+import json
+import logging
+
+from domain_candidates import collect_domain_stats, select_candidates
+from fakes import DummyRunLogger
+from policy_engine import DomainCacheStore
+from sqlite_cache import CacheDatabase, SqliteSenderCacheStore, read_sender_items
+
+
+def _write_log(path, rows, email_datum: str = ""):
+    with path.open("w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["log_datum", "email_datum", "categorie", "afzender", "onderwerp", "bron"])
+        for categorie, afzender, bron in rows:
+            writer.writerow(["2026-01-01 10:00:00", email_datum, categorie, afzender, "x", bron])
+
+
+def test_domain_candidates_from_logs_and_sender_cache(tmp_path):
+    log_file = tmp_path / "log_2026-01-01.csv"
+    _write_log(
+        log_file,
+        [("updates", f"news{i}@mail.shop.nl", "llm") for i in range(4)]
+        + [("updates", "news0@mail.shop.nl", "exact_cache"), ("onbekend", "x@mail.shop.nl", "onbekend")]
+        + [("persoonlijk_important", f"p{i}@friends.nl", "llm") for i in range(6)]
+        + [("updates", f"a{i}@mixed.nl", "llm") for i in range(5)]
+        + [("promotions", "b@mixed.nl", "llm")]
+        + [("spam", f"s{i}@casino-xyz.com", "guardrail:gambling") for i in range(5)]
+        + [("purchases", f"o{i}@known.nl", "llm") for i in range(5)],
+    )
+    sender_items = [
+        ("extra@mail.shop.nl", {"categorie": "updates"}),
+        ("news1@mail.shop.nl", {"categorie": "promotions"}),
+    ]
+    domain_file = tmp_path / "domain_cache.json"
+    domain_file.write_text(json.dumps({"known.nl": {"spam": False, "category": "purchases"}}), encoding="utf-8")
+
+    stats = collect_domain_stats(sender_items, [log_file])
+    candidates = select_candidates(stats, DomainCacheStore(domain_file))
+
+    assert list(candidates) == ["mail.shop.nl", "casino-xyz.com"]
+    assert candidates["mail.shop.nl"] == {
+        "spam": False,
+        "category": "updates",
+        "mails": 6,
+        "share": 1.0,
+        "llm_calls_saved": 4,
+    }
+    assert candidates["casino-xyz.com"]["spam"] is True
+    assert candidates["casino-xyz.com"]["category"] is None
+    assert stats["mixed.nl"].total == 6
+
+
+def test_overlapping_runs_count_each_mail_once(tmp_path):
+    rows = [("updates", f"news{i}@shop.nl", "llm") for i in range(5)]
+    first, second = tmp_path / "log_2026-01-01.csv", tmp_path / "log_2026-01-02.csv"
+    _write_log(first, rows, email_datum="2026-01-01 09:00:00")
+    _write_log(second, rows, email_datum="2026-01-01 09:00:00")
+
+    stats = collect_domain_stats([], [first, second])
+
+    assert stats["shop.nl"].total == 5
+    assert stats["shop.nl"].llm_mails == 5
+
+
+def test_candidate_report_reads_caches_without_touching_them(tmp_path):
+    legacy_json = tmp_path / "sender_exact.json"
+    legacy_json.write_text(json.dumps({"A@Shop.nl": "updates"}), encoding="utf-8")
+    assert read_sender_items(None, legacy_json) == [("a@shop.nl", {"categorie": "updates", "subject": "(onbekend)"})]
+    assert json.loads(legacy_json.read_text(encoding="utf-8")) == {"A@Shop.nl": "updates"}
+
+    db_file = tmp_path / "caches.sqlite3"
+    db = CacheDatabase(db_file)
+    store = SqliteSenderCacheStore(db, tmp_path / "none.json", logger=logging.getLogger("test"), run_logger=DummyRunLogger())
+    store.update("b@shop.nl", "orders", "Order 1")
+    store.save()
+    db.close()
+    before = db_file.read_bytes()
+    assert read_sender_items(db_file, legacy_json) == [("b@shop.nl", {"categorie": "orders", "subject": "Order 1"})]
+    assert db_file.read_bytes() == before
+
+    missing = tmp_path / "nieuw" / "domain_cache.json"
+    assert DomainCacheStore(missing, read_only=True).lookup("shop.nl") is None
+    assert not missing.parent.exists()
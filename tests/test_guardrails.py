@@ -1,6 +1,9 @@
 from __future__ import annotations
 
-from policy_engine import is_obvious_spam
+import json
+
+from guardrails import load_guardrails
+from policy_engine import guardrail_rule, is_obvious_spam
 
 
 def test_guardrail_gambling_keyword_triggers():
@@ -24,3 +27,30 @@ def test_guardrail_receipt_plus_rare_domain_triggers():
 def test_guardrail_legitimate_message_not_triggered():
     body = "Your package is onderweg. Bekijk de tracking in je account."
     assert is_obvious_spam("bol.com", "Bestelling update", body, ["https://bol.com/track"]) is False
+
+
+def test_guardrail_reports_rule_name():
+    assert guardrail_rule("random-domain.com", "Huge Jackpot Today", "", []) == "gambling"
+    body = "Payment completed. Keep your document pdf token for bookkeeping."
+    assert guardrail_rule("invoice-9988777-xz.com", "Receipt", body, []) == "receipt_rare_domain"
+    assert guardrail_rule("bol.com", "Receipt", body, ["https://bol.com"]) is None
+
+
+def test_guardrail_rules_load_from_versioned_file(tmp_path):
+    rules_file = tmp_path / "guardrail_rules.json"
+    rules_file.write_text(
+        json.dumps(
+            {
+                "version": 7,
+                "common_domains": [],
+                "rules": [{"name": "lottery", "conditions": [{"terms": ["loterij"]}, {"regex": r"\bwinnaar\b"}]}],
+            }
+        ),
+        encoding="utf-8",
+    )
+    engine = load_guardrails(rules_file)
+
+    assert engine.version == 7
+    assert engine.match("x.nl", "Loterij", "U bent winnaar!", []) == "lottery"
+    assert engine.match("x.nl", "Loterij", "winnaars lijst", []) is None
+    assert guardrail_rule("x.nl", "Casino", "", [], rules_file=rules_file) is None
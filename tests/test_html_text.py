@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import re
+
+from bs4 import BeautifulSoup
+
+import html_text
+from html_text import stream_html_text
+from message_features import _soup_text
+
+
+NEWSLETTER = """<!DOCTYPE html><html><head><meta charset="utf-8"><title>Nieuwsbrief</title>
+<style>.btn{color:red}</style></head><body>
+<table><tr><td><img src="logo.png"/><h1>Week&nbsp;12 aanbiedingen</h1></td></tr>
+<tr><td><p>Beste klant,<br>bekijk <a href="https://shop.nl/sale">onze   sale</a> &amp; bespaar.</p>
+<script>var x = "geen tekst";</script><!-- commentaar --><p>Tot ziens</p></td></tr></table></body></html>"""
+
+
+def _soup_reference(html: str, max_chars: int) -> str:
+    soup = BeautifulSoup(html, "html.parser")
+    for node in soup(("script", "style", "title")):
+        node.extract()
+    return re.sub(r"\s+", " ", soup.get_text(" ")).strip()[:max_chars]
+
+
+def test_stream_extractor_matches_beautifulsoup_text():
+    assert stream_html_text(NEWSLETTER, 500) == _soup_reference(NEWSLETTER, 500)
+    assert stream_html_text(NEWSLETTER, 500).startswith("Week 12 aanbiedingen Beste klant, bekijk onze sale & bespaar.")
+
+
+def test_stream_extractor_stops_after_max_chars(monkeypatch):
+    fed = []
+    original_feed = html_text._VisibleTextParser.feed
+
+    def counting_feed(self, data):
+        fed.append(len(data))
+        return original_feed(self, data)
+
+    monkeypatch.setattr(html_text._VisibleTextParser, "feed", counting_feed)
+    html = "<div>" + "<p>aanbieding van de week</p>" * 20000 + "</div>"
+
+    assert stream_html_text(html, 40) == _soup_reference(html, 40)
+    assert sum(fed) < len(html) // 10
+
+
+def test_stream_extractor_joins_words_split_across_chunks(monkeypatch):
+    monkeypatch.setattr(html_text, "FEED_CHUNK_CHARS", 5)
+    assert stream_html_text("<p>nieuwsbrief&amp;acties</p><b>nu</b>", 250) == "nieuwsbrief&acties nu"
+
+
+def test_missing_head_end_tag_keeps_body_text():
+    html = "<html><head><title>Nieuwsbrief</title><style>p{}</style><body><p>Hallo</p></body></html>"
+    assert stream_html_text(html, 250) == "Hallo"
+    assert _soup_text(html).strip() == "Hallo"
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import logging
+from types import SimpleNamespace
+
+from imap_mover import CategoryMover
+
+
+class DummyRunLogger:
+    def event(self, _context: str, _message: str) -> None:
+        return
+
+
+class FakeClient:
+    def __init__(self, capabilities, reject_prefix: str = "") -> None:
+        self.capabilities = capabilities
+        self.reject_prefix = reject_prefix
+        self.commands = []
+
+    def uid(self, command, *args):
+        self.commands.append((command, *args))
+        if command in ("MOVE", "COPY") and self.reject_prefix and not args[1].strip(b'"').startswith(self.reject_prefix.encode()):
+            return "NO", [b"Client tried to access nonexistent namespace"]
+        return "OK", [None]
+
+    def expunge(self):
+        self.commands.append(("EXPUNGE",))
+        return "OK", [None]
+
+
+class FakeFolders:
+    def __init__(self) -> None:
+        self.list_calls = 0
+
+    def list(self, _folder, _pattern):
+        self.list_calls += 1
+        return [SimpleNamespace(delim=".")]
+
+    def exists(self, _folder) -> bool:
+        return True
+
+
+def _mover(client) -> CategoryMover:
+    box = SimpleNamespace(client=client, folder=FakeFolders())
+    settings = SimpleNamespace(imap_move_by_category=True, imap_category_prefix="AI/")
+    return CategoryMover(box, settings, logging.getLogger("test"), DummyRunLogger())
+
+
+def test_moves_are_grouped_per_folder_with_one_uid_move_each():
+    client = FakeClient(("IMAP4REV1", "MOVE"))
+    mover = _mover(client)
+
+    mover.move_batch([("1", "updates"), ("2", "spam"), ("3", "updates"), ("4", "updates")])
+    mover.move_batch([("9", "spam")])
+
+    assert client.commands == [
+        ("MOVE", "1,3:4", b'"AI.updates"'),
+        ("MOVE", "2", b'"AI.spam"'),
+        ("MOVE", "9", b'"AI.spam"'),
+    ]
+    assert mover.box.folder.list_calls == 1
+
+
+def test_without_move_capability_uses_copy_store_uid_expunge():
+    client = FakeClient(("IMAP4REV1", "UIDPLUS"))
+    mover = _mover(client)
+
+    mover.move_batch([("5", "social"), ("6", "social")])
+
+    assert [cmd[0] for cmd in client.commands] == ["COPY", "STORE", "EXPUNGE"]
+    assert client.commands[2] == ("EXPUNGE", "5:6")
+
+
+def test_batched_move_retries_with_inbox_prefix():
+    client = FakeClient(("IMAP4REV1", "MOVE"), reject_prefix="INBOX")
+    mover = _mover(client)
+
+    mover.move_batch([("7", "purchases"), ("8", "purchases")])
+
+    assert client.commands[-1] == ("MOVE", "7:8", b'"INBOX.AI.purchases"')
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import json
+
+from cache_store import ImapWatermarkStore
+
+
+class DummyRunLogger:
+    def __init__(self) -> None:
+        self.events = []
+
+    def event(self, context: str, message: str) -> None:
+        self.events.append((context, message))
+
+
+def test_watermark_advances_and_persists(tmp_path):
+    cache_file = tmp_path / "imap_watermark.json"
+    store = ImapWatermarkStore(cache_file)
+    assert store.last_uid("INBOX", 77) is None
+
+    store.advance("INBOX", 77, 120)
+    store.advance("INBOX", 77, 90)
+    store.save()
+
+    reloaded = ImapWatermarkStore(cache_file)
+    assert reloaded.last_uid("INBOX", 77) == 120
+    assert json.loads(cache_file.read_text(encoding="utf-8"))["INBOX"] == {"uidvalidity": 77, "last_uid": 120}
+
+
+def test_watermark_uidvalidity_change_forces_full_scan(tmp_path):
+    cache_file = tmp_path / "imap_watermark.json"
+    cache_file.write_text(json.dumps({"INBOX": {"uidvalidity": 1, "last_uid": 500}}), encoding="utf-8")
+    run_logger = DummyRunLogger()
+    store = ImapWatermarkStore(cache_file, run_logger=run_logger)
+
+    assert store.last_uid("INBOX", 2) is None
+    assert run_logger.events[0][0] == "watermark_reset"
+
+    store.advance("INBOX", 2, 12)
+    assert store.last_uid("INBOX", 2) == 12
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+from llm_dispatch import (
+    CircuitBreaker,
+    TokenBucketLimiter,
+    TokenBudgetBatcher,
+    backoff_delay,
+    coalesce_items,
+    retry_after_seconds,
+)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_enforces_requests_per_minute():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(requests_per_minute=2, tokens_per_minute=0, clock=clock, sleep=clock.sleep)
+
+    limiter.acquire(100)
+    limiter.acquire(100)
+    limiter.acquire(100)
+
+    assert clock.sleeps == [30.0]
+
+
+def test_token_bucket_enforces_tokens_per_minute_and_block_for():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(requests_per_minute=0, tokens_per_minute=600, clock=clock, sleep=clock.sleep)
+
+    limiter.acquire(600)
+    limiter.acquire(300)
+    assert clock.sleeps == [30.0]
+
+    limiter.block_for(5)
+    limiter.acquire(1)
+    assert clock.sleeps[1] == 5.0
+
+
+def test_retry_after_header_is_honoured():
+    exc = SimpleNamespace(response=SimpleNamespace(headers={"retry-after": "7"}))
+    assert retry_after_seconds(exc, default=1.0) == 7.0
+    assert retry_after_seconds(RuntimeError("x"), default=2.0) == 2.0
+
+
+class FakeFeatures:
+    def __init__(self, uid: str, size: int) -> None:
+        self.uid = uid
+        self.size = size
+
+    def to_payload(self, index: int) -> dict:
+        return {"index": index, "body_snippet": "x" * self.size}
+
+
+def _state(*sizes):
+    return SimpleNamespace(unknown_items=[(pos, FakeFeatures(f"{pos}", size), False) for pos, size in enumerate(sizes)])
+
+
+def test_token_budget_batcher_packs_across_states_and_completes_in_order():
+    batcher = TokenBudgetBatcher(budget_tokens=130, max_wait=5.0, overhead_tokens=10, max_mails=100)
+    first, empty, second = _state(120, 120), _state(), _state(120)
+    batcher.add(first, now=0.0)
+    batcher.add(empty, now=0.0)
+    assert batcher.pop_completed() == []
+    assert batcher.ready(now=1.0) is False
+    assert batcher.wait_timeout(now=1.0) == 4.0
+
+    batcher.add(second, now=1.0)
+    assert batcher.ready(now=1.0) is True
+    request = batcher.take()
+    assert [(entry.state, idx) for entry, idx, _features in request] == [(first, 0), (first, 1)]
+
+    rest = batcher.take()
+    assert batcher.deliver(rest, {0: "updates"}) == []
+    completed = batcher.deliver(request, {0: "orders", 1: "spam"})
+    assert completed == [(first, {0: "orders", 1: "spam"}), (empty, {}), (second, {0: "updates"})]
+
+
+def test_token_budget_batcher_without_budget_sends_one_request_per_state():
+    batcher = TokenBudgetBatcher(budget_tokens=0, max_wait=5.0, overhead_tokens=10, max_mails=2)
+    first, second = _state(10, 10, 10), _state(10)
+    batcher.add(first, now=0.0)
+    batcher.add(second, now=0.0)
+
+    assert batcher.ready(now=0.0) is True
+    assert batcher.wait_timeout(now=0.0) is None
+    assert [len(batcher.take()) for _ in range(3)] == [2, 1, 1]
+
+
+def test_circuit_breaker_opens_after_consecutive_failures_and_allows_trial_after_reset():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60, clock=clock)
+
+    assert breaker.record_failure() is False
+    assert breaker.allow()
+    assert breaker.record_failure() is True
+    assert not breaker.allow()
+
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.record_failure() is False
+
+
+def test_backoff_delay_is_jittered_and_capped():
+    assert backoff_delay(0, base=1.0, cap=30.0, rand=lambda: 1.0) == 1.0
+    assert backoff_delay(3, base=1.0, cap=30.0, rand=lambda: 0.5) == 4.0
+    assert backoff_delay(10, base=1.0, cap=30.0, rand=lambda: 1.0) == 30.0
+
+
+def _mail(sender: str, subject: str):
+    return SimpleNamespace(sender=sender, subject=subject, to_payload=lambda index: {"index": index})
+
+
+def test_coalesce_items_groups_by_sender_and_subject_template():
+    mails = [
+        _mail("news@shop.nl", "Bestelling 1234 verzonden"),
+        _mail("news@shop.nl", "Bestelling 9876 verzonden"),
+        _mail("news@shop.nl", "Nieuwe aanbiedingen"),
+        _mail("", "Bestelling 1234 verzonden"),
+        _mail("", "Bestelling 1234 verzonden"),
+    ]
+
+    assert coalesce_items(mails) == ([0, 2, 3, 4], [[0, 1], [2], [3], [4]])
+
+
+def test_batcher_lets_later_states_wait_on_an_in_flight_verdict():
+    batcher = TokenBudgetBatcher(budget_tokens=0, max_wait=5.0, overhead_tokens=10, max_mails=100, coalesce=True)
+    first = SimpleNamespace(unknown_items=[(0, _mail("a@shop.nl", "Order 1"), False)], coalesced=set())
+    second = SimpleNamespace(
+        unknown_items=[(0, _mail("a@shop.nl", "Order 2"), False), (1, _mail("b@shop.nl", "Hoi"), False)],
+        coalesced=set(),
+    )
+    batcher.add(first, now=0.0)
+    request = batcher.take()
+    batcher.add(second, now=0.0)
+
+    rest = batcher.take()
+    assert [features.sender for _entry, _idx, features in rest] == ["b@shop.nl"]
+    assert batcher.coalesced == 1
+    assert first.coalesced == set() and second.coalesced == {0}
+    assert batcher.deliver(rest, {0: "social"}) == []
+    completed = batcher.deliver(request, {0: "purchases"})
+    assert completed == [(first, {0: "purchases"}), (second, {0: "purchases", 1: "social"})]
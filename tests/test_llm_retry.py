@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+from openai import APIConnectionError
+
+from cache_store import ImapWatermarkStore
+from classifier import EmailClassifier
+from llm_dispatch import DEFERRED
+from message_features import MessageFeatures
+
+
+class DummyRunLogger:
+    def __init__(self) -> None:
+        self.events = []
+
+    def event(self, context: str, message: str) -> None:
+        self.events.append((context, message))
+
+    def gpt_payload(self, _prompt_json: str, _final_user_prompt: str) -> None:
+        return
+
+
+class FakeCompletions:
+    def __init__(self, replies) -> None:
+        self.replies = list(replies)
+        self.prompts = []
+
+    def create(self, model, messages, stream=False, stream_options=None):
+        self.prompts.append(messages[1]["content"])
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        if stream:
+            return self._chunks(reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+    def _chunks(self, reply: str):
+        for start in range(0, len(reply), 7):
+            self.prompts.append(f"chunk {start}")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=reply[start : start + 7]))])
+
+
+def _classifier(tmp_path, replies, stream: bool = False, api_key: str = "") -> EmailClassifier:
+    system_prompt = tmp_path / "system.txt"
+    system_prompt.write_text("Toegestane categorieën (exact):\nspam\nupdates\nsocial\n\nRest", encoding="utf-8")
+    classify_prompt = tmp_path / "classify.txt"
+    classify_prompt.write_text("{emails_json}", encoding="utf-8")
+    settings = SimpleNamespace(
+        system_prompt_file=system_prompt,
+        classify_prompt_file=classify_prompt,
+        openai_api_key=api_key,
+        gpt_model="test",
+        llm_rpm=0,
+        llm_tpm=0,
+        llm_rate_limit_retries=0,
+        llm_retry_attempts=2,
+        llm_retry_base_seconds=0.0,
+        llm_retry_max_seconds=0.0,
+        llm_breaker_failures=2,
+        llm_breaker_reset_seconds=300.0,
+        llm_payload_format="json",
+        llm_stream=stream,
+        max_body_chars=250,
+    )
+    classifier = EmailClassifier(settings, logging.getLogger("test"), DummyRunLogger())
+    if replies is not None:
+        classifier.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(replies)))
+    return classifier
+
+
+def _mails(count: int) -> list[MessageFeatures]:
+    return [
+        MessageFeatures(
+            uid=str(uid),
+            subject=f"mail {uid}",
+            from_=f"a{uid}@shop.nl",
+            to=(),
+            cc=(),
+            date=None,
+            sender=f"a{uid}@shop.nl",
+            domain="shop.nl",
+            snippet="",
+            urls=[],
+            url_domains=set(),
+            headers={},
+        )
+        for uid in range(count)
+    ]
+
+
+def test_only_missing_and_invalid_indices_are_asked_again(tmp_path):
+    classifier = _classifier(
+        tmp_path,
+        [
+            "index=0; categorie=updates\nindex=1; categorie=nieuwsbrief",
+            "index=0; categorie=social\nindex=1; categorie=spam",
+        ],
+    )
+
+    results = classifier.batch_classify(_mails(3))
+
+    assert results == {0: "updates", 1: "social", 2: "spam"}
+    retry_prompt = classifier.client.chat.completions.prompts[1]
+    assert "mail 1" in retry_prompt and "mail 2" in retry_prompt and "mail 0" not in retry_prompt
+
+
+def test_garbled_answers_end_as_onbekend_but_failing_endpoint_defers(tmp_path):
+    classifier = _classifier(tmp_path, ["index=0; categorie=updates"] + ["rommel"] * 2)
+    assert classifier.batch_classify(_mails(2)) == {0: "updates"}
+
+    unreachable = APIConnectionError(request=None)
+    classifier = _classifier(tmp_path, [unreachable] * 3)
+    assert classifier.batch_classify(_mails(2)) == {0: DEFERRED, 1: DEFERRED}
+    # De breaker staat open: de volgende batch wordt direct uitgesteld zonder API-call.
+    assert classifier.batch_classify(_mails(1)) == {0: DEFERRED}
+    assert len(classifier.client.chat.completions.replies) == 1
+
+
+def test_streaming_hands_each_verdict_over_before_the_answer_is_complete(tmp_path):
+    classifier = _classifier(tmp_path, ["index=0; categorie=updates\nindex=1; categorie=spam"], stream=True)
+    prompts = classifier.client.chat.completions.prompts
+    seen = []
+
+    results = classifier.batch_classify(_mails(2), on_result=lambda idx, cat: seen.append((idx, cat, len(prompts))))
+
+    assert results == {0: "updates", 1: "spam"}
+    assert [(idx, cat) for idx, cat, _ in seen] == [(0, "updates"), (1, "spam")]
+    # Het eerste oordeel komt binnen terwijl er nog chunks volgen.
+    assert seen[0][2] < len(prompts)
+
+
+def test_local_errors_propagate_without_deferring_or_tripping_the_breaker(tmp_path):
+    classifier = _classifier(tmp_path, ["index=0; categorie=updates"] * 3, stream=True)
+
+    def broken_mover(_idx, _category):
+        raise OSError("IMAP move mislukt")
+
+    for _ in range(3):
+        with pytest.raises(OSError):
+            classifier.batch_classify(_mails(1), on_result=broken_mover)
+    assert classifier.circuit_breaker.allow()
+    assert not any(context == "gpt_exception" for context, _ in classifier.run_logger.events)
+
+
+def test_openai_client_leaves_retries_to_the_classifier(tmp_path):
+    classifier = _classifier(tmp_path, None, api_key="sk-test")
+
+    assert classifier.client.max_retries == 0
+
+
+class UnavailableHandler(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_POST(self) -> None:
+        type(self).requests += 1
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        body = b'{"error": {"message": "overbelast", "type": "server_error"}}'
+        self.send_response(503)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args) -> None:
+        return
+
+
+def test_breaker_counts_single_http_calls_with_the_real_client(tmp_path):
+    UnavailableHandler.requests = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UnavailableHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        classifier = _classifier(tmp_path, None, api_key="sk-test")
+        # Zelfde client-configuratie als in productie, alleen naar een lokale server die 503 geeft.
+        classifier.client = classifier.client.with_options(base_url=f"http://127.0.0.1:{server.server_port}/v1")
+
+        assert classifier.batch_classify(_mails(2)) == {0: DEFERRED, 1: DEFERRED}
+        # LLM_BREAKER_FAILURES=2: twee HTTP-calls, daarna staat de breaker open; geen verborgen SDK-retries.
+        assert UnavailableHandler.requests == 2
+        assert classifier.batch_classify(_mails(1)) == {0: DEFERRED}
+        assert UnavailableHandler.requests == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_watermark_keeps_deferred_uids_until_resolved(tmp_path):
+    cache_file = tmp_path / "imap_watermark.json"
+    store = ImapWatermarkStore(cache_file)
+    store.advance("INBOX", 7, 50)
+    store.defer("INBOX", 7, ["41", "45"])
+    store.save()
+
+    reloaded = ImapWatermarkStore(cache_file)
+    assert reloaded.deferred_uids("INBOX", 7) == [41, 45]
+    assert reloaded.deferred_uids("INBOX", 8) == []
+
+    reloaded.resolve_deferred("INBOX", 7, ["41", "45"])
+    reloaded.save()
+    assert ImapWatermarkStore(cache_file)._data["INBOX"] == {"uidvalidity": 7, "last_uid": 50}
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import csv
+import logging
+import os
+from types import SimpleNamespace
+
+from fakes import DummyRunLogger
+from local_model import LocalModel, load_or_train, read_training_rows
+from processing import BatchState, _verdict_result, finalize_mail
+
+
+def _write_log(path, rows):
+    with path.open("w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["log_datum", "email_datum", "categorie", "afzender", "onderwerp", "bron"])
+        for categorie, afzender, onderwerp, bron in rows:
+            writer.writerow(["2026-01-01 10:00:00", "", categorie, afzender, onderwerp, bron])
+
+
+def _rows():
+    rows = []
+    for i in range(40):
+        rows.append(("purchases", f"shop{i % 3}@bol.com", f"Je bestelling {1000 + i} is verzonden", "llm"))
+        rows.append(("updates", "digest@news.github.com", f"Weekly digest {i} jan", "exact_cache"))
+    rows.append(("updates", "x@bol.com", "Iets lokaals", "local_model"))
+    rows.append(("onbekend", "y@bol.com", "Geen oordeel", "onbekend"))
+    return rows
+
+
+def test_local_model_trains_from_logs_and_gates_on_confidence(tmp_path):
+    log_file = tmp_path / "log_2026-01-01.csv"
+    _write_log(log_file, _rows())
+    rows = read_training_rows([log_file])
+    assert len(rows) == 80
+
+    model = LocalModel.train(rows)
+    features = [
+        SimpleNamespace(domain="bol.com", subject="Je bestelling 55555 is verzonden"),
+        SimpleNamespace(domain="news.github.com", subject="Weekly digest 3 feb"),
+        SimpleNamespace(domain="unknown.org", subject="Hallo"),
+    ]
+
+    assert model.classify(features, threshold=0.9) == ["purchases", "updates", None]
+    assert (model.seen, model.answered) == (3, 2)
+    assert "2/3 lokaal" in model.summary()
+
+
+def test_local_model_is_persisted_and_reused(tmp_path):
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    _write_log(log_dir / "log_2026-01-01.csv", _rows())
+    settings = SimpleNamespace(
+        log_dir=log_dir,
+        local_model_file=tmp_path / "cache" / "local_model.npz",
+        local_model_min_rows=10,
+        local_model_retrain_hours=24,
+    )
+    run_logger = DummyRunLogger()
+
+    trained = load_or_train(settings, logging.getLogger("test"), run_logger)
+    reloaded = load_or_train(settings, logging.getLogger("test"), run_logger)
+
+    assert [context for context, _ in run_logger.events] == ["local_model_trained"]
+    assert reloaded.classes == trained.classes == ["purchases", "updates"]
+    assert reloaded.predict("bol.com", "Je bestelling 1 is verzonden")[0] == "purchases"
+
+    too_few = SimpleNamespace(
+        log_dir=log_dir, local_model_file=tmp_path / "none.npz", local_model_min_rows=1000, local_model_retrain_hours=24
+    )
+    assert load_or_train(too_few, logging.getLogger("test"), run_logger) is None
+
+
+def test_local_model_retrains_only_after_interval_and_recovers_from_corrupt_file(tmp_path):
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    _write_log(log_dir / "log_2026-01-01.csv", _rows())
+    settings = SimpleNamespace(
+        log_dir=log_dir,
+        local_model_file=tmp_path / "local_model.npz",
+        local_model_min_rows=10,
+        local_model_retrain_hours=24,
+    )
+    run_logger = DummyRunLogger()
+    load_or_train(settings, logging.getLogger("test"), run_logger)
+
+    newer_log = log_dir / "log_2026-01-02.csv"
+    _write_log(newer_log, _rows())
+    later = settings.local_model_file.stat().st_mtime + 60
+    os.utime(newer_log, (later, later))
+    load_or_train(settings, logging.getLogger("test"), run_logger)
+    assert [context for context, _ in run_logger.events] == ["local_model_trained"]
+
+    settings.local_model_retrain_hours = 0
+    load_or_train(settings, logging.getLogger("test"), run_logger)
+    assert [context for context, _ in run_logger.events] == ["local_model_trained", "local_model_trained"]
+
+    settings.local_model_file.write_bytes(b"geen npz")
+    model = load_or_train(settings, logging.getLogger("test"), run_logger)
+    assert model is not None and model.classes == ["purchases", "updates"]
+    assert [context for context, _ in run_logger.events][-2:] == ["local_model_unreadable", "local_model_trained"]
+
+
+class RecordingCache:
+    def __init__(self) -> None:
+        self.calls = []
+
+    def update(self, *args) -> None:
+        self.calls.append(args)
+
+    def increment_spam_hit(self, *args) -> int:
+        self.calls.append(args)
+        return 1
+
+
+def test_local_model_verdicts_do_not_feed_exact_or_spam_cache():
+    features = [
+        SimpleNamespace(uid=str(pos), sender="shop@bol.com", subject=f"Mail {pos}", date=None, headers={})
+        for pos in range(2)
+    ]
+    state = BatchState(batch=features)
+    state.final_results[0] = _verdict_result("purchases", "local_model", features[0], False)
+    state.final_results[1] = _verdict_result("spam", "local_model", features[1], False)
+    exact_cache, spam_cache = RecordingCache(), RecordingCache()
+    settings = SimpleNamespace(use_spam_sender_cache=True)
+
+    for idx in range(2):
+        finalize_mail(state, idx, exact_cache, spam_cache, settings, logging.getLogger("test"), DummyRunLogger())
+
+    assert exact_cache.calls == [] and spam_cache.calls == []
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from datetime import datetime
+
+from message_features import MessageFeatures, extract_features
+
+
+class FakeMsg:
+    uid = "42"
+    from_ = "Shop <Info@Shop.NL>"
+    to = ("me@example.com",)
+    cc = ()
+    subject = "Uw bestelling"
+    date = datetime(2026, 1, 2, 10, 0)
+    text = ""
+    html = '<div>Bekijk <a href="https://track.shop.nl/x">status</a> op https://shop.nl/a</div>'
+    headers = {
+        "authentication-results": ("mx.example.com; spf=pass smtp.mailfrom=shop.nl; dkim=fail; dmarc=pass",),
+        "list-id": ("<news.shop.nl>",),
+    }
+
+
+def test_features_are_extracted_once_into_compact_record():
+    features = extract_features(FakeMsg(), 500)
+
+    assert not hasattr(features, "__dict__")
+    assert features.uid == "42"
+    assert features.sender == "info@shop.nl"
+    assert features.domain == "shop.nl"
+    assert features.snippet == "Bekijk status op https://shop.nl/a"
+    assert sorted(features.url_domains) == ["shop.nl", "track.shop.nl"]
+    assert features.headers["spf"] == "pass"
+    assert features.headers["dkim"] == "fail"
+    assert features.headers["dmarc"] == "pass"
+    assert features.headers["list_id"] == "<news.shop.nl>"
+    assert extract_features(features, 500) is features
+
+
+def test_features_payload_matches_llm_format():
+    payload = extract_features(FakeMsg(), 500).to_payload(3)
+
+    assert payload["index"] == 3
+    assert payload["from"] == "Shop <Info@Shop.NL>"
+    assert payload["date"] == "2026-01-02T10:00:00"
+    assert payload["body_snippet"] == "Bekijk status op https://shop.nl/a"
+    assert isinstance(extract_features(FakeMsg(), 500), MessageFeatures)
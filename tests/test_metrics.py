@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import json
+from types import SimpleNamespace
+
+from metrics import Metrics
+
+
+def test_metrics_summary_and_exports(tmp_path):
+    metrics = Metrics()
+    metrics.observe("llm_request", 0.3)
+    metrics.observe("llm_request", 4.0)
+    metrics.observe("extract", 0.002)
+    metrics.count_bron("guardrail:gambling")
+    metrics.count_bron("llm")
+    metrics.count_bron("llm")
+    metrics.cache_lookup("exact_cache", True)
+    metrics.cache_lookup("exact_cache", False)
+    metrics.cache_lookup("verdict_cache", 3, lookups=4)
+    metrics.record_usage(
+        SimpleNamespace(prompt_tokens=1200, completion_tokens=40, prompt_tokens_details=SimpleNamespace(cached_tokens=1024))
+    )
+
+    snapshot = metrics.snapshot()
+    assert snapshot["stages"]["llm_request"]["count"] == 2
+    assert snapshot["stages"]["llm_request"]["p50_seconds"] == 0.5
+    assert snapshot["mails_by_bron"] == {"guardrail": 1, "llm": 2}
+    assert snapshot["cache"]["exact_cache"]["hit_ratio"] == 0.5
+    assert snapshot["cache"]["verdict_cache"]["hit_ratio"] == 0.75
+    assert snapshot["llm_tokens"] == {"cached_prompt": 1024, "completion": 40, "prompt": 1200, "requests": 1}
+    assert any("exact_cache: 1/2 hits" in line for line in metrics.summary_lines())
+
+    prom_file, json_file = metrics.export(tmp_path / "logs", "test", tmp_path / "textfile")
+    metrics.export(tmp_path / "logs", "volgende", tmp_path / "textfile")
+    assert [path.name for path in (tmp_path / "textfile").iterdir()] == ["emailsorteerder.prom"]
+    assert json_file.name == "metrics_test.json"
+    prom = prom_file.read_text(encoding="utf-8")
+    assert 'emailsorteerder_stage_seconds_bucket{stage="llm_request",le="+Inf"} 2' in prom
+    assert 'emailsorteerder_stage_seconds_bucket{stage="llm_request",le="0.25"} 0' in prom
+    assert 'emailsorteerder_mails_total{bron="llm"} 2' in prom
+    assert json.loads(json_file.read_text(encoding="utf-8"))["llm_tokens"]["prompt"] == 1200
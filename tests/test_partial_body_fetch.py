@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+from imap_reader import TextPart, _build_message, _decode_part, parse_bodystructures, select_text_part
+
+
+def test_bodystructure_prefers_plain_and_skips_attachments():
+    data = [
+        b'1 (UID 42 BODYSTRUCTURE ((("text" "plain" ("charset" "utf-8") NIL NIL "quoted-printable" 120 4 NIL NIL NIL NIL)'
+        b'("text" "html" ("charset" "utf-8") NIL NIL "base64" 4000 50 NIL NIL NIL NIL) "alternative" ("boundary" "b1") NIL NIL NIL)'
+        b'("application" "pdf" ("name" "factuur.pdf") NIL NIL "base64" 2000000 NIL ("attachment" ("filename" "factuur.pdf")) NIL NIL)'
+        b' "mixed" ("boundary" "b0") NIL NIL NIL))',
+    ]
+    structure = parse_bodystructures(data)["42"]
+
+    assert select_text_part(structure) == TextPart(section="1.1", subtype="plain", encoding="quoted-printable", charset="utf-8")
+
+
+def test_bodystructure_falls_back_to_html_and_handles_literals():
+    data = [
+        (b'2 (UID 43 BODYSTRUCTURE (("application" "pdf" ("name" {11}', b"factuur.pdf"),
+        b') NIL NIL "base64" 20 NIL ("attachment" NIL) NIL NIL)("text" "html" ("charset" "iso-8859-1") NIL NIL "7bit" 30 2 NIL NIL NIL NIL)'
+        b' "mixed" ("boundary" "x") NIL NIL NIL))',
+        b'3 (UID 44 BODYSTRUCTURE ("text" "plain" ("charset" "us-ascii") NIL NIL "7bit" 10 1 NIL NIL NIL NIL))',
+    ]
+    structures = parse_bodystructures(data)
+
+    assert select_text_part(structures["43"]).section == "2"
+    assert select_text_part(structures["43"]).subtype == "html"
+    assert select_text_part(structures["44"]).section == "1"
+
+
+def test_truncated_base64_prefix_decodes_and_builds_message():
+    part = TextPart(section="1", subtype="plain", encoding="base64", charset="utf-8")
+    text = _decode_part(b"SGFsbG8gd2VyZWxk\r\nIGRpdCBpcyBlZW4gdGVzdA", part)
+    headers = b'From: Shop <info@shop.nl>\r\nSubject: Bestelling\r\nContent-Type: multipart/mixed;\r\n boundary="b0"\r\n\r\n'
+    msg = _build_message("7", headers, text, "plain")
+
+    assert text.startswith("Hallo wereld dit is een")
+    assert msg.uid == "7"
+    assert msg.subject == "Bestelling"
+    assert msg.text == text
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+from classifier import _read_prompt, _validate_classify_prompt
+from payload_format import encode_compact_line, encode_payloads, measure
+
+
+PAYLOAD = {
+    "index": 3,
+    "subject": "Uw  bestelling\nis verzonden",
+    "from": "Shop <Info@Shop.NL>",
+    "to": ["me@example.com"],
+    "cc": [],
+    "date": "2026-01-02T10:00:00",
+    "body_snippet": "",
+    "urls": ["https://track.shop.nl/x?id=1", "https://shop.nl/a", "https://track.shop.nl/y"],
+    "headers": {
+        "spf": "pass (mx.example.com: domain of shop.nl designates 1.2.3.4)",
+        "dkim": "v=1; a=rsa-sha256; d=shop.nl; s=mail; b=abc",
+        "dmarc": "",
+        "return_path": "<bounce@mail.shop.nl>",
+        "message_id": "<123.abc@shop.nl>",
+        "list_id": "<news.shop.nl>",
+        "list_unsubscribe": "<https://shop.nl/unsubscribe?u=123456789>",
+        "precedence": "",
+        "x_mailer": "Mailer 1.0",
+        "x_spam_flag": "",
+        "x_spam_status": "",
+    },
+}
+
+
+def test_compact_line_drops_empty_fields_and_dedupes_url_domains():
+    line = encode_compact_line(PAYLOAD)
+
+    assert line.split("\t") == [
+        "3",
+        "f=info@shop.nl",
+        "s=Uw bestelling is verzonden",
+        "spf=pass",
+        "dkim=signed",
+        "rp=mail.shop.nl",
+        "mid=shop.nl",
+        "lid=news.shop.nl",
+        "lu=1",
+        "u=shop.nl,track.shop.nl",
+    ]
+
+
+def test_measure_reports_fewer_tokens_for_compact_format(tmp_path):
+    payload_file = tmp_path / "gpt_payload_test.txt"
+    payloads = [dict(PAYLOAD, index=idx) for idx in range(3)]
+    json_data = json.dumps(payloads, ensure_ascii=False)
+    payload_file.write_text(
+        f"\n=====\nGPT PAYLOAD\n=====\n\nJSON:\n{json_data}\n\nPROMPT:\nHier is de lijst e-mails in JSON:\n\n{json_data}\n\n",
+        encoding="utf-8",
+    )
+
+    stats = measure([payload_file])
+
+    assert stats["mails"] == 3
+    assert stats["compact_tokens_per_mail"] < stats["json_tokens_per_mail"] / 2
+    assert len(encode_payloads(payloads, "compact").splitlines()) == 3
+
+
+def test_classify_prompt_placeholder_must_match_payload_format(tmp_path):
+    prompts_dir = Path(__file__).resolve().parents[1] / "prompts"
+    _validate_classify_prompt(_read_prompt(prompts_dir / "classify_prompt.txt"), prompts_dir, "json")
+    _validate_classify_prompt(_read_prompt(prompts_dir / "classify_prompt_compact.txt"), prompts_dir, "compact")
+
+    custom = tmp_path / "classify.txt"
+    custom.write_text("Mails:\n{emails_json}", encoding="utf-8")
+    with pytest.raises(ValueError, match=r"LLM_PAYLOAD_FORMAT=compact"):
+        _validate_classify_prompt(_read_prompt(custom), custom, "compact")
+    with pytest.raises(ValueError, match=r"mist placeholder \{emails_json\}"):
+        _validate_classify_prompt("Geen placeholder", custom, "json")
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import logging
+import threading
+
+import pytest
+
+from fakes import DummyRunLogger, FakeClassifier, FakeMsg, FakeStore, processing_settings
+from pipeline import run_pipeline
+
+
+def _batches(count: int):
+    return [[FakeMsg(str(n * 10 + i)) for i in range(3)] for n in range(count)]
+
+
+def test_pipeline_processes_all_batches_in_order():
+    run_logger = DummyRunLogger()
+    done = []
+    store = FakeStore()
+
+    run_pipeline(
+        None,
+        iter(_batches(5)),
+        processing_settings(),
+        FakeClassifier(),
+        (store, store, store),
+        logging.getLogger("test"),
+        run_logger,
+        lambda batch: done.append(batch[0].uid),
+    )
+
+    assert done == ["0", "10", "20", "30", "40"]
+    assert len(run_logger.emails) == 15
+
+
+class FailureSignallingRunLogger(DummyRunLogger):
+    def __init__(self) -> None:
+        super().__init__()
+        self.failed = threading.Event()
+
+    def event(self, context: str, message: str) -> None:
+        super().event(context, message)
+        if context == "pipeline_error":
+            self.failed.set()
+
+
+def test_pipeline_stage_error_stops_run_and_is_raised():
+    store = FakeStore()
+    done = []
+    run_logger = FailureSignallingRunLogger()
+
+    def on_batch_done(batch) -> None:
+        # De mover blijft in batch 0 hangen tot de LLM-stage is gefaald; batch 10 staat dan al klaar en
+        # moet alsnog afgerond worden, batches na de fout niet.
+        if batch[0].uid == "0":
+            assert run_logger.failed.wait(timeout=5)
+        done.append(batch[0].uid)
+
+    with pytest.raises(RuntimeError, match="LLM stage kapot"):
+        run_pipeline(
+            None,
+            iter(_batches(6)),
+            processing_settings(),
+            FakeClassifier(fail_on_uid="20"),
+            (store, store, store),
+            logging.getLogger("test"),
+            run_logger,
+            on_batch_done,
+        )
+    assert done == ["0", "10"]
+
+
+def test_pipeline_packs_unknowns_across_batches_up_to_token_budget():
+    run_logger = DummyRunLogger()
+    done = []
+    store = FakeStore()
+    classifier = FakeClassifier()
+    settings = processing_settings()
+    settings.llm_batch_tokens = 100000
+    settings.llm_batch_max_wait = 60.0
+
+    run_pipeline(
+        None,
+        iter(_batches(5)),
+        settings,
+        classifier,
+        (store, store, store),
+        logging.getLogger("test"),
+        run_logger,
+        lambda batch: done.append(batch[0].uid),
+    )
+
+    assert classifier.batch_sizes == [15]
+    assert done == ["0", "10", "20", "30", "40"]
+    assert len(run_logger.emails) == 15
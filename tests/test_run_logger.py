@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import csv
+from types import SimpleNamespace
+
+from logging_setup import RunLogger
+
+
+def _settings(tmp_path, **overrides):
+    values = dict(
+        log_dir=tmp_path,
+        runstamp="test",
+        log_gpt_payload=True,
+        log_flush_bytes=1 << 20,
+        log_flush_seconds=3600.0,
+        log_writer_thread=False,
+    )
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+
+def _rows(path):
+    with path.open("r", encoding="utf-8", newline="") as f:
+        return list(csv.reader(f, delimiter=";"))
+
+
+def test_rows_are_buffered_until_flush_and_header_is_written_once(tmp_path):
+    run_logger = RunLogger(_settings(tmp_path))
+    run_logger.email(None, "updates", "a@shop.nl", "Hoi; daar", "llm")
+    run_logger.event("gpt_call", "Batch size=1")
+    assert not run_logger.csv_file.exists()
+
+    run_logger.close()
+    with RunLogger(_settings(tmp_path)) as second:
+        second.email(None, "spam", "b@shop.nl", "Win", "guardrail:gambling")
+
+    rows = _rows(run_logger.csv_file)
+    assert rows[0] == ["log_datum", "email_datum", "categorie", "afzender", "onderwerp", "bron"]
+    assert [row[2:] for row in rows[1:]] == [
+        ["updates", "a@shop.nl", "Hoi; daar", "llm"],
+        ["spam", "b@shop.nl", "Win", "guardrail:gambling"],
+    ]
+    assert _rows(run_logger.err_file)[1][1:] == ["gpt_call", "Batch size=1"]
+
+
+def test_size_threshold_and_writer_thread_flush(tmp_path):
+    run_logger = RunLogger(_settings(tmp_path, log_flush_bytes=1, log_writer_thread=True))
+    run_logger.gpt_payload('[{"index": 0}]', "prompt")
+    run_logger.flush()
+
+    text = run_logger.gpt_payload_file.read_text(encoding="utf-8")
+    assert 'JSON:\n[{"index": 0}]\n\nPROMPT:\nprompt' in text
+
+    run_logger.close()
+    run_logger.event("na_close", "direct geschreven")
+    assert _rows(run_logger.err_file)[-1][1:] == ["na_close", "direct geschreven"]
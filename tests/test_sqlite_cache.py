@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+
+from policy_engine import DomainCacheStore
+from sqlite_cache import CacheDatabase, SqliteSenderCacheStore, SqliteSpamSenderCacheStore
+
+
+class DummyRunLogger:
+    def __init__(self) -> None:
+        self.events = []
+
+    def event(self, context: str, message: str) -> None:
+        self.events.append((context, message))
+
+
+def test_sqlite_sender_cache_migrates_json_once_and_upserts_dirty_keys(tmp_path):
+    json_file = tmp_path / "sender_exact.json"
+    json_file.write_text(
+        json.dumps({"Old@Example.com": "updates", "shop@example.com": {"categorie": "orders"}}), encoding="utf-8"
+    )
+    db_file = tmp_path / "caches.sqlite3"
+    run_logger = DummyRunLogger()
+
+    store = SqliteSenderCacheStore(CacheDatabase(db_file), json_file, logging.getLogger("test"), run_logger)
+    assert store.get_category("old@example.com") == "updates"
+    assert store.get_category("unknown@example.com") is None
+    assert run_logger.events == [("cache_migrate", f"sender_exact: 2 regels uit {json_file}")]
+
+    store.update("new@example.com", "Purchases", "Factuur")
+    store.update("spam@example.com", "spam", "Bonus")
+    store.save()
+
+    json_file.write_text(json.dumps({"later@example.com": "updates"}), encoding="utf-8")
+    reopened = SqliteSenderCacheStore(CacheDatabase(db_file), json_file, logging.getLogger("test"), DummyRunLogger())
+    assert reopened.get_category("new@example.com") == "purchases"
+    assert reopened.get_category("later@example.com") is None
+    assert dict(reopened.items())["shop@example.com"] == {"categorie": "orders", "subject": "(onbekend)"}
+
+    with sqlite3.connect(db_file) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("SELECT count(*) FROM sender_exact").fetchone()[0] == 3
+
+
+def test_sqlite_spam_cache_increments_and_reconciles(tmp_path):
+    spam_json = tmp_path / "sender_spam_cache.json"
+    spam_json.write_text(
+        json.dumps(
+            {
+                "manual@example.com": {"spam_hits": 2, "manual_override": "purchases"},
+                "blocked@clean-domain.com": {"spam_hits": 4, "manual_override": None},
+                "keep@other-domain.com": {"spam_hits": 5, "manual_override": None},
+            }
+        ),
+        encoding="utf-8",
+    )
+    domain_file = tmp_path / "domain_cache.json"
+    domain_file.write_text(json.dumps({"clean-domain.com": {"spam": False, "category": None}}), encoding="utf-8")
+    db = CacheDatabase(tmp_path / "caches.sqlite3")
+    exact = SqliteSenderCacheStore(db, tmp_path / "missing.json", logging.getLogger("test"), DummyRunLogger())
+    spam = SqliteSpamSenderCacheStore(db, spam_json)
+
+    assert spam.apply_startup_reconciliation(exact, DomainCacheStore(domain_file)) == (1, 1)
+    assert exact.get_category("manual@example.com") == "purchases"
+    assert spam.eligible_spam("blocked@clean-domain.com", 1) is False
+    assert spam.eligible_spam("keep@other-domain.com", 5) is True
+
+    assert spam.increment_spam_hit("new@example.com", "Bonus") == 1
+    assert spam.increment_spam_hit("new@example.com", "Bonus 2") == 2
+    spam.save()
+    reopened = SqliteSpamSenderCacheStore(CacheDatabase(tmp_path / "caches.sqlite3"), spam_json)
+    assert reopened.eligible_spam("new@example.com", 2) is True
+    assert reopened.eligible_spam("manual@example.com", 1) is False
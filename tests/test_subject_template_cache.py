@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import json
+import logging
+
+from cache_store import SubjectTemplateCacheStore, subject_template
+from fakes import DummyRunLogger, FakeClassifier, FakeMsg, FakeStore, processing_settings
+from processing import process_batch
+
+
+def test_subject_template_masks_variable_parts():
+    assert subject_template("Your order #12345 has shipped") == subject_template("Your order #998 has shipped")
+    assert subject_template("Weekly digest 14 jan") == "weekly digest <date>"
+    assert subject_template("Factuur 2025-0098") == subject_template("Factuur 2026-0101")
+    assert subject_template('Uitnodiging van "Jan Jansen"') == "uitnodiging van <q>"
+    assert subject_template("Build a3f9c21e failed") == "build <id> failed"
+
+
+def test_subject_template_keeps_apostrophes_inside_words():
+    assert subject_template("Don't miss the update on John's order") == "don't miss the update on john's order"
+    assert subject_template("Don’t miss 'Summer Sale' for John’s order") == "don’t miss <q> for john’s order"
+
+
+def test_template_cache_answers_after_agreeing_votes(tmp_path):
+    cache_file = tmp_path / "subject_templates.json"
+    store = SubjectTemplateCacheStore(cache_file, min_votes=2)
+    store.vote("shop.nl", "Order 1 verzonden", "orders")
+    assert store.get("shop.nl", "Order 2 verzonden") is None
+    store.vote("shop.nl", "Order 3 verzonden", "orders")
+    store.save()
+
+    reloaded = SubjectTemplateCacheStore(cache_file, min_votes=2)
+    assert reloaded.get("shop.nl", "Order 4 verzonden") == "orders"
+    assert reloaded.get("other.nl", "Order 4 verzonden") is None
+
+    reloaded.vote("shop.nl", "Order 5 verzonden", "updates")
+    assert reloaded.get("shop.nl", "Order 6 verzonden") is None
+
+
+def test_process_batch_uses_template_cache_before_llm(tmp_path):
+    settings = processing_settings(use_spam_sender_cache=False)
+    classifier = FakeClassifier(category="orders")
+    template_cache = SubjectTemplateCacheStore(tmp_path / "subject_templates.json", min_votes=2)
+    run_logger = DummyRunLogger()
+    store = FakeStore()
+
+    batches = [
+        [FakeMsg("1", "Order 100 verzonden", "noreply1@shop.nl"), FakeMsg("2", "Order 101 verzonden", "noreply2@shop.nl")],
+        [FakeMsg("3", "Order 102 verzonden", "noreply3@shop.nl")],
+    ]
+    for batch in batches:
+        process_batch(
+            batch=batch,
+            box=None,
+            classifier=classifier,
+            exact_cache=store,
+            domain_cache=store,
+            spam_cache=store,
+            settings=settings,
+            logger=logging.getLogger("test"),
+            run_logger=run_logger,
+            template_cache=template_cache,
+        )
+
+    assert [features.subject for features in classifier.classified] == ["Order 100 verzonden", "Order 101 verzonden"]
+    assert [email["bron"] for email in run_logger.emails] == ["llm", "llm", "template_cache"]
+
+
+def test_coalesced_mails_count_as_one_template_vote(tmp_path):
+    settings = processing_settings(use_spam_sender_cache=False)
+    classifier = FakeClassifier(category="orders")
+    template_cache = SubjectTemplateCacheStore(tmp_path / "subject_templates.json", min_votes=3)
+    run_logger = DummyRunLogger()
+    store = FakeStore()
+
+    batches = [
+        [FakeMsg(str(uid), f"Order {uid} verzonden", sender="noreply@shop.nl") for uid in (100, 101, 102)],
+        [FakeMsg("103", "Order 103 verzonden", sender="noreply@shop.nl")],
+    ]
+    for batch in batches:
+        process_batch(
+            batch=batch,
+            box=None,
+            classifier=classifier,
+            exact_cache=store,
+            domain_cache=store,
+            spam_cache=store,
+            settings=settings,
+            logger=logging.getLogger("test"),
+            run_logger=run_logger,
+            template_cache=template_cache,
+        )
+
+    assert [features.subject for features in classifier.classified] == ["Order 100 verzonden", "Order 103 verzonden"]
+    assert [email["bron"] for email in run_logger.emails] == ["llm", "llm", "llm", "llm"]
+    saved = json.loads((tmp_path / "subject_templates.json").read_text(encoding="utf-8"))
+    assert [entry["votes"] for entry in saved.values()] == [{"orders": 2}]
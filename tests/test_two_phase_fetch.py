@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import logging
+import threading
+
+import processing
+from fakes import DummyRunLogger, FakeClassifier, FakeMsg, FakeStore, processing_settings
+from imap_reader import fetch_in_chunks, stream_uid_slices
+from processing import process_batch, resolve_batch
+
+
+def test_headers_first_fetches_bodies_only_for_cache_misses(monkeypatch):
+    requested = []
+
+    def fake_fetch_bodies(_box, uids, _logger, _run_logger):
+        requested.extend(uids)
+        return {uid: FakeMsg(uid, "Hallo", "new@example.com", body="Volledige body") for uid in uids}
+
+    monkeypatch.setattr(processing, "fetch_bodies", fake_fetch_bodies)
+    batch = [
+        FakeMsg("1", "Factuur", "known@example.com"),
+        FakeMsg("2", "Hallo", "new@example.com"),
+    ]
+    classifier = FakeClassifier()
+    settings = processing_settings(imap_headers_first=True)
+
+    process_batch(
+        batch=batch,
+        box=None,
+        classifier=classifier,
+        exact_cache=FakeStore({"known@example.com": "purchases"}),
+        domain_cache=FakeStore(),
+        spam_cache=FakeStore(),
+        settings=settings,
+        logger=logging.getLogger("test"),
+        run_logger=DummyRunLogger(),
+    )
+
+    assert requested == ["2"]
+    assert [features.snippet for features in classifier.classified] == ["Volledige body"]
+
+
+def test_box_lock_covers_only_the_body_fetch(monkeypatch):
+    box_lock = threading.Lock()
+    held = []
+
+    def fake_fetch_bodies(_box, uids, _logger, _run_logger):
+        held.append(("fetch", box_lock.locked()))
+        return {uid: FakeMsg(uid, "Hallo", "new@example.com", body="Volledige body") for uid in uids}
+
+    class LockCheckingClassifier(FakeClassifier):
+        def build_features(self, msg):
+            held.append(("extract", box_lock.locked()))
+            return super().build_features(msg)
+
+    monkeypatch.setattr(processing, "fetch_bodies", fake_fetch_bodies)
+    resolve_batch(
+        [FakeMsg("1", "Hallo", "new@example.com")],
+        None,
+        LockCheckingClassifier(),
+        FakeStore(),
+        FakeStore(),
+        FakeStore(),
+        processing_settings(imap_headers_first=True),
+        logging.getLogger("test"),
+        DummyRunLogger(),
+        box_lock=box_lock,
+    )
+
+    assert held == [("extract", False), ("fetch", True), ("extract", False)]
+
+
+class RecordingBox:
+    def __init__(self) -> None:
+        self.fetch_kwargs = []
+
+    def fetch(self, *_args, **kwargs):
+        self.fetch_kwargs.append(kwargs)
+        return []
+
+
+def test_headers_first_marks_mails_seen_like_the_full_fetch():
+    box = RecordingBox()
+    list(fetch_in_chunks(box, "2026-01-01", "2026-01-02", 1, logging.getLogger("test"), DummyRunLogger(), headers_only=True))
+    list(stream_uid_slices(box, ["1", "2"], 10, 0, logging.getLogger("test"), DummyRunLogger(), headers_only=True))
+
+    assert [kwargs.get("headers_only") for kwargs in box.fetch_kwargs] == [True, True]
+    assert all(kwargs.get("mark_seen", True) for kwargs in box.fetch_kwargs)
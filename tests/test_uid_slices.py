@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+from imap_reader import plan_uid_slices, uid_sequence_set
+from main import _iter_batches
+
+
+def test_uid_slices_bounded_by_count():
+    uids = [str(n) for n in range(1, 8)]
+
+    slices = list(plan_uid_slices(uids, {}, slice_size=3, max_bytes=0))
+
+    assert slices == [["1", "2", "3"], ["4", "5", "6"], ["7"]]
+
+
+def test_uid_slices_bounded_by_bytes_and_oversized_message_gets_own_slice():
+    uids = ["10", "11", "12", "13"]
+    sizes = {"10": 400, "11": 500, "12": 5000, "13": 100}
+
+    slices = list(plan_uid_slices(uids, sizes, slice_size=10, max_bytes=1000))
+
+    assert slices == [["10", "11"], ["12"], ["13"]]
+
+
+def test_byte_limited_slices_are_merged_back_into_full_batches():
+    slices = [["1", "2"], ["3"], ["4", "5", "6", "7"], ["8"]]
+
+    assert list(_iter_batches(slices, batch_size=3)) == [["1", "2", "3"], ["4", "5", "6"], ["7", "8"]]
+
+
+def test_uid_sequence_set_compresses_ranges():
+    assert uid_sequence_set(["7", "3", "4", "5", "9", "10"]) == "3:5,7,9:10"
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from cache_store import VerdictCacheStore, payload_fingerprint, verdict_namespace
+
+
+class DummyRunLogger:
+    def __init__(self) -> None:
+        self.events = []
+
+    def event(self, context: str, message: str) -> None:
+        self.events.append((context, message))
+
+
+def _payload(index: int, **overrides) -> dict:
+    payload = {
+        "index": index,
+        "subject": "Uw  bestelling is verzonden",
+        "from": "Shop <noreply@shop.nl>",
+        "to": f"user{index}@example.com",
+        "cc": "",
+        "date": f"2026-01-0{index + 1}T10:00:00",
+        "body_snippet": "Track uw pakket",
+        "urls": ["https://shop.nl/b", "https://shop.nl/a"],
+        "headers": {"spf": "pass", "message_id": f"<{index}@shop.nl>", "list_id": ""},
+    }
+    payload.update(overrides)
+    return payload
+
+
+def test_fingerprint_ignores_per_message_fields():
+    first = payload_fingerprint(_payload(0))
+    second = payload_fingerprint(_payload(1, subject="Uw bestelling is verzonden", urls=["https://shop.nl/a", "https://shop.nl/b"]))
+    assert first == second
+    assert payload_fingerprint(_payload(0, body_snippet="Iets anders")) != first
+
+
+def test_fingerprint_ignores_per_message_header_values(tmp_path):
+    def headers(index: int) -> dict:
+        return {
+            "spf": "pass",
+            "dkim": f"v=1; a=rsa-sha256; d=shop.nl; s=mail; bh={index}abc=; b={index}xyz=",
+            "return_path": f"<bounce-{index}-user{index}=example.com@mail.shop.nl>",
+            "message_id": f"<{index}@mail.shop.nl>",
+            "x_spam_status": f"No, score=-{index}.3 required=5.0",
+        }
+
+    first = payload_fingerprint(_payload(0, headers=headers(0)))
+    store = VerdictCacheStore(tmp_path / "llm_verdicts.json", namespace="ns1", ttl_days=30, max_entries=10)
+    store.put(first, "orders")
+    assert store.get(payload_fingerprint(_payload(1, headers=headers(1)))) == "orders"
+    other_signer = dict(headers(1), dkim="v=1; a=rsa-sha256; d=phish.example; b=xyz=")
+    assert payload_fingerprint(_payload(1, headers=other_signer)) != first
+
+
+def test_verdict_cache_hit_miss_and_persist(tmp_path):
+    cache_file = tmp_path / "llm_verdicts.json"
+    store = VerdictCacheStore(cache_file, namespace="ns1", ttl_days=30, max_entries=10)
+    assert store.get("a") is None
+    store.put("a", "orders", now=1000)
+    store.save()
+
+    reloaded = VerdictCacheStore(cache_file, namespace="ns1", ttl_days=30, max_entries=10)
+    assert reloaded.get("a", now=2000) == "orders"
+
+
+def test_verdict_cache_ttl_expires(tmp_path):
+    store = VerdictCacheStore(tmp_path / "llm_verdicts.json", namespace="ns1", ttl_days=1, max_entries=10)
+    store.put("a", "orders", now=0)
+    assert store.get("a", now=86400) == "orders"
+    assert store.get("a", now=86401) is None
+
+
+def test_verdict_cache_evicts_least_recently_used(tmp_path):
+    store = VerdictCacheStore(tmp_path / "llm_verdicts.json", namespace="ns1", ttl_days=0, max_entries=2)
+    store.put("a", "orders", now=1)
+    store.put("b", "updates", now=2)
+    assert store.get("a", now=3) == "orders"
+    store.put("c", "promotions", now=4)
+
+    assert store.get("b") is None
+    assert store.get("a") == "orders"
+    assert store.get("c") == "promotions"
+
+
+def test_verdict_cache_invalidated_by_model_or_prompt_change(tmp_path):
+    cache_file = tmp_path / "llm_verdicts.json"
+    old_ns = verdict_namespace("gpt-a", "system", "classify")
+    store = VerdictCacheStore(cache_file, namespace=old_ns, ttl_days=0, max_entries=10)
+    store.put("a", "orders")
+    store.save()
+
+    assert verdict_namespace("gpt-b", "system", "classify") != old_ns
+    new_ns = verdict_namespace("gpt-a", "system", "classify v2")
+    run_logger = DummyRunLogger()
+    reloaded = VerdictCacheStore(cache_file, namespace=new_ns, ttl_days=0, max_entries=10, run_logger=run_logger)
+    assert reloaded.get("a") is None
+    assert run_logger.events[0][0] == "verdict_cache_reset"